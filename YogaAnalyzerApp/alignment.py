@@ -0,0 +1,96 @@
+"""
+Order-aware alignment of a planned routine with the detected pose segments.
+
+The planned steps and the detected segments are aligned with an edit
+distance whose costs depend on the durations:
+    matched step (same pose): relative duration error, in [0, 1]
+    missed step (planned, not detected): MISS_COST
+    extra segment (detected, not planned): EXTRA_COST
+so a planned step is only matched with a detection of the same pose, in
+routine order, and repeated poses (e.g. sun salutation flows) are matched
+with their own occurrence.
+
+The DP runs row by row over the planned steps. Within a row the chain of
+"extra" transitions is a running minimum over prefix sums, so every row is a
+few vectorized NumPy operations and the cost is O(n·m) in C, not in Python.
+"""
+import numpy as np
+
+MATCHED = "matched"
+MISSED = "missed"
+EXTRA = "extra"
+
+MISS_COST = 1.0
+EXTRA_COST = 1.0
+
+# backtrace moves
+_MATCH, _MISS, _EXTRA = 0, 1, 2
+
+
+def _match_costs(planned_class, planned_duration, detected_classes, detected_durations):
+    """
+    Cost of matching one planned step with every detected segment, inf for
+    segments of another pose.
+    """
+    longest = np.maximum(np.maximum(detected_durations, planned_duration), 1e-9)
+    costs = np.abs(detected_durations - planned_duration) / longest
+    costs[detected_classes != planned_class] = np.inf
+    return costs
+
+def align(planned_classes, planned_durations, detected_classes, detected_durations,
+          miss_cost=MISS_COST, extra_cost=EXTRA_COST):
+    """
+    Align the planned steps with the detected segments.
+    Input:
+        planned_classes, planned_durations (s): the planned steps in order
+        detected_classes, detected_durations (s): the detected segments in order
+    Output:
+        list of (kind, planned index, detected index) in order, kind being
+        MATCHED, MISSED (detected index None) or EXTRA (planned index None)
+    """
+    # compare class names as integer codes
+    names = {name: code for code, name in enumerate(dict.fromkeys(list(planned_classes) + list(detected_classes)))}
+    planned = np.array([names[name] for name in planned_classes], dtype=np.int64)
+    detected = np.array([names[name] for name in detected_classes], dtype=np.int64)
+    planned_durations = np.asarray(planned_durations, dtype=np.float64)
+    detected_durations = np.asarray(detected_durations, dtype=np.float64)
+
+    n, m = len(planned), len(detected)
+
+    # extra[j]: cost of leaving the first j segments unmatched
+    extra = np.arange(m + 1) * extra_cost
+    moves = np.empty((n + 1, m + 1), dtype=np.int8)
+    moves[0, :] = _EXTRA
+    cost = extra.copy() # row 0
+
+    for i in range(1, n + 1):
+        # best of matching segment j-1 with step i-1 or missing step i-1
+        via_miss = cost + miss_cost
+        via_match = np.full(m + 1, np.inf)
+        via_match[1:] = cost[:-1] + _match_costs(planned[i - 1], planned_durations[i - 1], detected, detected_durations)
+        best = np.minimum(via_miss, via_match)
+
+        # chains of extra segments: cost[j] = min over k <= j of best[k] + extra[j] - extra[k]
+        row = np.minimum.accumulate(best - extra) + extra
+
+        moves[i] = np.where(via_match <= via_miss, _MATCH, _MISS)
+        moves[i, row < best - 1e-9] = _EXTRA
+        moves[i, 0] = _MISS
+        cost = row
+
+    steps = []
+    i, j = n, m
+    while i or j:
+        move = moves[i, j]
+        if move == _MATCH:
+            i, j = i - 1, j - 1
+            steps.append((MATCHED, i, j))
+        elif move == _MISS:
+            i -= 1
+            steps.append((MISSED, i, None))
+        else:
+            j -= 1
+            steps.append((EXTRA, None, j))
+    steps.reverse()
+
+    return steps
@@ -0,0 +1,416 @@
+"""
+Headless analysis of the detected poses against the user's routine.
+
+Nothing in here renders or depends on streamlit: the results are plain typed
+objects which analyzer.py renders in the UI, and which batch.py (or any other
+caller) can use or serialize directly with to_dict().
+"""
+from dataclasses import asdict, dataclass, field
+import datetime
+
+import settings
+import alignment
+
+
+@dataclass
+class PoseCheck:
+    """
+    Basic analysis of one planned pose.
+    """
+    pose: str
+    detected: bool
+    planned_duration: int # seconds
+    detected_duration: float # seconds
+    fulfilled: bool # detected for the planned duration within the tolerance
+
+
+@dataclass
+class BasicAnalysis:
+    duration_tolerance: float # %
+    poses: list[PoseCheck] = field(default_factory=list)
+
+    @property
+    def routine_check(self):
+        """
+        Whether each planned pose was detected.
+        """
+        return {check.pose: check.detected for check in self.poses}
+
+    def to_dict(self):
+        return {
+            check.pose: {
+                "detected": check.detected,
+                "planned_duration": check.planned_duration,
+                "detected_duration": check.detected_duration,
+                "fulfilled": check.fulfilled,
+            }
+            for check in self.poses
+        }
+
+
+@dataclass
+class DurationDifference:
+    """
+    Duration difference (seconds) of a planned or detected pose, negative for
+    poses that are missing from either the routine or the detections.
+    """
+    pose: str
+    difference: float
+
+
+@dataclass
+class ConfidenceScore:
+    """
+    Average score of a detected pose, negative for poses outside the routine.
+    """
+    pose: str
+    score: float
+
+
+@dataclass
+class RoutineStep:
+    """
+    One step of the planned routine aligned with the detections, in order:
+    a planned step matched with a detection of the same pose, a missed
+    planned step or an extra detection.
+    """
+    kind: str # alignment.MATCHED, alignment.MISSED or alignment.EXTRA
+    pose: str
+    planned_index: int | None
+    detected_index: int | None
+    planned_duration: float | None # seconds
+    detected_duration: float | None # seconds
+    avg_score: float | None
+
+
+@dataclass
+class DetailedAnalysis:
+    duration_differences: list[DurationDifference] = field(default_factory=list)
+    confidence_scores: list[ConfidenceScore] = field(default_factory=list)
+    overall_scores: dict[str, float] = field(default_factory=dict) # weighted score per pose
+    steps: list[RoutineStep] = field(default_factory=list)
+
+    def count(self, kind):
+        return sum(step.kind == kind for step in self.steps)
+
+    def to_dict(self):
+        return {
+            "duration_diff": [{"class": d.pose, "difference": d.difference} for d in self.duration_differences],
+            "confidence_scores": [{"class": c.pose, "score": c.score} for c in self.confidence_scores],
+            "overall_score": self.overall_scores,
+            "steps": [asdict(step) for step in self.steps],
+        }
+
+
+@dataclass
+class DetectedSegment:
+    """
+    Display row of one detected pose segment.
+    """
+    index: int
+    pose: str
+    duration: datetime.timedelta
+    avg_score: float
+
+    @property
+    def duration_text(self):
+        # mm:ss.mmm
+        reference_date = datetime.datetime(1900, 1, 1) # convert timedelta to datetime for formatting
+        return (reference_date + self.duration).strftime("%M:%S.%f")[:-3]
+
+
+class LiveAnalysis:
+    """
+    Incremental analysis of a running session. Segments are added as they
+    close (see SegmentTracker.closed_segments) and every add() updates the
+    routine progress in O(1):
+        the merged detected duration of every pose, as get_merged_poses
+        whether each planned pose is fulfilled within the tolerance, as compute_basic
+        a running overall score per pose, as calculate_overall_score_detailed,
+        with the segments matched greedily against the next planned steps
+    The final results are still computed with analyze() once the session
+    ends, since the full alignment may match the steps differently.
+    """
+    def __init__(self, user_routine, duration_tolerance=0, duration_weight=0.70, confidence_weight=0.3):
+        self.duration_tolerance = duration_tolerance or 0
+        self.duration_weight = duration_weight
+        self.confidence_weight = confidence_weight
+
+        self.steps = convert_user_input(user_routine)
+        self.planned = {} # planned seconds per pose
+        for step in self.steps:
+            self.planned[step["class"]] = self.planned.get(step["class"], 0) + step["duration"]
+        self.planned_total = sum(self.planned.values())
+
+        self.detected = {} # detected seconds per pose
+        self.fulfilled = set() # planned poses detected for their planned duration
+        self.covered = 0.0 # planned seconds covered by the detections
+        self.scores = {} # running overall score per pose
+        self.counts = {alignment.MATCHED: 0, alignment.MISSED: 0, alignment.EXTRA: 0}
+        self.next_step = 0 # index of the next planned step
+        self.segments = 0
+
+    @property
+    def progress(self):
+        """
+        Share of the planned time covered by the detections, in [0, 1].
+        """
+        return self.covered / self.planned_total if self.planned_total else 0.0
+
+    @property
+    def next_pose(self):
+        return self.steps[self.next_step]["class"] if self.next_step < len(self.steps) else None
+
+    def add(self, segment):
+        """
+        Add a closed segment in the format of SegmentTracker.merged().
+        """
+        pose = segment["class"]
+        duration = segment["duration"].total_seconds()
+        self.segments += 1
+
+        previous = self.detected.get(pose, 0.0)
+        detected = previous + duration
+        self.detected[pose] = detected
+
+        if pose in self.planned:
+            planned = self.planned[pose]
+            self.covered += min(detected, planned) - min(previous, planned)
+            if planned*(100-self.duration_tolerance)/100 <= detected <= planned*(100+self.duration_tolerance)/100:
+                self.fulfilled.add(pose)
+            else:
+                self.fulfilled.discard(pose)
+
+        self._match(pose, duration, segment["avg_score"])
+
+    def _match(self, pose, duration, avg_score):
+        # the segment is matched with the next planned step, or with the one after it if the next step was skipped
+        for offset in (0, 1):
+            index = self.next_step + offset
+            if index < len(self.steps) and self.steps[index]["class"] == pose:
+                if offset:
+                    missed = self.steps[self.next_step]
+                    self._score(missed["class"], -missed["duration"], 0)
+                    self.counts[alignment.MISSED] += 1
+
+                self._score(pose, abs(self.steps[index]["duration"] - duration), avg_score)
+                self.counts[alignment.MATCHED] += 1
+                self.next_step = index + 1
+                return
+
+        # an extra detection is considered as a negative effect
+        self._score(pose, -duration, -avg_score)
+        self.counts[alignment.EXTRA] += 1
+
+    def _score(self, pose, duration_difference, confidence_score):
+        self.scores[pose] = self.scores.get(pose, 0) + self.duration_weight * duration_difference + self.confidence_weight * confidence_score
+
+    def to_dict(self):
+        return {
+            "progress": self.progress,
+            "next_pose": self.next_pose,
+            "segments": self.segments,
+            **self.counts,
+            "poses": {
+                pose: {
+                    "planned_duration": planned,
+                    "detected_duration": self.detected.get(pose, 0.0),
+                    "fulfilled": pose in self.fulfilled,
+                    "score": self.scores.get(pose, 0.0),
+                }
+                for pose, planned in self.planned.items()
+            },
+        }
+
+
+def detected_segments(detected_poses):
+    """
+    Display rows of the segments returned by SegmentTracker.merged.
+    """
+    return [DetectedSegment(i, pose["class"], pose["duration"], pose["avg_score"]) for i, pose in enumerate(detected_poses)]
+
+def analyze_basic(detected_poses, user_routine, duration_tolerance):
+    """
+    Check whether the planned poses were detected, and if so whether they
+    were held for the planned duration within duration_tolerance (%).
+    Input:
+        detected_poses: segments returned by SegmentTracker.merged
+        user_routine: {"Pose": [...], "Minutes": [...], "Seconds": [...]}
+    Output:
+        BasicAnalysis
+    """
+    checks = [PoseCheck(pose, **check) for pose, check in compute_basic(detected_poses, user_routine, duration_tolerance).items()]
+    return BasicAnalysis(duration_tolerance, checks)
+
+def analyze_detailed(detected_poses, user_routine):
+    """
+    Compare the planned routine step by step, in order, with the detections.
+    Input:
+        detected_poses: segments returned by SegmentTracker.merged
+        user_routine: {"Pose": [...], "Minutes": [...], "Seconds": [...]}
+    Output:
+        DetailedAnalysis
+    """
+    return summarize_steps(align_routine(convert_user_input(user_routine), detected_poses))
+
+def summarize_steps(steps):
+    """
+    DetailedAnalysis of the RoutineSteps returned by align_routine.
+    """
+    duration_diff, confidence_scores = _step_scores(steps)
+
+    return DetailedAnalysis(
+        [DurationDifference(d["class"], d["difference"]) for d in duration_diff],
+        [ConfidenceScore(c["class"], c["score"]) for c in confidence_scores],
+        calculate_overall_score_detailed(duration_diff, confidence_scores),
+        steps,
+    )
+
+def analyze(analysis_level, detected_poses, user_routine, duration_tolerance=0):
+    """
+    Run the analysis of the given level (settings.BASIC or settings.DETAILED).
+    """
+    if analysis_level == settings.BASIC:
+        return analyze_basic(detected_poses, user_routine, duration_tolerance)
+    if analysis_level == settings.DETAILED:
+        return analyze_detailed(detected_poses, user_routine)
+    raise ValueError(f"Unknown analysis level: {analysis_level}")
+
+def convert_user_input(data):
+    poses = data['Pose']
+    minutes_list = data['Minutes']
+    seconds_list = data['Seconds']
+
+    result = []
+
+    for i in range(len(poses)):
+        minutes = minutes_list[i]
+        seconds = seconds_list[i]
+
+        total_seconds = minutes * 60 + seconds
+
+        result.append({"class": poses[i], "duration": total_seconds})
+
+    return result
+
+def get_merged_poses(detected_poses, user_routine):
+    detected = {}
+    routine = {}
+
+    for pose in detected_poses:
+        if pose["class"] not in detected:
+            detected[pose["class"]] = pose["duration"]
+        else:
+            detected[pose["class"]] += pose["duration"]
+
+    for i in range(len(user_routine["Pose"])):
+        planned_duration = (user_routine["Minutes"][i])*60 + user_routine["Seconds"][i]
+        if user_routine["Pose"][i] not in routine:
+            routine[user_routine["Pose"][i]] = planned_duration
+        else:
+            routine[user_routine["Pose"][i]] += planned_duration
+
+    return detected, routine
+
+def compute_basic(detected_poses, user_routine, duration_tolerance):
+    """
+    Compute the basic analysis without rendering it.
+    Output:
+        dictionary of the planned poses and, for each pose, whether it was
+        detected and whether the detected duration is within the tolerance
+    """
+    detected, routine = get_merged_poses(detected_poses, user_routine)
+
+    results = {}
+
+    for pose, duration in routine.items():
+        detected_duration = detected[pose].total_seconds() if pose in detected else 0
+        results[pose] = {
+            "detected": pose in detected,
+            "planned_duration": duration,
+            "detected_duration": detected_duration,
+            "fulfilled": pose in detected and duration*(100-duration_tolerance)/100 <= detected_duration <= duration*(100+duration_tolerance)/100
+        }
+
+    return results
+
+def align_routine(user_poses, actual_poses):
+    """
+    Align the planned steps (see convert_user_input) with the detected
+    segments in order and return the RoutineSteps.
+    """
+    actual_durations = [pose["duration"].total_seconds() for pose in actual_poses]
+
+    steps = []
+    for kind, planned, detected in alignment.align([pose["class"] for pose in user_poses], [pose["duration"] for pose in user_poses],
+                                                   [pose["class"] for pose in actual_poses], actual_durations):
+        user_pose = user_poses[planned] if planned is not None else None
+        actual_pose = actual_poses[detected] if detected is not None else None
+        steps.append(RoutineStep(
+            kind,
+            (user_pose or actual_pose)["class"],
+            planned,
+            detected,
+            user_pose["duration"] if user_pose else None,
+            actual_durations[detected] if actual_pose else None,
+            actual_pose["avg_score"] if actual_pose else None,
+        ))
+
+    return steps
+
+def _step_scores(steps):
+    duration_diff = []
+    confidence_scores = []
+
+    for step in steps:
+        if step.kind == alignment.MATCHED:
+            duration_diff.append({"class": step.pose, "difference": abs(step.planned_duration - step.detected_duration)})
+            confidence_scores.append({"class": step.pose, "score": step.avg_score})
+
+        # a missed step or an extra detection is considered as a negative effect
+        elif step.kind == alignment.MISSED:
+            duration_diff.append({"class": step.pose, "difference": -step.planned_duration})
+        else:
+            duration_diff.append({"class": step.pose, "difference": -step.detected_duration})
+            confidence_scores.append({"class": step.pose, "score": -step.avg_score})
+
+    return duration_diff, confidence_scores
+
+def compute_detailed(user_poses, actual_poses):
+    """
+    Compute the duration differences and confidence scores of the detailed
+    analysis without rendering them. Planned steps are matched with the
+    detections in routine order (see align_routine).
+    """
+    return _step_scores(align_routine(user_poses, actual_poses))
+
+def calculate_overall_score_detailed(duration_diff, confidence_scores, duration_weight=0.70, confidence_weight=0.3):
+    overall_data = {
+        "duration": {},
+        "confidence": {}
+        }
+    overall_score = {}
+
+    for pose_n_duration in duration_diff:
+        pose, duration = pose_n_duration["class"], pose_n_duration["difference"]
+        if pose not in overall_data["duration"]:
+            overall_data["duration"][pose] = duration
+        else:
+            overall_data["duration"][pose] += duration
+    
+    for pose_n_conf in confidence_scores:
+        pose, conf = pose_n_conf["class"], pose_n_conf["score"]
+        if pose not in overall_data["confidence"]:
+            overall_data["confidence"][pose] = conf
+        else:
+            overall_data["confidence"][pose] += conf
+    
+    for pose in set(overall_data["duration"].keys()) | set(overall_data["confidence"].keys()):
+        # Use 0 if not present in one of the dictionaries
+        duration_difference = overall_data["duration"].get(pose, 0)
+        confidence_score = overall_data["confidence"].get(pose, 0)
+
+        # Combine duration and confidence scores using specified weights
+        overall_score[pose] = duration_weight * duration_difference + confidence_weight * confidence_score
+    
+    return overall_score
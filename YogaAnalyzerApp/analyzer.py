@@ -1,29 +1,35 @@
+"""
+Streamlit rendering of the routine analysis. The analysis itself is computed
+headless in analysis.py.
+"""
 import settings
 import streamlit as st
+import telemetry
+import analysis
+import alignment
 from helper import _create_table_view, fill_table
 
+# moved to analysis.py, kept here for existing callers
+from analysis import convert_user_input, get_merged_poses, calculate_overall_score_detailed # noqa: F401
 
-def analyze_routine(analysis_level, detected_poses, user_routine, duration_tolerance):
-    if analysis_level == settings.BASIC:
-        basic_analyzer(detected_poses, user_routine, duration_tolerance)
-    elif analysis_level == settings.DETAILED:
-        converted_data = convert_user_input(user_routine)
-        detailed_analyzer(converted_data, detected_poses)
 
-def convert_user_input(data):
-    poses = data['Pose']
-    minutes_list = data['Minutes']
-    seconds_list = data['Seconds']
-
-    result = []
-
-    for i in range(len(poses)):
-        minutes = minutes_list[i]
-        seconds = seconds_list[i]
+def analyze_routine(analysis_level, detected_poses, user_routine, duration_tolerance, metrics=telemetry.NULL_METRICS):
+    """
+    Analyze the detected poses against the user's routine, render the results
+    and return the BasicAnalysis / DetailedAnalysis.
+    """
+    if settings.DEBUG:
+        print(detected_poses)
+        print(user_routine)
 
-        total_seconds = minutes * 60 + seconds
+    with metrics.span("analysis"):
+        result = analysis.analyze(analysis_level, detected_poses, user_routine, duration_tolerance)
 
-        result.append({"class": poses[i], "duration": total_seconds})
+    with metrics.span("render_analysis"):
+        if analysis_level == settings.BASIC:
+            render_basic(result)
+        elif analysis_level == settings.DETAILED:
+            render_detailed(result)
 
     return result
 
@@ -35,127 +41,46 @@ def basic_analyzer(detected_poses, user_routine, duration_tolerance):
         detected_poses: list of detected poses
         user_routine: list of user's routine
     Output:
-        routine_check: dictionary of detected poses and their 
+        routine_check: dictionary of detected poses and their
         presence in the user's routine
     """
-    cols = _create_table_view("Yoga Routine Basic Analysis Results", "Pose in the routine", "Is detected?", "Duration for the pose", "Is fulfilled?")
-
-    if settings.DEBUG:
-        print(detected_poses)
-        print(user_routine)
-
-    detected, routine = get_merged_poses(detected_poses, user_routine)
-
-    if settings.DEBUG:
-        print(detected_poses)
-        print(user_routine)
-
-    routine_check = {}
-
-    for pose, duration in routine.items():
-        pose_detected = "❌"
-        duration_fulfilled = "❌"
-        if pose in detected:
-            pose_detected = "✅"
-            if duration*(100-duration_tolerance)/100 <= duration <= duration*(100+duration_tolerance)/100:
-                duration_fulfilled = "✅"
-
-        minutes, remaining_seconds = divmod(duration, 60)
-
-        fill_table(cols, pose, pose_detected, f"{minutes:02}:{remaining_seconds:02} ± {duration_tolerance}%", duration_fulfilled)
-        
-        routine_check[pose] = pose in detected
-
-def get_merged_poses(detected_poses, user_routine):
-    detected = {}
-    routine = {}
-
-    for pose in detected_poses:
-        if pose["class"] not in detected:
-            detected[pose["class"]] = pose["duration"]
-        else:
-            detected[pose["class"]] += pose["duration"]
-
-    for i in range(len(user_routine["Pose"])):
-        planned_duration = (user_routine["Minutes"][i])*60 + user_routine["Seconds"][i]
-        if user_routine["Pose"][i] not in routine:
-            routine[user_routine["Pose"][i]] = planned_duration
-        else:
-            routine[user_routine["Pose"][i]] += planned_duration
-
-    return detected, routine
-
-def calculate_overall_score_detailed(duration_diff, confidence_scores, duration_weight=0.70, confidence_weight=0.3):
-    overall_data = {
-        "duration": {},
-        "confidence": {}
-        }
-    overall_score = {}
-
-    for pose_n_duration in duration_diff:
-        pose, duration = pose_n_duration["class"], pose_n_duration["difference"]
-        if pose not in overall_data["duration"]:
-            overall_data["duration"][pose] = duration
-        else:
-            overall_data["duration"][pose] += duration
-    
-    for pose_n_conf in confidence_scores:
-        pose, conf = pose_n_conf["class"], pose_n_conf["score"]
-        if pose not in overall_data["confidence"]:
-            overall_data["confidence"][pose] = conf
-        else:
-            overall_data["confidence"][pose] += conf
-    
-    for pose in set(overall_data["duration"].keys()) | set(overall_data["confidence"].keys()):
-        # Use 0 if not present in one of the dictionaries
-        duration_difference = overall_data["duration"].get(pose, 0)
-        confidence_score = overall_data["confidence"].get(pose, 0)
-
-        # Combine duration and confidence scores using specified weights
-        overall_score[pose] = duration_weight * duration_difference + confidence_weight * confidence_score
-    
-    return overall_score
+    result = analysis.analyze_basic(detected_poses, user_routine, duration_tolerance)
+    render_basic(result)
+    return result.routine_check
 
 def detailed_analyzer(user_poses, actual_poses):
-    duration_diff = []
-    confidence_scores = []
-
-    user_pose_names = {pose["class"] for pose in user_poses}
-
-    for user_pose in user_poses:
-        user_pose_name, user_duration = user_pose["class"], user_pose["duration"]
-
-        matching_poses = [pose for pose in actual_poses if pose["class"] == user_pose_name]
-
-        # if there is a missing pose in the actual routine 
-        if not matching_poses:
-            # consider it as a negative effect
-            duration_diff.append({"class": user_pose_name, "difference": -user_duration})
-            continue
-
-        for actual_pose in matching_poses:
-            actual_duration, actual_score = actual_pose["duration"].total_seconds(), actual_pose["avg_score"]
-
-            # calculate duration difference
-            duration_diff.append({"class": user_pose_name, "difference": abs(user_duration - actual_duration)})
+    """
+    Compare the planned steps with the detections in routine order.
+    Input:
+        user_poses: planned steps, see analysis.convert_user_input
+        actual_poses: segments returned by SegmentTracker.merged
+    Output:
+        DetailedAnalysis
+    """
+    result = analysis.summarize_steps(analysis.align_routine(user_poses, actual_poses))
+    render_detailed(result)
+    return result
 
-            # collect confidence scores
-            confidence_scores.append({"class": user_pose_name, "score": actual_score})
+def render_basic(result):
+    """
+    Table of the planned poses, whether they were detected and whether their
+    duration was fulfilled.
+    """
+    cols = _create_table_view("Yoga Routine Basic Analysis Results", "Pose in the routine", "Is detected?", "Duration for the pose", "Is fulfilled?")
 
-    # if there is an additional pose in the actual routine, but it's not in the inputs
-    for actual_pose in actual_poses:
-        actual_pose_name = actual_pose["class"]
-        if actual_pose_name not in user_pose_names:
-            # consider it as a negative effect
-            duration_diff.append({"class": actual_pose_name, "difference": -actual_pose["duration"].total_seconds()})
-            confidence_scores.append({"class": actual_pose_name, "score": -actual_pose["avg_score"]})
+    for check in result.poses:
+        pose_detected = "✅" if check.detected else "❌"
+        duration_fulfilled = "✅" if check.fulfilled else "❌"
 
-    classes_duration = [pose["class"] for pose in duration_diff]
-    differences_duration = [pose["difference"] for pose in duration_diff]
+        minutes, remaining_seconds = divmod(check.planned_duration, 60)
 
-    classes_confidence = [pose["class"] for pose in confidence_scores]
-    confidence_values = [pose["score"] for pose in confidence_scores]
+        fill_table(cols, check.pose, pose_detected, f"{minutes:02}:{remaining_seconds:02} ± {result.duration_tolerance}%", duration_fulfilled)
 
+def render_detailed(result):
+    """
+    Bar charts of the duration differences, confidence scores and overall
+    scores per pose.
+    """
     st.markdown("<h1 style='text-align: center; color: white;'>Yoga Routine Detailed Analysis Results</h1>", unsafe_allow_html=True)
 
     col1, col2, col3 = st.columns(3)
@@ -163,17 +88,65 @@ def detailed_analyzer(user_poses, actual_poses):
     # chart for duration differences
     with col1:
         st.subheader("Duration Difference")
-        chart_data_duration = {pose: diff for pose, diff in zip(classes_duration, differences_duration)}
+        chart_data_duration = {d.pose: d.difference for d in result.duration_differences}
         st.bar_chart(chart_data_duration, use_container_width=True)
 
     # chart for confidence scores
     with col2:
         st.subheader("Confidence Scores")
-        chart_data_confidence = {pose: score for pose, score in zip(classes_confidence, confidence_values)}
+        chart_data_confidence = {c.pose: c.score for c in result.confidence_scores}
         st.bar_chart(chart_data_confidence, use_container_width=True)
 
+    # overall score of the whole routine
     with col3:
-        # overall score of the whole routine
-        overall_score = calculate_overall_score_detailed(duration_diff, confidence_scores)
         st.subheader("Overall Score of Your Routine")
-        st.bar_chart(overall_score, use_container_width=True)
\ No newline at end of file
+        st.bar_chart(result.overall_scores, use_container_width=True)
+
+    # the routine step by step, in order
+    cols = _create_table_view(f"Step by step: {result.count(alignment.MATCHED)} matched, {result.count(alignment.MISSED)} missed, {result.count(alignment.EXTRA)} extra",
+                              "Step", "Pose", "Planned / detected duration", "Result", True)
+
+    for step in result.steps:
+        planned = f"{step.planned_duration:.0f}s" if step.planned_duration is not None else "-"
+        detected = f"{step.detected_duration:.1f}s" if step.detected_duration is not None else "-"
+        step_number = step.planned_index + 1 if step.planned_index is not None else ""
+
+        fill_table(cols, step_number, step.pose, f"{planned} / {detected}", step.kind)
+
+def render_history(store, days=settings.HISTORY_DAYS):
+    """
+    Trends of the recorded sessions, read from the daily rollups of the
+    history store.
+    """
+    daily = store.daily_totals(days)
+    if not daily:
+        st.info("No recorded sessions yet, the history is shown here once a routine is analyzed.")
+        return
+
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Sessions", sum(d["sessions"] for d in daily))
+    col2.metric("Minutes of yoga", round(sum(d["detected_seconds"] for d in daily) / 60))
+    col3.metric("Active days", len(daily))
+
+    # average detected duration per session, one line per pose
+    trends = store.pose_trends(days)
+    poses = sorted({t["pose"] for t in trends})
+    chart_data_duration = {"day": [d["day"] for d in daily], **{pose: [None] * len(daily) for pose in poses}}
+    day_index = {d["day"]: i for i, d in enumerate(daily)}
+    for t in trends:
+        chart_data_duration[t["pose"]][day_index[t["day"]]] = round(t["avg_detected_seconds"], 1)
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.subheader("Seconds per Session")
+        st.line_chart(chart_data_duration, x="day", y=poses, use_container_width=True)
+
+    with col2:
+        st.subheader("Average Confidence")
+        confidence = store.confidence_trend(days)
+        st.line_chart({"day": [c["day"] for c in confidence], "confidence": [c["avg_score"] for c in confidence]},
+                      x="day", y="confidence", use_container_width=True)
+
+    cols = _create_table_view("Most missed poses", "Pose", "Missed", "Planned", "Fulfilled", True)
+    for missed in store.most_missed(days):
+        fill_table(cols, missed["pose"], missed["missed"], missed["planned"], missed["fulfilled"])
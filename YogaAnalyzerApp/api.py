@@ -0,0 +1,312 @@
+"""
+HTTP API for analyzing recorded sessions without the Streamlit UI, e.g. from
+mobile or IoT clients. Jobs run the same detection and analysis as batch.py,
+with models from the shared registry, on a bounded pool of worker threads.
+
+    python api.py [--host 0.0.0.0] [--port 8000]
+
+Endpoints:
+    POST /jobs       multipart form with
+                         video: the recording, or
+                         frame: one part per frame (JPEG / PNG), in order, with an optional fps field
+                         routine: routine JSON, e.g. {"Pose": ["tree"], "Minutes": [1], "Seconds": [30]}
+                         yogi, analysis, duration_tolerance: optional, as in batch.py
+                     -> 202 {"id": ..., "status": "queued"}, 429 if the queue is full
+    GET  /jobs/{id}  -> {"id": ..., "status": "queued" | "running" | "done" | "failed", "result" | "error": ...}
+    GET  /health
+
+See loadtest.py for a local load test with concurrent clients.
+"""
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+from pathlib import Path
+import tempfile
+import time
+import traceback
+import uuid
+
+from aiohttp import web
+import cv2
+import numpy as np
+
+import settings
+import registry
+import batch
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+_jobs_key = web.AppKey("jobs", dict)
+_queue_key = web.AppKey("queue", asyncio.Queue)
+_executor_key = web.AppKey("executor", ThreadPoolExecutor)
+_workers_key = web.AppKey("workers", list)
+
+
+class FrameStream:
+    """
+    cv2.VideoCapture stand-in over the encoded frames of a spool file (the
+    frames written back to back, frame i spanning offsets[i]:offsets[i + 1]),
+    read and decoded one at a time. Timestamps are derived from the frame rate.
+    """
+    def __init__(self, path, offsets, fps):
+        self.file = open(path, "rb")
+        self.offsets = offsets
+        self.fps = fps
+        self.index = -1
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def isOpened(self):
+        return not self.file.closed
+
+    def grab(self):
+        if self.index + 1 >= len(self):
+            return False
+        self.index += 1
+        return True
+
+    def read(self):
+        if not self.grab():
+            return False, None
+
+        start, end = self.offsets[self.index], self.offsets[self.index + 1]
+        self.file.seek(start)
+        frame = cv2.imdecode(np.frombuffer(self.file.read(end - start), dtype=np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            raise ValueError(f"Unable to decode frame {self.index}")
+        return True, frame
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_POS_MSEC:
+            return max(self.index, 0) * 1000 / self.fps
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return len(self)
+        return 0
+
+    def release(self):
+        self.file.close()
+
+
+def _discard_upload(job):
+    # delete the uploaded video and the frame spool of a job, if any
+    if job.get("upload"):
+        Path(job["video"]).unlink(missing_ok=True)
+    if job.get("spool"):
+        Path(job["spool"]).unlink(missing_ok=True)
+
+def _run_job(job):
+    """
+    Analyze a job on a worker thread. Uploaded videos and frame spools are
+    deleted afterwards.
+    """
+    captured_video = None
+    try:
+        if job.get("spool"):
+            captured_video = FrameStream(job["spool"], job.pop("offsets"), job["fps"])
+        result = batch.analyze_video(job, captured_video=captured_video)
+        result["video"] = job.get("filename", result["video"])
+        return result
+    finally:
+        if captured_video is not None:
+            captured_video.release()
+        _discard_upload(job)
+
+async def _worker(app):
+    loop = asyncio.get_running_loop()
+    queue = app[_queue_key]
+
+    while True:
+        job = await queue.get()
+        record = app[_jobs_key][job["id"]]
+        record.update(status=RUNNING, started=time.time())
+
+        try:
+            record["result"] = await loop.run_in_executor(app[_executor_key], _run_job, job)
+            record["status"] = DONE
+        except Exception as e:
+            record.update(status=FAILED, error=str(e))
+            if settings.DEBUG:
+                traceback.print_exc()
+        finally:
+            record["finished"] = time.time()
+            queue.task_done()
+
+def _prune(jobs):
+    # forget finished jobs after settings.API_JOB_TTL seconds
+    expired = time.time() - settings.API_JOB_TTL
+    for job_id in [job_id for job_id, record in jobs.items() if record.get("finished", time.time()) < expired]:
+        del jobs[job_id]
+
+def _bad_request(message):
+    return web.json_response({"error": message}, status=400)
+
+def _routine_error(routine):
+    """
+    Return why a routine is invalid, or None: it needs Pose, Minutes and
+    Seconds lists of the same length, with pose names and non-negative
+    durations.
+    """
+    if not isinstance(routine, dict) or not all(isinstance(routine.get(key), list) for key in ("Pose", "Minutes", "Seconds")):
+        return "routine must have Pose, Minutes and Seconds lists"
+    if not routine["Pose"] or not len(routine["Pose"]) == len(routine["Minutes"]) == len(routine["Seconds"]):
+        return "routine Pose, Minutes and Seconds must have the same, non-zero length"
+    if not all(isinstance(pose, str) for pose in routine["Pose"]):
+        return "routine poses must be names"
+    durations = routine["Minutes"] + routine["Seconds"]
+    if not all(isinstance(value, (int, float)) and not isinstance(value, bool) and value >= 0 for value in durations):
+        return "routine Minutes and Seconds must be non-negative numbers"
+    return None
+
+async def _read_upload(request, job):
+    """
+    Read the multipart form of a job submission. The video is streamed to a
+    temporary file, frames are appended encoded to a spool file (see
+    FrameStream). Returns an error response if the request is invalid or
+    exceeds the limits.
+    """
+    reader = await request.multipart()
+    size = 0
+    spool = None
+    offsets = [0] # start of every spooled frame, and the end of the last one
+
+    try:
+        while (part := await reader.next()) is not None:
+            if part.name == "video":
+                if "video" in job:
+                    return _bad_request("only one video can be uploaded per job")
+                settings.API_UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+                suffix = Path(part.filename or "").suffix or ".mp4"
+                fd, path = tempfile.mkstemp(suffix=suffix, dir=settings.API_UPLOAD_DIR)
+                job.update(video=path, upload=True, filename=part.filename)
+
+                with os.fdopen(fd, "wb") as video_file:
+                    while chunk := await part.read_chunk():
+                        size += len(chunk)
+                        if size > settings.API_MAX_UPLOAD_BYTES:
+                            return web.json_response({"error": "upload too large"}, status=413)
+                        video_file.write(chunk)
+
+            elif part.name == "frame":
+                if len(offsets) > settings.API_MAX_FRAMES:
+                    return web.json_response({"error": "upload too large"}, status=413)
+                if spool is None:
+                    settings.API_UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+                    fd, job["spool"] = tempfile.mkstemp(suffix=".frames", dir=settings.API_UPLOAD_DIR)
+                    spool = os.fdopen(fd, "wb")
+
+                while chunk := await part.read_chunk():
+                    size += len(chunk)
+                    if size > settings.API_MAX_UPLOAD_BYTES:
+                        return web.json_response({"error": "upload too large"}, status=413)
+                    spool.write(chunk)
+                offsets.append(spool.tell())
+
+            elif part.name in ("routine", "yogi", "analysis", "duration_tolerance", "fps"):
+                job[part.name] = await part.text()
+    finally:
+        if spool is not None:
+            spool.close()
+
+    if spool is not None:
+        # the frames take precedence over a video uploaded along with them
+        if job.pop("upload", False):
+            Path(job["video"]).unlink(missing_ok=True)
+        job.update(offsets=offsets, video=f"<{len(offsets) - 1} frames>")
+
+    if "video" not in job:
+        return _bad_request("a video or frames are required")
+
+    try:
+        job["routine"] = json.loads(job.get("routine", ""))
+        job["duration_tolerance"] = float(job.get("duration_tolerance", 0))
+        job["fps"] = float(job.get("fps", 30))
+    except ValueError as e:
+        return _bad_request(f"invalid parameter: {e}")
+
+    routine_error = _routine_error(job["routine"])
+    if routine_error:
+        return _bad_request(routine_error)
+    if job["yogi"] not in settings.YOGI_LIST:
+        return _bad_request(f"yogi must be one of {settings.YOGI_LIST}")
+    if job["analysis"] not in settings.ANALYSIS_LIST:
+        return _bad_request(f"analysis must be one of {settings.ANALYSIS_LIST}")
+    if job["fps"] <= 0:
+        return _bad_request("fps must be positive")
+
+    return None
+
+async def submit_job(request):
+    jobs = request.app[_jobs_key]
+    queue = request.app[_queue_key]
+    _prune(jobs)
+
+    # refuse early instead of receiving an upload that cannot be queued
+    if queue.full():
+        return web.json_response({"error": "too many queued jobs"}, status=429, headers={"Retry-After": "5"})
+
+    if not request.content_type.startswith("multipart/"):
+        return _bad_request("expected a multipart/form-data request")
+
+    job = {"id": uuid.uuid4().hex, "yogi": settings.BEGINNER, "analysis": settings.BASIC}
+    error = await _read_upload(request, job)
+    if error is None and queue.full():
+        error = web.json_response({"error": "too many queued jobs"}, status=429, headers={"Retry-After": "5"})
+
+    if error is not None:
+        _discard_upload(job)
+        return error
+
+    jobs[job["id"]] = {"id": job["id"], "status": QUEUED, "created": time.time()}
+    queue.put_nowait(job)
+
+    return web.json_response({"id": job["id"], "status": QUEUED}, status=202)
+
+async def job_status(request):
+    record = request.app[_jobs_key].get(request.match_info["job_id"])
+    if record is None:
+        return web.json_response({"error": "unknown job"}, status=404)
+    return web.json_response(record)
+
+async def health(request):
+    return web.json_response({"status": "ok", "queued": request.app[_queue_key].qsize()})
+
+async def _start_workers(app):
+    app[_queue_key] = asyncio.Queue(maxsize=settings.API_MAX_QUEUED_JOBS)
+    app[_workers_key] = [asyncio.create_task(_worker(app)) for _ in range(settings.API_WORKERS)]
+
+async def _stop_workers(app):
+    for worker in app[_workers_key]:
+        worker.cancel()
+    app[_executor_key].shutdown(wait=False, cancel_futures=True)
+
+def create_app():
+    app = web.Application()
+    app[_jobs_key] = {}
+    app[_executor_key] = ThreadPoolExecutor(max_workers=settings.API_WORKERS, thread_name_prefix="api-job")
+
+    app.router.add_post("/jobs", submit_job)
+    app.router.add_get("/jobs/{job_id}", job_status)
+    app.router.add_get("/health", health)
+
+    app.on_startup.append(_start_workers)
+    app.on_cleanup.append(_stop_workers)
+    return app
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="HTTP API for the yoga routine analysis.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=settings.API_PORT)
+    args = parser.parse_args()
+
+    if settings.PRELOAD_MODELS:
+        registry.preload_models()
+
+    web.run_app(create_app(), host=args.host, port=args.port)
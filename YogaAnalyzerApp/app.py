@@ -3,10 +3,10 @@ from pathlib import Path
 import PIL
 import streamlit as st 
 
-# local Modules
+# local Modules (the inference stack is imported below, once the planner is rendered)
 import settings
-import helper
-import analyzer
+import modelhost
+import telemetry
 
 # setting page layout
 st.set_page_config(
@@ -32,10 +32,10 @@ yogi_radio = st.sidebar.radio(
 
 if yogi_radio == settings.ADVANCED:
     model_path = Path(settings.ADVANCED_MODEL)
-    model_thresh = 0.5
+    model_thresh = settings.MODEL_THRESH_DICT[settings.ADVANCED]
 elif yogi_radio == settings.BEGINNER:
     model_path = Path(settings.BEGINNER_MODEL)
-    model_thresh = 0.7
+    model_thresh = settings.MODEL_THRESH_DICT[settings.BEGINNER]
 
 with st.sidebar.expander("Learn more about how do we use yogi level information."):
     st.write("There are two AI models to detect your poses. If you are a beginner, we will take it slow and our AI model will \
@@ -68,9 +68,20 @@ source_radio = st.sidebar.radio(
     settings.SOURCES_LIST
     )
 
-# loading the model
+# history of the sessions recorded by this app (there are no user accounts), shown below the analysis
+show_history = settings.HISTORY_ENABLED and st.sidebar.checkbox("Show the history of all sessions")
+
+# per-session timing spans & counters, exported for the whole process
+metrics = telemetry.session_metrics(st.session_state)
+telemetry.serve()
+
+# the model host loads the models in the background while the routine is planned
+if settings.MODEL_HOST and settings.MODEL_HOST_AUTOSTART:
+    modelhost.start()
+
+# the class names are read without loading the model, which is loaded once the detection starts
 try:
-    model, classes = helper.load_model(model_path)
+    classes = modelhost.model_names(model_path)
 except Exception as ex:
     st.error(f"Unable to load model. Check the specified path: {model_path}")
     st.error(ex)
@@ -164,20 +175,50 @@ if st.session_state['DETECT_POSES_BUTTON'] and not st.session_state['TABLE_FILLE
 
 ################################################## analysis ##################################################
 
+import helper
+import registry
+import analyzer
+import history
+
+if settings.PRELOAD_MODELS:
+    registry.preload_models()
+
 source_img = None
 detected_poses = None
+st.session_state["DETECTIONS_CACHED"] = False
 
 # conditions for different input options
 
+if source_radio != settings.LIVE:
+    # the camera of a live session is released once another source is selected
+    helper.end_live_session(st.session_state)
+
 if source_radio == settings.VIDEO:
-    detected_poses = helper.play_stored_video(model, model_thresh)
+    detected_poses = helper.play_stored_video(model_path, model_thresh, metrics)
 
 elif source_radio == settings.LIVE:
-    detected_poses = helper.play_livevideo(model, model_thresh)
+    detected_poses = helper.play_livevideo(model_path, model_thresh, metrics, data, duration_tolerance)
 
 else:
     st.error("Please select a valid source type!")
 
 # visualize the analysis results at the end of the session
 if detected_poses is not None:
-    routine_check = analyzer.analyze_routine(analysis_radio, detected_poses, data, duration_tolerance)
+    routine_analysis = analyzer.analyze_routine(analysis_radio, detected_poses, data, duration_tolerance, metrics)
+    telemetry.write()
+
+    if settings.HISTORY_ENABLED and not st.session_state["DETECTIONS_CACHED"]:
+        with metrics.span("history"):
+            history.record(detected_poses, data, yogi_radio, analysis_radio, duration_tolerance,
+                           getattr(routine_analysis, "overall_scores", None), source_radio,
+                           basic_results=routine_analysis.to_dict() if analysis_radio == settings.BASIC else None)
+
+# trends of the recorded sessions, from the daily rollups of the history store
+if settings.HISTORY_ENABLED and show_history:
+    st.divider()
+    st.markdown("<h1 style='text-align: center; color: white;'>Yoga History of All Sessions</h1>", unsafe_allow_html=True)
+    analyzer.render_history(history.get_store())
+
+if settings.DEBUG:
+    helper.show_metrics(metrics)
+
@@ -0,0 +1,360 @@
+"""
+Inference backends behind registry.get_model / helper.load_model.
+
+"torch" runs the weights with ultralytics' PyTorch path. "onnx" exports
+the classifier once to ONNX (optionally INT8 dynamically quantized) and runs
+it with ONNX Runtime on CPU. Both return objects with the subset of the
+ultralytics interface used by helper.py: `names` and
+`model(frames, verbose=False)` yielding results with `probs.top1`,
+`probs.top1conf` and `probs.data`.
+
+The top-1 agreement of both backends can be checked on the demo video with:
+
+    python backends.py --check-parity [--quantize] [--max-frames N] [--tolerance T] [--min-agreement A]
+
+which exits with a non-zero status when the backends disagree. Likewise
+
+    python backends.py --check-preprocessing [--backend B] [--max-frames N] [--tolerance T] [--min-agreement A]
+
+compares the classification of raw frames with the one of preallocated
+batches (see PREALLOCATED_PREPROCESSING) for a backend.
+"""
+import argparse
+import ast
+from contextlib import contextmanager
+import os
+from pathlib import Path
+import shutil
+import sys
+import threading
+
+try:
+    import fcntl
+except ImportError: # windows: exports are still atomic, but may be done twice
+    fcntl = None
+
+import cv2
+import numpy as np
+
+import settings
+from preprocess import FrameBatch, plan_resize
+
+TORCH_BACKEND = "torch"
+ONNX_BACKEND = "onnx"
+
+
+def load(model_path, backend=None):
+    backend = backend or settings.INFERENCE_BACKEND
+
+    if backend == TORCH_BACKEND:
+        from ultralytics import YOLO
+        return YOLO(str(model_path))
+    if backend == ONNX_BACKEND:
+        return OnnxClassifier(export_onnx(model_path, settings.ONNX_QUANTIZE))
+    raise ValueError(f"Unknown inference backend: {backend}")
+
+def _stale(path, source):
+    return not path.exists() or path.stat().st_mtime < source.stat().st_mtime
+
+def _tmp_path(path):
+    # unique per process and thread, in the same directory for os.replace
+    return path.with_name(f"{path.stem}.{os.getpid()}.{threading.get_ident()}.tmp{path.suffix}")
+
+@contextmanager
+def _export_lock(onnx_dir, stem):
+    """
+    Serialize the exports of a model across processes (e.g. batch workers).
+    """
+    if fcntl is None:
+        yield
+        return
+
+    with open(onnx_dir / f"{stem}.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def export_onnx(model_path, quantize=False):
+    """
+    Export a classifier to ONNX once and return the path of the exported
+    (and optionally INT8 quantized) model. The export is redone when the
+    weights are newer than the exported file. Concurrent exports wait for each
+    other, and the exported files are written to a temporary file first and
+    then renamed into place, so a reader never sees a partial model.
+    """
+    model_path = Path(model_path)
+    onnx_dir = Path(settings.ONNX_DIR)
+    onnx_path = onnx_dir / f"{model_path.stem}.onnx"
+    quantized_path = onnx_dir / f"{model_path.stem}.int8.onnx"
+
+    if not _stale(onnx_path, model_path) and not (quantize and _stale(quantized_path, onnx_path)):
+        return quantized_path if quantize else onnx_path
+
+    onnx_dir.mkdir(parents=True, exist_ok=True)
+    with _export_lock(onnx_dir, model_path.stem):
+        # checked again, another process may have exported the model meanwhile
+        if _stale(onnx_path, model_path):
+            from ultralytics import YOLO
+
+            exported = YOLO(str(model_path)).export(format="onnx", dynamic=True, simplify=True)
+            tmp_path = _tmp_path(onnx_path)
+            shutil.move(str(exported), tmp_path)
+            os.replace(tmp_path, onnx_path)
+
+        if not quantize:
+            return onnx_path
+
+        if _stale(quantized_path, onnx_path):
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+
+            tmp_path = _tmp_path(quantized_path)
+            quantize_dynamic(str(onnx_path), str(tmp_path), weight_type=QuantType.QInt8)
+            os.replace(tmp_path, quantized_path)
+
+    return quantized_path
+
+
+class _Array:
+    """
+    numpy stand-in for the torch tensors of ultralytics results.
+    """
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.value
+
+    def __float__(self):
+        return float(self.value)
+
+
+class _Probs:
+    __slots__ = ("data", "top1", "top1conf")
+
+    def __init__(self, probs):
+        self.top1 = int(probs.argmax())
+        self.data = _Array(probs)
+        self.top1conf = _Array(probs[self.top1])
+
+
+class _Result:
+    __slots__ = ("probs",)
+
+    def __init__(self, probs):
+        self.probs = _Probs(probs)
+
+
+def results(probs):
+    """
+    Wrap per-frame probability vectors into ultralytics-like results.
+    """
+    return [_Result(p) for p in probs]
+
+
+class OnnxClassifier:
+    """
+    YOLOv8 classifier exported to ONNX, run with ONNX Runtime on CPU.
+    """
+    def __init__(self, onnx_path, intra_op_threads=None, inter_op_threads=None):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = settings.ONNX_INTRA_OP_THREADS if intra_op_threads is None else intra_op_threads
+        options.inter_op_num_threads = settings.ONNX_INTER_OP_THREADS if inter_op_threads is None else inter_op_threads
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+        self.session = ort.InferenceSession(str(onnx_path), options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+        # ultralytics stores the class names and the image size in the model metadata
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.names = ast.literal_eval(metadata["names"])
+        imgsz = ast.literal_eval(metadata.get("imgsz", "[224, 224]"))
+        self.imgsz = imgsz[0] if isinstance(imgsz, (list, tuple)) else imgsz
+        self._frame_batch = None # input batch reused across calls, calls are serialized by registry.inference_lock
+
+    def preprocess(self, frame):
+        """
+        Same transform as ultralytics' classify_transforms: RGB, resize of the
+        shorter side to imgsz, center crop, scaling to [0, 1] and CHW layout.
+        """
+        dsize, interpolation, (top, left) = plan_resize(frame.shape, self.imgsz)
+        resized = cv2.resize(frame, dsize, interpolation=interpolation)
+        cropped = resized[top:top + self.imgsz, left:left + self.imgsz, ::-1] # BGR -> RGB
+
+        return cropped.transpose(2, 0, 1).astype(np.float32) / 255
+
+    def probs(self, batch):
+        """
+        Probability vectors of a preprocessed (N, 3, imgsz, imgsz) batch.
+        """
+        return self.session.run(None, {self.input_name: batch})[0]
+
+    def __call__(self, frames, verbose=False):
+        if isinstance(frames, np.ndarray):
+            frames = [frames]
+
+        if self._frame_batch is None or len(self._frame_batch.data) < len(frames):
+            self._frame_batch = FrameBatch(self.imgsz, len(frames))
+
+        frame_batch = self._frame_batch
+        frame_batch.clear()
+        for frame in frames:
+            frame_batch.add(frame)
+        return results(self.probs(frame_batch.batch))
+
+
+def batch_classifier(model):
+    """
+    Return (imgsz, classify) if the model can classify a preprocessed input
+    batch (see preprocess.FrameBatch), where classify(batch) returns the
+    probability vectors as an (N, n_classes) array. None for other models,
+    e.g. the proxies of the model host and the cascade, which take frames.
+
+    ultralytics classifiers are run through the forward pass of their
+    underlying network, without the per-frame transforms of model(frames)
+    and without building Results.
+    """
+    if isinstance(model, OnnxClassifier):
+        return model.imgsz, model.probs
+
+    if type(model).__name__ == "YOLO" and getattr(model, "task", None) == "classify":
+        import torch
+
+        imgsz = model.overrides.get("imgsz") or settings.WARMUP_IMGSZ
+        imgsz = imgsz[0] if isinstance(imgsz, (list, tuple)) else imgsz
+        network = model.model # the ClassificationModel behind model(frames)
+        network.eval()
+        parameter = next(network.parameters())
+
+        def classify(batch):
+            # from_numpy shares the batch's memory, it is only copied for another device or dtype
+            with torch.inference_mode():
+                output = network(torch.from_numpy(batch).to(parameter.device, parameter.dtype))
+            # the Classify head returns the softmax in eval mode, newer ultralytics versions as (softmax, logits)
+            if isinstance(output, (list, tuple)):
+                output = output[1].float().softmax(1)
+            return output.float().cpu().numpy()
+
+        return imgsz, classify
+
+    return None
+
+
+def check_parity(model_path, video_path, quantize=False, max_frames=None, batch_size=settings.BATCH_SIZE):
+    """
+    Classify the frames of a video with the PyTorch and the ONNX backend.
+    Output:
+        the share of frames with the same top-1 class and the largest absolute
+        difference of the class probabilities, or (None, None) if no frame
+        was read
+    """
+    torch_model = load(model_path, TORCH_BACKEND)
+    onnx_model = OnnxClassifier(export_onnx(model_path, quantize))
+
+    captured_video = cv2.VideoCapture(str(video_path))
+    total = agreed = 0
+    max_diff = 0.0
+    frames = []
+
+    while True:
+        success, frame = captured_video.read()
+        if success and (max_frames is None or total + len(frames) < max_frames):
+            frames.append(frame)
+            if len(frames) < batch_size:
+                continue
+
+        if frames:
+            torch_probs = [r.probs.data.cpu().numpy() for r in torch_model(frames, verbose=False)]
+            onnx_probs = [r.probs.data.numpy() for r in onnx_model(frames)]
+            for a, b in zip(torch_probs, onnx_probs):
+                agreed += int(np.argmax(a) == np.argmax(b))
+                max_diff = max(max_diff, float(np.max(np.abs(a - b))))
+            total += len(frames)
+            frames = []
+
+        if not success or (max_frames is not None and total >= max_frames):
+            break
+
+    captured_video.release()
+    return (agreed / total, max_diff) if total else (None, None)
+
+def check_preprocessing(model_path, video_path, backend=None, max_frames=None, batch_size=settings.BATCH_SIZE):
+    """
+    Classify the frames of a video as raw frames, as model(frames) does, and
+    as preallocated batches (see preprocess.FrameBatch and batch_classifier).
+    Output:
+        the share of frames with the same top-1 class and the largest absolute
+        difference of the class probabilities, or (None, None) if no frame
+        was read or the model does not classify preprocessed batches
+    """
+    model = load(model_path, backend)
+    classifier = batch_classifier(model)
+    if classifier is None:
+        return None, None
+    imgsz, classify = classifier
+    frame_batch = FrameBatch(imgsz, batch_size)
+
+    captured_video = cv2.VideoCapture(str(video_path))
+    total = agreed = 0
+    max_diff = 0.0
+    frames = []
+
+    while True:
+        success, frame = captured_video.read()
+        if success and (max_frames is None or total + len(frames) < max_frames):
+            frames.append(frame)
+            if len(frames) < batch_size:
+                continue
+
+        if frames:
+            raw_probs = [r.probs.data.cpu().numpy() for r in model(frames, verbose=False)]
+            frame_batch.clear()
+            for frame in frames:
+                frame_batch.add(frame)
+            for a, b in zip(raw_probs, classify(frame_batch.batch)):
+                agreed += int(np.argmax(a) == np.argmax(b))
+                max_diff = max(max_diff, float(np.max(np.abs(a - b))))
+            total += len(frames)
+            frames = []
+
+        if not success or (max_frames is not None and total >= max_frames):
+            break
+
+    captured_video.release()
+    return (agreed / total, max_diff) if total else (None, None)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the ONNX backend against PyTorch.")
+    parser.add_argument("--check-parity", action="store_true")
+    parser.add_argument("--check-preprocessing", action="store_true",
+                        help="compare raw frames against preallocated batches instead")
+    parser.add_argument("--backend", choices=(TORCH_BACKEND, ONNX_BACKEND), help="backend of --check-preprocessing")
+    parser.add_argument("--model", default=str(settings.BEGINNER_MODEL))
+    parser.add_argument("--video", default=str(settings.VIDEOS_DICT["video_1"]))
+    parser.add_argument("--quantize", action="store_true", help="check the INT8 quantized model")
+    parser.add_argument("--max-frames", type=int)
+    parser.add_argument("--tolerance", type=float, default=settings.ONNX_PARITY_TOLERANCE,
+                        help="largest allowed absolute difference of the class probabilities")
+    parser.add_argument("--min-agreement", type=float, default=settings.ONNX_PARITY_MIN_AGREEMENT,
+                        help="smallest allowed share of frames with the same top-1 class")
+    args = parser.parse_args()
+
+    if args.check_parity or args.check_preprocessing:
+        if args.check_preprocessing:
+            agreement, max_diff = check_preprocessing(args.model, args.video, args.backend, args.max_frames)
+        else:
+            agreement, max_diff = check_parity(args.model, args.video, args.quantize, args.max_frames)
+        if agreement is None:
+            sys.exit("no frames read or no preallocated preprocessing for this model")
+
+        print(f"top-1 agreement: {agreement:.2%}, max probability difference: {max_diff:.6f}")
+        if agreement < args.min_agreement or max_diff > args.tolerance:
+            sys.exit(f"parity check failed (min agreement {args.min_agreement:.2%}, tolerance {args.tolerance})")
@@ -0,0 +1,257 @@
+"""
+Headless batch analysis of recorded yoga sessions.
+
+Examples:
+    python batch.py recordings/ --routine routine.json --output results/
+    python batch.py manifest.json --output results/ --analysis Detailed --workers 8 --format csv
+
+The input is either a directory of videos analyzed against a single routine
+(--routine), or a JSON manifest listing the videos and their routines:
+
+    [
+        {"video": "session_1.mp4", "routine": "routine.json"},
+        {"video": "session_2.mp4", "routine": {"Pose": ["tree"], "Minutes": [1], "Seconds": [30]}, "yogi": "Advanced"}
+    ]
+
+Routines use the same format as the routine planner of the app. Videos whose
+results already exist in the output directory are skipped, so an interrupted
+run can simply be restarted.
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import csv
+import json
+import multiprocessing
+import os
+from pathlib import Path
+import sys
+import traceback
+
+import cv2
+
+import settings
+import analysis
+import history
+import probstore
+from helper import load_model, while_video
+from segments import SegmentTracker
+
+
+def _load_routine(routine, base_dir):
+    if isinstance(routine, (str, Path)):
+        with open(Path(base_dir) / routine) as routine_file:
+            return json.load(routine_file)
+    return routine
+
+def _output_name(video, base_dir):
+    try:
+        relative = Path(video).resolve().relative_to(Path(base_dir).resolve())
+    except ValueError:
+        relative = Path(Path(video).name)
+    return "__".join(relative.with_suffix("").parts)
+
+def collect_jobs(source, routine=None, yogi=settings.BEGINNER, analysis=settings.BASIC, duration_tolerance=0):
+    """
+    Build the list of jobs from a directory of videos or a JSON manifest.
+    """
+    source = Path(source)
+    jobs = []
+
+    if source.is_dir():
+        if routine is None:
+            raise ValueError("--routine is required when analyzing a directory")
+        routine = _load_routine(routine, Path.cwd())
+
+        for video in sorted(source.rglob("*")):
+            if video.suffix.lower() in settings.VIDEO_EXTENSIONS:
+                jobs.append({"video": str(video), "name": _output_name(video, source), "routine": routine,
+                             "yogi": yogi, "analysis": analysis, "duration_tolerance": duration_tolerance})
+    else:
+        with open(source) as manifest_file:
+            manifest = json.load(manifest_file)
+
+        for entry in manifest:
+            video = source.parent / entry["video"]
+            jobs.append({
+                "video": str(video),
+                "name": _output_name(video, source.parent),
+                "routine": _load_routine(entry.get("routine", routine), source.parent),
+                "yogi": entry.get("yogi", yogi),
+                "analysis": entry.get("analysis", analysis),
+                "duration_tolerance": entry.get("duration_tolerance", duration_tolerance),
+            })
+
+    return jobs
+
+def segment_to_dict(segment):
+    scores = segment["scores"]
+    return {
+        "class": segment["class"],
+        "start_timestamp": segment["start_timestamp"],
+        "final_timestamp": segment["final_timestamp"],
+        "duration": segment["duration"].total_seconds(),
+        "avg_score": segment["avg_score"],
+        "min_score": scores.min,
+        "max_score": scores.max,
+        "frames": scores.count,
+    }
+
+def analyze_video(job, probs_path=None, captured_video=None):
+    """
+    Detect the poses of a single video and analyze them against its routine.
+    If probs_path is given, the per-frame probabilities are stored there for
+    probstore.resegment. The video is read from captured_video instead of
+    job["video"] if given (any capture with the cv2.VideoCapture interface).
+    """
+    model, _ = load_model(settings.MODELS_DICT[job["yogi"]])
+    tracker = SegmentTracker(settings.MODEL_THRESH_DICT[job["yogi"]])
+
+    if captured_video is None:
+        captured_video = cv2.VideoCapture(job["video"])
+    if not captured_video.isOpened():
+        raise IOError(f"Unable to open video: {job['video']}")
+
+    if probs_path:
+        # adaptive sampling does not record probabilities, fall back to dense
+        sampling = settings.SAMPLING_MODE if settings.SAMPLING_MODE != settings.ADAPTIVE_SAMPLING else settings.DENSE_SAMPLING
+        with probstore.ProbabilityRecorder(probs_path, list(model.names.values())) as recorder:
+            while_video(captured_video, model, tracker, batch_size=settings.BATCH_SIZE, sampling=sampling, recorder=recorder)
+    else:
+        while_video(captured_video, model, tracker, batch_size=settings.BATCH_SIZE, sampling=settings.SAMPLING_MODE)
+    detected_poses = tracker.merged()
+
+    result = {
+        "video": job["video"],
+        "yogi": job["yogi"],
+        "analysis": job["analysis"],
+        "segments": [segment_to_dict(segment) for segment in detected_poses],
+    }
+
+    routine_analysis = analysis.analyze(job["analysis"], detected_poses, job["routine"], job["duration_tolerance"])
+    result["basic" if job["analysis"] == settings.BASIC else "detailed"] = routine_analysis.to_dict()
+
+    return result
+
+def _write_atomic(path, write):
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "w", newline="") as output_file:
+        write(output_file)
+    os.replace(tmp_path, path)
+
+def _write_csv(output_file, rows):
+    if not rows:
+        return
+    writer = csv.DictWriter(output_file, fieldnames=list(rows[0].keys()))
+    writer.writeheader()
+    writer.writerows(rows)
+
+def result_path(output_dir, job, output_format):
+    return Path(output_dir) / f"{job['name']}.{output_format}"
+
+def write_result(result, output_dir, job, output_format):
+    """
+    Write the result of a job. The file named by result_path is written last,
+    its presence marks the job as done.
+    """
+    path = result_path(output_dir, job, output_format)
+
+    if output_format == "json":
+        _write_atomic(path, lambda f: json.dump(result, f, indent=2))
+        return
+
+    _write_atomic(path.with_name(f"{job['name']}.segments.csv"), lambda f: _write_csv(f, result["segments"]))
+
+    if result["analysis"] == settings.BASIC:
+        rows = [{"pose": pose, **check} for pose, check in result["basic"].items()]
+    else:
+        rows = [{"pose": pose, "overall_score": score} for pose, score in result["detailed"]["overall_score"].items()]
+    _write_atomic(path, lambda f: _write_csv(f, rows))
+
+def _init_worker(threads):
+    # one process per core, so keep the per-process thread pools small
+    cv2.setNumThreads(threads)
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+def _run_job(job, output_dir, output_format, save_probs):
+    probs_path = Path(output_dir) / f"{job['name']}.probs" if save_probs else None
+    result = analyze_video(job, probs_path)
+    write_result(result, output_dir, job, output_format)
+    return result
+
+def record_history(store, job, result):
+    """
+    Add the result of a job to the history store, dated by the video file.
+    """
+    detailed = result.get("detailed")
+    store.add(result["segments"], job["routine"], job["yogi"], job["analysis"], job["duration_tolerance"],
+              detailed["overall_score"] if detailed else None, source="batch", started_at=Path(job["video"]).stat().st_mtime,
+              basic_results=result.get("basic"))
+
+def run(jobs, output_dir, output_format="json", workers=None, threads=1, save_probs=False, history_store=None):
+    """
+    Process the jobs on a process pool, skipping jobs whose results already
+    exist. Returns the list of (video, error) pairs of the failed jobs. The
+    results are also recorded in history_store if given, in bulk batches of
+    its batch_size.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    pending = [job for job in jobs if not result_path(output_dir, job, output_format).exists()]
+    print(f"{len(jobs) - len(pending)} of {len(jobs)} videos already analyzed, {len(pending)} to go")
+
+    failed = []
+    context = multiprocessing.get_context("spawn")
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker, initargs=(threads,)) as executor:
+        futures = {executor.submit(_run_job, job, output_dir, output_format, save_probs): job for job in pending}
+
+        for done, future in enumerate(as_completed(futures), start=1):
+            job = futures[future]
+            try:
+                result = future.result()
+                print(f"[{done}/{len(pending)}] {job['video']}: {len(result['segments'])} segments")
+                if history_store is not None:
+                    record_history(history_store, job, result)
+            except Exception as e:
+                failed.append((job["video"], str(e)))
+                print(f"[{done}/{len(pending)}] {job['video']}: failed: {e}", file=sys.stderr)
+                if settings.DEBUG:
+                    traceback.print_exc()
+
+    if history_store is not None:
+        history_store.flush()
+
+    return failed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyze recorded yoga sessions without the Streamlit UI.")
+    parser.add_argument("source", help="directory of videos or JSON manifest")
+    parser.add_argument("--routine", help="routine JSON used for videos without their own routine")
+    parser.add_argument("--output", required=True, help="directory for the per-video results")
+    parser.add_argument("--yogi", choices=settings.YOGI_LIST, default=settings.BEGINNER)
+    parser.add_argument("--analysis", choices=settings.ANALYSIS_LIST, default=settings.BASIC)
+    parser.add_argument("--tolerance", type=int, default=0, help="duration tolerance (%%) of the basic analysis")
+    parser.add_argument("--format", choices=("json", "csv"), default="json")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("--threads", type=int, default=1, help="inference threads per worker process")
+    parser.add_argument("--save-probs", action="store_true", help="also store the per-frame probabilities for re-segmentation")
+    parser.add_argument("--history", action="store_true", help="also record the sessions in the history store (settings.HISTORY_DB)")
+    args = parser.parse_args(argv)
+
+    jobs = collect_jobs(args.source, args.routine, args.yogi, args.analysis, args.tolerance)
+    history_store = history.HistoryStore() if args.history else None
+    try:
+        failed = run(jobs, args.output, args.format, args.workers, args.threads, args.save_probs, history_store)
+    finally:
+        if history_store is not None:
+            history_store.close()
+
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
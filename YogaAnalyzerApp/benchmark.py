@@ -0,0 +1,535 @@
+"""
+Benchmarks of the detection and analysis hot paths, runnable without a
+Streamlit server or a webcam.
+
+    python benchmark.py                      # run everything, compare to the baseline
+    python benchmark.py --only segments,analysis
+    python benchmark.py --save-baseline      # store the results as the new baseline
+
+Every benchmark reports its throughput, p50 / p99 latency and the peak RSS of
+the process so far. When a baseline file exists, every metric is compared
+against it and regressions beyond --tolerance are listed. The baseline holds
+absolute timings of one machine, so it is recorded on the machine it is
+compared on and not committed.
+"""
+import argparse
+import datetime
+import json
+from pathlib import Path
+import random
+import resource
+import sys
+import time
+
+import numpy as np
+
+import settings
+import telemetry
+
+BASELINE_PATH = settings.ROOT / 'benchmark_baseline.json'
+
+# metrics where a higher value is better, all others are lower-is-better
+HIGHER_IS_BETTER = {"frames_per_s", "segments_per_s", "poses_per_s", "sessions_per_s"}
+
+
+def _peak_rss_mb():
+    # ru_maxrss is reported in kilobytes on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+def _rss_mb():
+    # current resident set size, None where /proc is not available
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize() / 2**20
+    except OSError:
+        return None
+
+def _percentiles_ms(latencies):
+    if not latencies:
+        return None, None
+    p50, p99 = np.percentile(np.asarray(latencies) * 1000, [50, 99])
+    return round(float(p50), 6), round(float(p99), 6)
+
+
+class _RecordingMetrics(telemetry.Metrics):
+    """
+    Metrics that also keep every observation, for exact percentiles.
+    """
+    def __init__(self):
+        super().__init__("benchmark")
+        self.observations = {}
+
+    def observe(self, stage, seconds):
+        super().observe(stage, seconds)
+        self.observations.setdefault(stage, []).append(seconds)
+
+
+def bench_video(batch_sizes=(1, 4, 8, 16), strides=(1, 5, 10)):
+    """
+    helper.while_video on the bundled demo video, with the model as loaded by
+    the app (so including PREALLOCATED_PREPROCESSING). The batch latency is
+    the forward pass and the copy of the scores of one batch, as recorded by
+    while_video's own telemetry spans.
+    """
+    import cv2
+    import registry
+    from helper import while_video
+    from segments import SegmentTracker
+
+    video_path = settings.VIDEOS_DICT["video_1"]
+    if not Path(video_path).exists():
+        print(f"skipping video benchmarks, demo video not found: {video_path}", file=sys.stderr)
+        return {}
+
+    model = registry.get_model(settings.BEGINNER_MODEL)
+    results = {}
+
+    runs = [(batch_size, 1) for batch_size in batch_sizes] + [(max(batch_sizes), stride) for stride in strides if stride > 1]
+    for batch_size, stride in runs:
+        metrics = _RecordingMetrics()
+        tracker = SegmentTracker(settings.MODEL_THRESH_DICT[settings.BEGINNER])
+        captured_video = cv2.VideoCapture(str(video_path))
+        n_frames = int(captured_video.get(cv2.CAP_PROP_FRAME_COUNT))
+
+        start = time.perf_counter()
+        sampling = settings.STRIDE_SAMPLING if stride > 1 else settings.DENSE_SAMPLING
+        while_video(captured_video, model, tracker, batch_size=batch_size, sampling=sampling, stride=stride, metrics=metrics)
+        tracker.merged()
+        elapsed = time.perf_counter() - start
+
+        batch_times = [forward + sync for forward, sync in zip(metrics.observations.get("forward", []), metrics.observations.get("sync", []))]
+        p50, p99 = _percentiles_ms(batch_times)
+        results[f"video/batch={batch_size},stride={stride}"] = {
+            "frames": n_frames,
+            "classified_frames": metrics.counters.get("frames_processed", 0),
+            "frames_per_s": round(n_frames / elapsed, 2),
+            "p50_batch_ms": p50,
+            "p99_batch_ms": p99,
+            "peak_rss_mb": _peak_rss_mb(),
+        }
+
+    return results
+
+def bench_preprocess(video_path=None, batch_size=8, max_frames=3000, repeat=3):
+    """
+    helper.while_video on the demo video with the frames given to the model
+    as they are decoded, against PREALLOCATED_PREPROCESSING, for the whole
+    loop of decoding, preprocessing and classification:
+        frame_ms: time per frame
+        batch_traced_kb: memory allocated for one batch, as the tracemalloc
+            peak above the memory held between batches. It covers Python
+            objects and numpy buffers (numpy reports them to tracemalloc, so
+            the arrays returned by OpenCV and ONNX Runtime are included), but
+            not the native buffers OpenCV or ONNX Runtime allocate internally.
+        batch_alloc_blocks: number of memory blocks allocated while the
+            frames of a batch are decoded and preprocessed, and still held
+            when the batch is complete (tracemalloc snapshot statistics,
+            summed over the allocation sites). Temporaries freed before,
+            e.g. inside model(frames), are not counted.
+        rss_growth_mb: growth of the resident memory over the timed runs,
+            which includes native memory but not the transient allocations
+            that are freed again
+    """
+    import tracemalloc
+    import cv2
+    import backends
+    import registry
+    import helper
+    from segments import SegmentTracker
+
+    video_path = video_path or settings.VIDEOS_DICT["video_1"]
+    if not Path(video_path).exists():
+        print(f"skipping preprocess benchmarks, demo video not found: {video_path}", file=sys.stderr)
+        return {}
+
+    model = registry.get_model(settings.BEGINNER_MODEL)
+    if backends.batch_classifier(model) is None:
+        print("skipping preprocess benchmarks, the model does not classify preprocessed batches", file=sys.stderr)
+        return {}
+
+    class _Capture:
+        # the first max_frames frames, decoded into a given buffer like cv2.VideoCapture
+        reads_into_buffer = True
+
+        def __init__(self, n_frames):
+            self.cap = cv2.VideoCapture(str(video_path))
+            self.remaining = n_frames
+            self.batch_peaks = []
+            self.batch_blocks = []
+            self._batch_start = None
+
+        def isOpened(self):
+            return self.cap.isOpened()
+
+        def read(self, image=None):
+            if tracemalloc.is_tracing() and self.remaining % batch_size == 0:
+                current, peak = tracemalloc.get_traced_memory()
+                self.batch_peaks.append(peak - current)
+                tracemalloc.reset_peak()
+                self._batch_start = tracemalloc.take_snapshot()
+            self.remaining -= 1
+            result = self.cap.read(image) if self.remaining >= 0 else (False, None)
+
+            if self._batch_start is not None and self.remaining % batch_size == 0:
+                # the last frame of the batch is decoded, the batch is classified next
+                statistics = tracemalloc.take_snapshot().compare_to(self._batch_start, "lineno")
+                self.batch_blocks.append(sum(stat.count_diff for stat in statistics if stat.count_diff > 0))
+            return result
+
+        def get(self, prop):
+            return self.cap.get(prop)
+
+        def release(self):
+            self.cap.release()
+
+    preallocated = settings.PREALLOCATED_PREPROCESSING
+    results = {}
+    try:
+        for name, enabled in (("per_call", False), ("preallocated", True)):
+            settings.PREALLOCATED_PREPROCESSING = enabled
+
+            times = []
+            rss_before = _rss_mb()
+            for _ in range(repeat):
+                start = time.perf_counter()
+                helper.while_video(_Capture(max_frames), model, SegmentTracker(0), batch_size=batch_size)
+                times.append(time.perf_counter() - start)
+            rss_after = _rss_mb()
+
+            capture = _Capture(min(max_frames, 50 * batch_size))
+            tracemalloc.start()
+            helper.while_video(capture, model, SegmentTracker(0), batch_size=batch_size)
+            tracemalloc.stop()
+            # the first batches allocate the reused buffers
+            batch_peaks, batch_blocks = capture.batch_peaks[2:], capture.batch_blocks[2:]
+
+            results[f"preprocess/{name}"] = {
+                "frames": max_frames,
+                "frames_per_s": round(max_frames / min(times), 2),
+                "frame_ms": round(min(times) / max_frames * 1000, 6),
+                "batch_traced_kb": round(float(np.median(batch_peaks)) / 1024, 1) if batch_peaks else None,
+                "batch_alloc_blocks": int(np.median(batch_blocks)) if batch_blocks else None,
+                "rss_growth_mb": round(rss_after - rss_before, 1) if rss_before is not None else None,
+                "peak_rss_mb": _peak_rss_mb(),
+            }
+    finally:
+        settings.PREALLOCATED_PREPROCESSING = preallocated
+
+    return results
+
+def _synthetic_frames(n_segments, frames_per_segment=30, n_classes=47, noise=0.05, seed=0):
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(frames_per_segment // 2, frames_per_segment * 2, n_segments)
+    classes = rng.integers(0, n_classes, n_segments)
+    class_ids = np.repeat(classes, lengths)
+    flicker = rng.random(len(class_ids)) < noise
+    class_ids[flicker] = rng.integers(0, n_classes, flicker.sum())
+    timestamps = np.arange(len(class_ids)) * 1000 / 30
+    scores = rng.uniform(0.4, 1.0, len(class_ids))
+    return timestamps, class_ids, scores
+
+def bench_segments(n_segments=20000, repeat=3):
+    """
+    Segment bookkeeping (SegmentTracker.update) and merging
+    (SegmentTracker.merged, as used by post_process_predictions) on
+    synthetic detections with n_segments segments.
+    """
+    from segments import SegmentTracker
+
+    timestamps, class_ids, scores = _synthetic_frames(n_segments)
+    class_names = [f"pose_{i}" for i in range(int(class_ids.max()) + 1)]
+    frames = list(zip([class_names[i] for i in class_ids], scores.tolist(), timestamps.tolist()))
+
+    chunk = 1000
+    update_times, update_latencies, merge_times = [], [], []
+    for _ in range(repeat):
+        tracker = SegmentTracker(0.5)
+
+        start = time.perf_counter()
+        for i in range(0, len(frames), chunk):
+            chunk_start = time.perf_counter()
+            for cls, score, timestamp in frames[i:i + chunk]:
+                tracker.update(cls, score, timestamp)
+            update_latencies.append((time.perf_counter() - chunk_start) / len(frames[i:i + chunk]))
+        tracker.finalize(timestamps[-1])
+        update_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        merged = tracker.merged()
+        merge_times.append(time.perf_counter() - start)
+
+    update_p50, update_p99 = _percentiles_ms(update_latencies)
+    merge_p50, merge_p99 = _percentiles_ms(merge_times)
+
+    return {
+        "segments/update": {
+            "frames": len(frames),
+            "frames_per_s": round(len(frames) / min(update_times), 2),
+            "p50_frame_ms": update_p50,
+            "p99_frame_ms": update_p99,
+            "peak_rss_mb": _peak_rss_mb(),
+        },
+        "segments/merge": {
+            "raw_segments": n_segments,
+            "merged_segments": len(merged),
+            "segments_per_s": round(n_segments / min(merge_times), 2),
+            "p50_ms": merge_p50,
+            "p99_ms": merge_p99,
+            "peak_rss_mb": _peak_rss_mb(),
+        },
+    }
+
+def _synthetic_routine(n_planned, n_detected, n_classes=47, seed=0):
+    rng = random.Random(seed)
+    class_names = [f"pose_{i}" for i in range(n_classes)]
+
+    user_routine = {"Pose": [], "Minutes": [], "Seconds": []}
+    for _ in range(n_planned):
+        user_routine["Pose"].append(rng.choice(class_names))
+        user_routine["Minutes"].append(rng.randrange(3))
+        user_routine["Seconds"].append(rng.randrange(60))
+
+    detected_poses = []
+    for _ in range(n_detected):
+        duration = rng.uniform(1, 120)
+        detected_poses.append({"class": rng.choice(class_names), "avg_score": rng.uniform(0.5, 1),
+                               "duration": datetime.timedelta(seconds=duration)})
+
+    return user_routine, detected_poses
+
+def bench_analysis(n_planned=500, n_detected=5000, repeat=3):
+    """
+    Basic and detailed analysis on a large synthetic routine.
+    """
+    import analysis
+
+    user_routine, detected_poses = _synthetic_routine(n_planned, n_detected)
+    user_poses = analysis.convert_user_input(user_routine)
+
+    def timed(function):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - start)
+        return times
+
+    basic_times = timed(lambda: analysis.compute_basic(detected_poses, user_routine, 10))
+    detailed_times = timed(lambda: analysis.analyze_detailed(detected_poses, user_routine))
+    duration_diff, confidence_scores = analysis.compute_detailed(user_poses, detected_poses)
+    overall_times = timed(lambda: analysis.calculate_overall_score_detailed(duration_diff, confidence_scores))
+
+    results = {}
+    for name, times in (("basic", basic_times), ("detailed", detailed_times), ("overall_score", overall_times)):
+        p50, p99 = _percentiles_ms(times)
+        results[f"analysis/{name}"] = {
+            "planned_poses": n_planned,
+            "detected_poses": n_detected,
+            "poses_per_s": round((n_planned + n_detected) / min(times), 2),
+            "p50_ms": p50,
+            "p99_ms": p99,
+            "peak_rss_mb": _peak_rss_mb(),
+        }
+
+    return results
+
+# imports & calls the app needs before the routine planner is interactive, and those of the former eager start-up
+_STARTUP_SNIPPETS = {
+    "planner": "import streamlit, settings, modelhost, telemetry; modelhost.model_names(settings.BEGINNER_MODEL)",
+    # without MODEL_NAMES_CACHE, i.e. the first start after installing or updating the weights
+    "planner_cold": ("import pathlib, tempfile, streamlit, settings, modelhost, telemetry\n"
+                     "with tempfile.TemporaryDirectory() as cache_dir:\n"
+                     "    settings.MODEL_NAMES_CACHE = pathlib.Path(cache_dir) / 'model_names.json'\n"
+                     "    modelhost.model_names(settings.BEGINNER_MODEL)"),
+    "inference": "import streamlit, settings, helper, registry, analyzer, telemetry; helper.load_model(settings.BEGINNER_MODEL)",
+}
+
+# the peak RSS is read from /proc: on Linux, ru_maxrss of a child started with fork + exec
+# starts at the high-water mark of the parent, i.e. of the benchmark process
+_STARTUP_PROBE = """
+import json, resource, sys, time
+start = time.perf_counter()
+exec(sys.argv[1])
+try:
+    with open("/proc/self/status") as status:
+        rss_mb = next(int(line.split()[1]) for line in status if line.startswith("VmHWM:")) / 1024
+except (OSError, StopIteration):
+    rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+print(json.dumps({
+    "seconds": time.perf_counter() - start,
+    "rss_mb": rss_mb,
+    "heavy_modules": sorted(m for m in ("cv2", "numpy", "torch", "ultralytics", "onnxruntime") if m in sys.modules),
+}))
+"""
+
+def bench_startup(repeat=3):
+    """
+    Time and memory of a fresh app process until the routine planner can be
+    rendered, against loading the inference stack and the model up front.
+    Every run is a new interpreter, so nothing is cached in memory.
+    """
+    import subprocess
+
+    results = {}
+    for name, snippet in _STARTUP_SNIPPETS.items():
+        runs = []
+        for _ in range(repeat):
+            process = subprocess.run([sys.executable, "-c", _STARTUP_PROBE, snippet], cwd=Path(__file__).resolve().parent,
+                                     capture_output=True, text=True)
+            if process.returncode != 0:
+                print(f"skipping startup/{name}: {process.stderr.strip().splitlines()[-1]}", file=sys.stderr)
+                break
+            runs.append(json.loads(process.stdout.strip().splitlines()[-1]))
+        if not runs:
+            continue
+
+        p50, p99 = _percentiles_ms([run["seconds"] for run in runs])
+        results[f"startup/{name}"] = {
+            "p50_ms": p50,
+            "p99_ms": p99,
+            "peak_rss_mb": round(min(run["rss_mb"] for run in runs), 1),
+            "heavy_modules": runs[0]["heavy_modules"],
+        }
+
+    return results
+
+def bench_history(n_sessions=20000, n_days=365, repeat=5):
+    """
+    Bulk inserts into a fresh history store and the trend queries of the
+    history view on its rollups, against the same aggregates computed from
+    the raw per-session rows.
+    """
+    import tempfile
+    import analysis
+    import history
+
+    rng = random.Random(0)
+    start = time.time() - n_days * 24 * 3600
+
+    sessions = []
+    for i in range(n_sessions):
+        user_routine, detected_poses = _synthetic_routine(rng.randrange(3, 12), rng.randrange(5, 40), seed=i)
+        # the app and batch.py record the basic analysis they computed
+        basic_results = analysis.analyze_basic(detected_poses, user_routine, 10).to_dict()
+        sessions.append((detected_poses, user_routine, start + i * n_days * 24 * 3600 / n_sessions, basic_results))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store = history.HistoryStore(Path(tmp_dir) / "history.db")
+
+        insert_start = time.perf_counter()
+        for detected_poses, user_routine, started_at, basic_results in sessions:
+            store.add(detected_poses, user_routine, settings.ADVANCED, settings.BASIC, 10, started_at=started_at,
+                      basic_results=basic_results)
+        store.flush()
+        insert_time = time.perf_counter() - insert_start
+
+        queries = {
+            "pose_trends": (lambda: store.pose_trends(30),
+                            "SELECT s.day, p.pose, COUNT(*), AVG(p.detected_seconds) FROM session_poses p "
+                            "JOIN sessions s ON s.id = p.session_id WHERE s.day >= ? GROUP BY s.day, p.pose"),
+            "confidence_trend": (lambda: store.confidence_trend(n_days),
+                                 "SELECT s.day, AVG(g.avg_score) FROM segments g JOIN sessions s ON s.id = g.session_id "
+                                 "WHERE s.day >= ? GROUP BY s.day"),
+            "most_missed": (lambda: store.most_missed(n_days),
+                            "SELECT p.pose, SUM(p.missed) AS missed FROM session_poses p JOIN sessions s ON s.id = p.session_id "
+                            "WHERE s.day >= ? AND p.planned_steps > 0 GROUP BY p.pose ORDER BY missed DESC LIMIT 10"),
+        }
+        since = {"pose_trends": history._since(30), "confidence_trend": history._since(n_days), "most_missed": history._since(n_days)}
+
+        results = {
+            "history/insert": {
+                "sessions": n_sessions,
+                "segments": sum(len(detected_poses) for detected_poses, *_ in sessions),
+                "sessions_per_s": round(n_sessions / insert_time, 2),
+                "peak_rss_mb": _peak_rss_mb(),
+            }
+        }
+        for name, (rollup_query, raw_sql) in queries.items():
+            rollup_times, raw_times = [], []
+            for _ in range(repeat):
+                query_start = time.perf_counter()
+                rollup_query()
+                rollup_times.append(time.perf_counter() - query_start)
+
+                query_start = time.perf_counter()
+                store._query(raw_sql, (since[name],))
+                raw_times.append(time.perf_counter() - query_start)
+
+            p50, p99 = _percentiles_ms(rollup_times)
+            raw_p50, _ = _percentiles_ms(raw_times)
+            results[f"history/{name}"] = {"sessions": n_sessions, "p50_ms": p50, "p99_ms": p99, "raw_scan_p50_ms": raw_p50}
+
+        store.close()
+
+    return results
+
+def compare(results, baseline, tolerance):
+    """
+    Return the metrics that regressed by more than tolerance (a fraction)
+    against the baseline.
+    """
+    regressions = []
+    for name, metrics in results.items():
+        for metric, value in list(metrics.items()):
+            reference = baseline.get(name, {}).get(metric)
+            if not isinstance(value, (int, float)) or not isinstance(reference, (int, float)) or not reference:
+                continue
+
+            change = (value - reference) / reference
+            if metric in HIGHER_IS_BETTER:
+                change = -change
+
+            metrics.setdefault("vs_baseline", {})[metric] = round(value / reference, 3)
+            if change > tolerance and (metric in HIGHER_IS_BETTER or metric.endswith("_ms")):
+                regressions.append((name, metric, reference, value))
+
+    return regressions
+
+BENCHMARKS = {
+    "video": bench_video,
+    "preprocess": bench_preprocess,
+    "segments": bench_segments,
+    "analysis": bench_analysis,
+    "startup": bench_startup,
+    "history": bench_history,
+}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the detection and analysis hot paths.")
+    parser.add_argument("--only", help="comma separated subset of: " + ", ".join(BENCHMARKS))
+    parser.add_argument("--baseline", default=str(BASELINE_PATH))
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed regression as a fraction")
+    parser.add_argument("--no-fail", action="store_true", help="list the regressions but exit with status 0")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    names = args.only.split(",") if args.only else list(BENCHMARKS)
+    results = {}
+    for name in names:
+        results.update(BENCHMARKS[name]())
+
+    baseline_path = Path(args.baseline)
+    regressions = []
+    if args.save_baseline:
+        with open(baseline_path, "w") as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+    elif baseline_path.exists():
+        with open(baseline_path) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+    else:
+        print(f"no baseline at {baseline_path}, record one with --save-baseline", file=sys.stderr)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output)
+    print(output)
+
+    for name, metric, reference, value in regressions:
+        print(f"REGRESSION {name} {metric}: {reference} -> {value}", file=sys.stderr)
+
+    return 1 if regressions and not args.no_fail else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
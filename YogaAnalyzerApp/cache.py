@@ -0,0 +1,136 @@
+from collections import OrderedDict
+import copy
+import hashlib
+import json
+import os
+from pathlib import Path
+import pickle
+import threading
+
+import settings
+
+# in-memory front layer of the on-disk cache
+_memory = OrderedDict()
+_lock = threading.Lock()
+
+# file digests by (path, size, mtime), so unchanged files are hashed only once
+_digests = OrderedDict()
+
+
+def file_digest(path):
+    """
+    Return the sha256 of a file's content.
+    """
+    path = Path(path).resolve()
+    stat = path.stat()
+    key = (str(path), stat.st_size, stat.st_mtime_ns)
+
+    with _lock:
+        if key in _digests:
+            _digests.move_to_end(key)
+            return _digests[key]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+
+    with _lock:
+        _digests[key] = digest.hexdigest()
+        while len(_digests) > settings.CACHE_DIGEST_ENTRIES:
+            _digests.popitem(last=False)
+    return digest.hexdigest()
+
+def detection_key(video_path, model_path, **params):
+    """
+    Build the cache key of the detections of a video from the video content,
+    the model weights and every parameter that changes the segments, e.g. the
+    model threshold and the sampling settings.
+    """
+    key = {
+        "video": file_digest(video_path),
+        "model": file_digest(model_path),
+        "params": params,
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()
+
+def _path(key):
+    return Path(settings.CACHE_DIR) / f"{key}.pkl"
+
+def get(key):
+    """
+    Return a copy of the cached segments of the key, or None on a miss.
+    """
+    with _lock:
+        if key in _memory:
+            _memory.move_to_end(key)
+            return copy.deepcopy(_memory[key])
+
+    path = _path(key)
+    try:
+        with open(path, "rb") as f:
+            segments = pickle.load(f)
+        os.utime(path) # mark as recently used for the eviction
+    except FileNotFoundError:
+        return None
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError, TypeError, ValueError, IndexError):
+        # corrupt, or written by another version of the code (e.g. a renamed class): drop it and miss
+        path.unlink(missing_ok=True)
+        return None
+
+    _remember(key, segments)
+    return copy.deepcopy(segments)
+
+def put(key, segments):
+    """
+    Store the finalized segments of the key in memory and on disk.
+    """
+    segments = copy.deepcopy(segments)
+    _remember(key, segments)
+
+    cache_dir = Path(settings.CACHE_DIR)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    path = _path(key)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp_path, "wb") as f:
+        pickle.dump(segments, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+    _evict(cache_dir)
+
+def _remember(key, segments):
+    with _lock:
+        _memory[key] = segments
+        _memory.move_to_end(key)
+        while len(_memory) > settings.CACHE_MEMORY_ENTRIES:
+            _memory.popitem(last=False)
+
+def _evict(cache_dir):
+    """
+    Remove the least recently used entries until the cache fits into
+    settings.CACHE_MAX_BYTES.
+    """
+    entries = []
+    for path in cache_dir.glob("*.pkl"):
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= settings.CACHE_MAX_BYTES:
+            break
+        try:
+            path.unlink()
+        except OSError:
+            pass
+        total -= size
+
+def clear():
+    with _lock:
+        _memory.clear()
+    for path in Path(settings.CACHE_DIR).glob("*.pkl"):
+        path.unlink()
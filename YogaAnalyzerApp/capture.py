@@ -0,0 +1,178 @@
+from collections import deque
+from pathlib import Path
+import threading
+import time
+import weakref
+
+import cv2
+
+import settings
+
+
+class CaptureSession:
+    """
+    Long-lived capture of a camera (or of a local video file standing in for
+    one). The device is opened once and read on a background thread into a
+    small ring buffer; failed reads trigger a reconnect with exponential
+    backoff instead of ending the session.
+
+    The session mimics the parts of cv2.VideoCapture used by
+    helper.while_video, so it can be passed in its place. Its release() only
+    ends the current read loop; the device stays open until close().
+    """
+    def __init__(self, source=settings.WEBCAM_PATH, buffer_size=settings.CAPTURE_BUFFER_SIZE,
+                 read_timeout=settings.CAPTURE_READ_TIMEOUT, realtime=True):
+        self.source = source
+        # video files are replayed in a loop, paced at their frame rate if realtime
+        self.is_file = isinstance(source, (str, Path)) and Path(source).is_file()
+        self.realtime = realtime
+        self.read_timeout = read_timeout
+
+        self._buffer = deque(maxlen=max(buffer_size, 1))
+        self._cond = threading.Condition()
+        self._closed = False
+        self._started_at = time.perf_counter()
+        self._timestamp = 0.0 # timestamp (ms) of the last frame returned by read()
+
+        self.counters = {"captured": 0, "delivered": 0, "dropped": 0, "read_failures": 0, "open_failures": 0, "reconnects": 0}
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+
+        self._thread = threading.Thread(target=self._run, name="capture-session", daemon=True)
+        self._thread.start()
+
+    def _open(self):
+        cap = cv2.VideoCapture(str(self.source) if self.is_file else self.source)
+        return cap if cap.isOpened() else None
+
+    def _run(self):
+        cap = None
+        delay = settings.CAPTURE_RECONNECT_DELAY
+        frame_interval = 0
+
+        while not self._closed:
+            if cap is None:
+                cap = self._open()
+                if cap is None:
+                    with self._cond:
+                        self.counters["open_failures"] += 1
+                    time.sleep(delay)
+                    delay = min(delay * 2, settings.CAPTURE_RECONNECT_MAX_DELAY)
+                    continue
+                delay = settings.CAPTURE_RECONNECT_DELAY
+                if self.is_file and self.realtime:
+                    fps = cap.get(cv2.CAP_PROP_FPS)
+                    frame_interval = 1 / fps if fps and fps > 0 else 0
+
+            start = time.perf_counter()
+            success, frame = cap.read()
+
+            if not success:
+                # lost the device (or reached the end of the stand-in file): reconnect
+                cap.release()
+                cap = None
+                with self._cond:
+                    self.counters["read_failures"] += 1
+                    self.counters["reconnects"] += 1
+                continue
+
+            captured_at = time.perf_counter()
+            with self._cond:
+                if len(self._buffer) == self._buffer.maxlen:
+                    self.counters["dropped"] += 1
+                self._buffer.append((frame, (captured_at - self._started_at) * 1000, captured_at))
+                self.counters["captured"] += 1
+                self._cond.notify()
+
+            if frame_interval:
+                time.sleep(max(frame_interval - (time.perf_counter() - start), 0))
+
+        if cap is not None:
+            cap.release()
+
+    def isOpened(self):
+        return not self._closed
+
+    def read(self):
+        """
+        Return the newest buffered frame, waiting up to read_timeout seconds
+        for one (e.g. while reconnecting). The older, stale frames are dropped.
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._buffer or self._closed, timeout=self.read_timeout) or not self._buffer:
+                return False, None
+
+            frame, self._timestamp, captured_at = self._buffer.pop()
+            self.counters["dropped"] += len(self._buffer)
+            self._buffer.clear()
+            latency = time.perf_counter() - captured_at
+            self._latency_total += latency
+            self._latency_max = max(self._latency_max, latency)
+            self.counters["delivered"] += 1
+
+        return True, frame
+
+    def grab(self):
+        success, _ = self.read()
+        return success
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_POS_MSEC:
+            return self._timestamp
+        return 0
+
+    def release(self):
+        # the device stays open for the next read loop, see close()
+        pass
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout=2)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self.counters)
+            delivered = stats["delivered"]
+            stats["avg_latency_ms"] = round(self._latency_total * 1000 / delivered, 2) if delivered else None
+            stats["max_latency_ms"] = round(self._latency_max * 1000, 2)
+            return stats
+
+
+class _SessionCapture:
+    """
+    CaptureSession owned by a streamlit session state. The capture is closed
+    when the owner is discarded with the session state (e.g. the tab was
+    closed) or at interpreter exit, whichever comes first.
+    """
+    def __init__(self, capture, source):
+        self.capture = capture
+        self.source = source
+        self._finalizer = weakref.finalize(self, capture.close)
+
+    def close(self):
+        self._finalizer()
+
+
+def session_capture(state, source=settings.WEBCAM_PATH):
+    """
+    Return the CaptureSession of a streamlit session, stored in its session
+    state. A capture opened for another source is closed and replaced.
+    """
+    owner = state.get("LIVE_CAPTURE")
+    if owner is not None and owner.source != source:
+        close_session_capture(state)
+        owner = None
+
+    if owner is None:
+        owner = state["LIVE_CAPTURE"] = _SessionCapture(CaptureSession(source), source)
+    return owner.capture
+
+def close_session_capture(state):
+    """
+    Close the CaptureSession of a streamlit session, if any.
+    """
+    owner = state.pop("LIVE_CAPTURE", None)
+    if owner is not None:
+        owner.close()
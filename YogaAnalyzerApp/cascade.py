@@ -0,0 +1,230 @@
+"""
+Confidence-gated cascade of the beginner and the advanced classifier.
+
+Every frame is classified by the small 5-class beginner model first. Only
+the frames it is unsure about go to the 47-class advanced model: frames
+below CASCADE_GATE, frames of a beginner class without an advanced
+counterpart (CASCADE_LABEL_MAP) and the first frame after every change of
+the beginner class. Confident frames are reported as the mapped advanced
+class, so the cascade looks like the advanced model to helper.py and the
+segments use the advanced class names throughout.
+
+Class changes are tracked per calling thread. helper.while_video starts
+every run with reset_session, so a thread that runs one session after the
+other (API and batch workers, chunk workers) does not carry the previous
+class over. The cascade is never run through the shared inference
+scheduler (schedulable = False): its dispatcher thread classifies the frames
+of several sessions in one call, and the last class of one session could
+mask a class change at the start of the next one.
+
+The throughput and the agreement with the advanced model alone can be
+measured on recorded sessions with:
+
+    python cascade.py session_1.mp4 session_2.mp4 --gates 0.8,0.9,0.95
+"""
+import argparse
+import json
+import threading
+import time
+
+import cv2
+import numpy as np
+
+import settings
+import registry
+import backends
+
+_cascade = None
+_lock = threading.Lock()
+
+
+class CascadeModel:
+    """
+    Model with the interface of the advanced model (`names` and
+    `model(frames, verbose=False)`) that runs the beginner model first.
+    Raises ValueError if label_map refers to a class unknown to either model.
+    """
+    schedulable = False # see the module docstring
+
+    def __init__(self, fast, accurate, label_map=settings.CASCADE_LABEL_MAP, gate=settings.CASCADE_GATE):
+        self.fast = fast
+        self.accurate = accurate
+        self.names = accurate.names
+        self.gate = gate
+
+        fast_ids = {name: i for i, name in fast.names.items()}
+        accurate_ids = {name: i for i, name in accurate.names.items()}
+        unknown = sorted(set(label_map) - fast_ids.keys()) + sorted(set(label_map.values()) - accurate_ids.keys())
+        if unknown:
+            raise ValueError(f"CASCADE_LABEL_MAP refers to unknown classes: {', '.join(unknown)}")
+
+        # beginner class id -> advanced class id, for the classes both models know
+        self.class_map = {fast_ids[fast_name]: accurate_ids[accurate_name] for fast_name, accurate_name in label_map.items()}
+
+        self.counters = {"frames": 0, "escalated": 0}
+        self._counters_lock = threading.Lock() # the cascade is shared by the sessions' threads
+        self._last = threading.local() # beginner class of the previous frame of the calling thread
+
+    def reset_session(self):
+        """
+        Forget the beginner class of the previous frame of the calling thread.
+        """
+        self._last.cls = None
+
+    def _mapped(self, probs):
+        # beginner probabilities moved to the advanced classes, classes without a counterpart are dropped
+        mapped = np.zeros(len(self.names), dtype=np.float32)
+        for fast_id, accurate_id in self.class_map.items():
+            mapped[accurate_id] += probs[fast_id]
+        return mapped
+
+    def __call__(self, frames, verbose=False):
+        if isinstance(frames, np.ndarray):
+            frames = [frames]
+
+        with registry.inference_lock(self.fast):
+            fast_results = self.fast(frames, verbose=False)
+
+        results = [None] * len(frames)
+        escalated = []
+        previous = getattr(self._last, "cls", None)
+
+        for i, result in enumerate(fast_results):
+            cls = result.probs.top1
+            if cls in self.class_map and cls == previous and float(result.probs.top1conf.cpu()) >= self.gate:
+                results[i] = backends.results([self._mapped(result.probs.data.cpu().numpy())])[0]
+            else:
+                escalated.append(i)
+            previous = cls
+        self._last.cls = previous
+
+        if escalated:
+            with registry.inference_lock(self.accurate):
+                accurate_results = self.accurate([frames[i] for i in escalated], verbose=False)
+            for i, result in zip(escalated, accurate_results):
+                results[i] = result
+
+        with self._counters_lock:
+            self.counters["frames"] += len(frames)
+            self.counters["escalated"] += len(escalated)
+        return results
+
+
+def get_model():
+    """
+    Return the process-wide cascade of the registry's beginner and advanced
+    models, rebuilt if the registry reloaded either of them.
+    """
+    global _cascade
+
+    fast = registry.get_model(settings.BEGINNER_MODEL)
+    accurate = registry.get_model(settings.ADVANCED_MODEL)
+
+    with _lock:
+        if _cascade is None or _cascade.fast is not fast or _cascade.accurate is not accurate:
+            _cascade = CascadeModel(fast, accurate)
+        return _cascade
+
+def _read_batches(video_path, batch_size, max_frames=None):
+    captured_video = cv2.VideoCapture(str(video_path))
+    frames, n_frames = [], 0
+
+    while max_frames is None or n_frames < max_frames:
+        success, frame = captured_video.read()
+        if not success:
+            break
+        frames.append(frame)
+        n_frames += 1
+        if len(frames) == batch_size:
+            yield frames
+            frames = []
+
+    captured_video.release()
+    if frames:
+        yield frames
+
+def evaluate(video_paths, gates, batch_size=settings.BATCH_SIZE, max_frames=None):
+    """
+    Compare the cascade with the advanced model alone on recorded sessions.
+
+    Both models classify every frame once. The cascade decisions of every
+    gate are derived from these outputs, with the throughput estimated from
+    the measured per-frame time of each model. The cascade at CASCADE_GATE is
+    also run and timed for real.
+    Output:
+        dictionary of the advanced-only throughput and, per gate, the share
+        of escalated frames, the top-1 agreement with the advanced model and
+        the (estimated) throughput
+    """
+    model = get_model()
+    fast_time = accurate_time = real_time = 0.0
+    fast_top1, fast_conf, accurate_top1, cascade_top1 = [], [], [], []
+    session_starts = []
+
+    for video_path in video_paths:
+        session_starts.append(len(fast_top1))
+        for frames in _read_batches(video_path, batch_size, max_frames):
+            start = time.perf_counter()
+            fast_results = model.fast(frames, verbose=False)
+            fast_time += time.perf_counter() - start
+
+            start = time.perf_counter()
+            accurate_results = model.accurate(frames, verbose=False)
+            accurate_time += time.perf_counter() - start
+
+            start = time.perf_counter()
+            cascade_results = model(frames)
+            real_time += time.perf_counter() - start
+
+            fast_top1 += [r.probs.top1 for r in fast_results]
+            fast_conf += [float(r.probs.top1conf.cpu()) for r in fast_results]
+            accurate_top1 += [r.probs.top1 for r in accurate_results]
+            cascade_top1 += [r.probs.top1 for r in cascade_results]
+
+        model.reset_session() # sessions are independent
+
+    n_frames = len(accurate_top1)
+    if not n_frames:
+        return {}
+
+    fast_top1, fast_conf, accurate_top1 = np.array(fast_top1), np.array(fast_conf), np.array(accurate_top1)
+    mapped = np.array([model.class_map.get(int(cls), -1) for cls in fast_top1])
+    # the first frame of every session and every class change are escalated
+    changed = np.r_[True, fast_top1[1:] != fast_top1[:-1]]
+    changed[[start for start in session_starts if start < n_frames]] = True
+
+    report = {
+        "frames": n_frames,
+        "advanced_fps": round(n_frames / accurate_time, 2),
+        "beginner_fps": round(n_frames / fast_time, 2),
+        "cascade": {
+            "gate": model.gate,
+            "fps": round(n_frames / real_time, 2),
+            "speedup": round(accurate_time / real_time, 2),
+            "agreement": round(float(np.mean(np.array(cascade_top1) == accurate_top1)), 4),
+        },
+        "gates": {},
+    }
+
+    for gate in gates:
+        escalated = changed | (mapped < 0) | (fast_conf < gate)
+        labels = np.where(escalated, accurate_top1, mapped)
+        estimated_time = fast_time + accurate_time * escalated.mean()
+        report["gates"][gate] = {
+            "escalated": round(float(escalated.mean()), 4),
+            "agreement": round(float(np.mean(labels == accurate_top1)), 4),
+            "estimated_fps": round(n_frames / estimated_time, 2),
+            "estimated_speedup": round(accurate_time / estimated_time, 2),
+        }
+
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the cascade against the advanced model alone.")
+    parser.add_argument("videos", nargs="*", default=[str(settings.VIDEOS_DICT["video_1"])])
+    parser.add_argument("--gates", default="0.5,0.7,0.8,0.9,0.95", help="comma separated confidence gates")
+    parser.add_argument("--max-frames", type=int, help="max. frames per video")
+    args = parser.parse_args()
+
+    gates = [float(gate) for gate in args.gates.split(",")]
+    print(json.dumps(evaluate(args.videos, gates, max_frames=args.max_frames), indent=2))
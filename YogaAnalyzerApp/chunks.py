@@ -0,0 +1,231 @@
+"""
+Time-chunked parallel detection of a single long video.
+
+The video is split into time ranges which are decoded and classified on a
+process pool, every worker seeking to its own range and classifying it with
+its own copy of the model (see registry). Workers return the per-frame
+classifications of their range rather than segments, so the stitching is
+exact: the ranges are appended in time order to one SegmentTracker, whose
+merged() equals the sequential result, including segments spanning a range
+boundary, the min. duration filter and the temporal smoothing.
+
+Range starts are aligned to the sampling stride, so stride sampling
+classifies the same frames as a sequential run. Adaptive sampling restarts
+at every range start, its boundaries stay within the sampling tolerance but
+may differ slightly from a sequential run.
+
+The speed-up of a video can be checked against the sequential detection with:
+
+    python chunks.py videos/video_1_trimmed.mp4 --workers 8 --compare
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import json
+import math
+import multiprocessing
+import os
+import threading
+import time
+
+import cv2
+
+import settings
+import telemetry
+from helper import load_model, while_video
+from segments import SegmentTracker
+
+# worker pool kept across videos, so that the workers keep their models loaded
+_executor = None
+_executor_workers = None
+_lock = threading.Lock()
+
+
+class FrameRange:
+    """
+    cv2.VideoCapture over the frames [start, stop) of a video file.
+
+    Seeking is only as accurate as the backend: FFmpeg decodes from the
+    previous keyframe up to the requested frame, other backends may stop at
+    the keyframe. The position reported after the seek is checked and the
+    missing frames are grabbed forward from there, or from the first frame if
+    the backend overshot. A backend that reports the requested position
+    without reaching it goes unnoticed, and the range boundaries are then
+    approximate.
+    """
+    # read() decodes into a given buffer, like cv2.VideoCapture.read (see preprocess.FrameBatch)
+    reads_into_buffer = True
+
+    def __init__(self, video_path, start, stop):
+        self.cap = cv2.VideoCapture(str(video_path))
+        if start:
+            self._seek(video_path, start)
+        self.remaining = stop - start
+
+    def _seek(self, video_path, start):
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+        position = int(self.cap.get(cv2.CAP_PROP_POS_FRAMES))
+        if position == start:
+            return
+
+        if not 0 <= position < start:
+            self.cap.release()
+            self.cap = cv2.VideoCapture(str(video_path))
+            position = 0
+        for _ in range(start - position):
+            if not self.cap.grab():
+                break
+
+    def isOpened(self):
+        # stays open past the range until release(), like a capture at the end of its file
+        return self.cap.isOpened()
+
+    def read(self, image=None):
+        if self.remaining <= 0:
+            return False, None
+        self.remaining -= 1
+        return self.cap.read(image)
+
+    def grab(self):
+        if self.remaining <= 0:
+            return False
+        self.remaining -= 1
+        return self.cap.grab()
+
+    def get(self, prop):
+        return self.cap.get(prop)
+
+    def release(self):
+        self.remaining = 0
+        self.cap.release()
+
+
+def plan_chunks(n_frames, fps, workers, chunk_seconds=settings.CHUNK_SECONDS, stride=1):
+    """
+    Split the frames of a video into [start, stop) ranges of at most
+    chunk_seconds, at least one per worker, with starts aligned to stride.
+    """
+    if n_frames <= 0:
+        return []
+
+    n_chunks = max(workers, math.ceil(n_frames / max(chunk_seconds * fps, 1)))
+    chunk_frames = math.ceil(math.ceil(n_frames / n_chunks) / stride) * stride
+
+    return [(start, min(start + chunk_frames, n_frames)) for start in range(0, n_frames, chunk_frames)]
+
+def _init_worker(threads):
+    # one process per core, so keep the per-process thread pools small
+    cv2.setNumThreads(threads)
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+def _detect_chunk(video_path, model_path, model_thresh, start, stop, batch_size, sampling, stride, tolerance_ms):
+    """
+    Classify the frames [start, stop) of a video on a worker process and
+    return the SegmentTracker holding them, with the processing time.
+    """
+    started_at = time.perf_counter()
+
+    model, _ = load_model(model_path)
+    # every frame is kept, the ranges are stitched frame by frame
+    tracker = SegmentTracker(model_thresh, compact_frames=0)
+    while_video(FrameRange(video_path, start, stop), model, tracker, batch_size=batch_size,
+                sampling=sampling, stride=stride, tolerance_ms=tolerance_ms)
+
+    return tracker, time.perf_counter() - started_at
+
+def _get_executor(workers):
+    global _executor, _executor_workers
+
+    with _lock:
+        if _executor is None or _executor_workers != workers:
+            if _executor is not None:
+                _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                            initializer=_init_worker, initargs=(settings.CHUNK_THREADS,))
+            _executor_workers = workers
+        return _executor
+
+def shutdown():
+    global _executor
+
+    with _lock:
+        if _executor is not None:
+            _executor.shutdown()
+            _executor = None
+
+def detect(video_path, model_path, tracker, workers=settings.CHUNK_WORKERS, chunk_seconds=settings.CHUNK_SECONDS,
+           batch_size=settings.BATCH_SIZE, sampling=settings.SAMPLING_MODE, stride=settings.SAMPLING_STRIDE,
+           tolerance_ms=settings.SAMPLING_TOLERANCE_MS, metrics=telemetry.NULL_METRICS):
+    """
+    Classify the frames of a video file in parallel time ranges and record
+    them in the given SegmentTracker, as while_video does sequentially.
+    Input:
+        video_path: video file, seekable
+        model_path: weight file, loaded once by every worker
+        tracker: SegmentTracker receiving the frames, its model_thresh is used
+        workers: number of worker processes, None for one per core
+    """
+    workers = workers or os.cpu_count()
+
+    capture = cv2.VideoCapture(str(video_path))
+    if not capture.isOpened():
+        raise IOError(f"Unable to open video: {video_path}")
+    n_frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = capture.get(cv2.CAP_PROP_FPS) or 30
+    capture.release()
+
+    chunks = plan_chunks(n_frames, fps, workers, chunk_seconds, stride if sampling == settings.STRIDE_SAMPLING else 1)
+
+    executor = _get_executor(workers)
+    futures = [
+        executor.submit(_detect_chunk, str(video_path), str(model_path), tracker.model_thresh, start, stop,
+                        batch_size, sampling, stride, tolerance_ms)
+        for start, stop in chunks
+    ]
+
+    # stitch the ranges in time order
+    for future in futures:
+        chunk_tracker, seconds = future.result()
+        tracker.extend(chunk_tracker)
+        metrics.observe("chunk", seconds)
+        metrics.inc("chunks")
+
+    return tracker
+
+def _segments_key(segments):
+    return [(s["class"], s["start_timestamp"], s["final_timestamp"], s["scores"].count) for s in segments]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Detect the poses of a single video in parallel time ranges.")
+    parser.add_argument("video")
+    parser.add_argument("--yogi", choices=settings.YOGI_LIST, default=settings.BEGINNER)
+    parser.add_argument("--workers", type=int, default=settings.CHUNK_WORKERS)
+    parser.add_argument("--chunk-seconds", type=float, default=settings.CHUNK_SECONDS)
+    parser.add_argument("--compare", action="store_true", help="also run the sequential detection and compare both")
+    args = parser.parse_args()
+
+    model_path = settings.MODELS_DICT[args.yogi]
+    model_thresh = settings.MODEL_THRESH_DICT[args.yogi]
+
+    # warm the pool up, so that the timing excludes process start-up & model loading
+    detect(args.video, model_path, SegmentTracker(model_thresh), args.workers, args.chunk_seconds)
+
+    start = time.perf_counter()
+    segments = detect(args.video, model_path, SegmentTracker(model_thresh), args.workers, args.chunk_seconds).merged()
+    report = {"workers": args.workers or os.cpu_count(), "segments": len(segments), "chunked_s": round(time.perf_counter() - start, 3)}
+
+    if args.compare:
+        tracker = SegmentTracker(model_thresh)
+        start = time.perf_counter()
+        while_video(cv2.VideoCapture(args.video), load_model(model_path)[0], tracker,
+                    batch_size=settings.BATCH_SIZE, sampling=settings.SAMPLING_MODE)
+        sequential = tracker.merged()
+        report["sequential_s"] = round(time.perf_counter() - start, 3)
+        report["speedup"] = round(report["sequential_s"] / report["chunked_s"], 2)
+        report["identical"] = _segments_key(sequential) == _segments_key(segments)
+
+    shutdown()
+    print(json.dumps(report, indent=2))
@@ -1,14 +1,32 @@
-from ultralytics import YOLO
+from pathlib import Path
+import os
 import streamlit as st
 import cv2
-import datetime
 import settings
+import registry
+import backends
+import cascade
+import pipeline
+import cache
+import telemetry
+import analysis
+import scheduler
+from preview import Preview
+from progress import LiveProgress
+from preprocess import FrameBatch
+import capture
+from segments import SegmentTracker
 import traceback
 
-predictions = []
+def _uses_cascade(model_path):
+    return settings.CASCADE and Path(model_path).resolve() == Path(settings.ADVANCED_MODEL).resolve()
 
 def load_model(model_path):
-    model = YOLO(model_path)
+    # models are loaded once per process and shared across sessions
+    if _uses_cascade(model_path):
+        model = cascade.get_model()
+    else:
+        model = registry.get_model(model_path)
     classes = model.names
     return model, classes
 
@@ -43,100 +61,325 @@ def fill_table(cols, value_1, value_2, value_3, value_4):
     col2.write(value_3)
     col3.write(value_4)
 
-def while_video(vid_cap, model, model_thresh, frame_window=None):
-    # predictions = [] # store predictions
-    global predictions
+def _classify_batch(model, frames, probs=None, metrics=telemetry.NULL_METRICS, scheduled=False):
+    """
+    Classify a batch of frames with a single model call and return the
+    (class, score) pair of every frame in the input order. If a probs list
+    is given, the full probability vector of every frame is appended to it.
+
+    With scheduled=True the frames go through the model's shared
+    InferenceScheduler, which batches them with the frames of other sessions.
+    Models evicted from the registry meanwhile, and models that keep
+    per-session state (schedulable = False, e.g. the cascade), are run directly.
+    """
+    scheduled = scheduled and probs is None and getattr(model, "schedulable", True)
+    model_scheduler = scheduler.get(model, _classify_batch) if scheduled else None
+    if model_scheduler is not None:
+        try:
+            with metrics.span("scheduled_forward"): # waiting for the batch + forward pass
+                labels = model_scheduler.classify(frames)
+            metrics.inc("frames_processed", len(labels))
+            return labels
+        except (scheduler.SchedulerClosed, scheduler.SchedulerTimeout):
+            pass # evicted (or stopped) while the frames were queued, or a forward pass hangs
+
     classes = model.names # get poses
-    
+
+    # models are shared between sessions, only one forward pass may run at a time
+    with registry.inference_lock(model), metrics.span("forward"): # preprocessing + forward pass
+        results = model(frames, verbose=False)
+
+    # copying the scores to the host waits for the device to finish
+    with metrics.span("sync"):
+        if probs is not None:
+            probs.extend(r.probs.data.cpu().numpy() for r in results)
+
+        labels = [(classes[r.probs.top1], float(r.probs.top1conf.cpu())) for r in results]
+
+    metrics.inc("frames_processed", len(labels))
+    return labels
+
+def _classify_preprocessed(model, classify, frame_batch, probs=None, metrics=telemetry.NULL_METRICS):
+    """
+    Classify the frames of a preprocess.FrameBatch with the classify function
+    of backends.batch_classifier, as _classify_batch does with raw frames.
+    """
+    classes = model.names
+
+    with registry.inference_lock(model), metrics.span("forward"): # forward pass only
+        batch_probs = classify(frame_batch.batch)
+
+    with metrics.span("sync"):
+        if probs is not None:
+            probs.extend(batch_probs)
+
+        top1 = batch_probs.argmax(axis=1)
+        labels = [(classes[int(cls)], float(frame_probs[cls])) for cls, frame_probs in zip(top1, batch_probs)]
+
+    metrics.inc("frames_processed", len(labels))
+    return labels
+
+def while_video(vid_cap, model, tracker, frame_window=None, batch_size=1, pipelined=False,
+                sampling=settings.DENSE_SAMPLING, stride=settings.SAMPLING_STRIDE, tolerance_ms=settings.SAMPLING_TOLERANCE_MS,
+                recorder=None, metrics=telemetry.NULL_METRICS, scheduled=False, progress=None):
+    """
+    Classify the frames of the given capture and record the detected poses
+    in the given SegmentTracker.
+    Frames are gathered into batches of batch_size frames which are classified
+    with one model call, then fed to the segmentation in timestamp order.
+
+    sampling selects which frames are classified:
+        DENSE_SAMPLING: every frame
+        STRIDE_SAMPLING: every stride-th frame
+        ADAPTIVE_SAMPLING: every stride-th frame while the pose is stable,
+            refined around pose changes down to tolerance_ms (no batching)
+
+    With pipelined=True decoding, inference and rendering run concurrently
+    (see pipeline.run) on every frame and the per-stage statistics are returned.
+
+    If a frame_window is given, the frames are shown in it through a
+    throttled, downscaled Preview.
+
+    If a probstore.ProbabilityRecorder is given, the probability vectors of
+    the classified frames are recorded as well (dense and stride sampling only).
+
+    Stage latencies and frame counters are recorded in the given telemetry
+    Metrics.
+
+    With scheduled=True the frames are classified through the model's shared
+    InferenceScheduler (dense, stride and pipelined processing).
+
+    If a progress.LiveProgress is given, it is updated with the segments
+    closed so far at its throttled refresh rate.
+
+    With PREALLOCATED_PREPROCESSING, dense and stride sampling decode and
+    preprocess the frames into preallocated buffers (see preprocess.FrameBatch)
+    when the model supports it (see backends.batch_classifier) and the frames
+    are not scheduled.
+    """
+    preview = Preview(frame_window) if frame_window else None
+
+    # models with per-session state (e.g. the cascade) start afresh
+    if hasattr(model, "reset_session"):
+        model.reset_session()
+
+    if pipelined:
+        render = preview.show if preview else None
+
+        if progress:
+            def on_result(cls, score, timestamp):
+                tracker.update(cls, score, timestamp)
+                progress.update(tracker)
+        else:
+            on_result = tracker.update
+
+        timestamp, stats = pipeline.run(
+            vid_cap,
+            classify=lambda frames: _classify_batch(model, frames, metrics=metrics, scheduled=scheduled),
+            on_result=on_result,
+            render=render,
+            batch_size=batch_size,
+            metrics=metrics
+        )
+
+        tracker.finalize(timestamp)
+        if preview:
+            metrics.inc("preview_dropped", preview.dropped)
+
+        return stats
+
+    if sampling == settings.ADAPTIVE_SAMPLING:
+        return _while_video_adaptive(vid_cap, model, tracker, preview, stride, tolerance_ms, metrics, progress)
+
+    if sampling != settings.STRIDE_SAMPLING:
+        stride = 1
+
+    frames, timestamps = [], [] # current batch
+
+    # frames are preprocessed into a preallocated input batch if the model can classify one
+    classifier = backends.batch_classifier(model) if settings.PREALLOCATED_PREPROCESSING and not scheduled else None
+    frame_batch = FrameBatch(classifier[0], batch_size) if classifier else None
+    timestamp = None
+    frame_idx = -1
+
     # start video analysis
     while (vid_cap.isOpened()):
-        success, frame = vid_cap.read()
+        frame_idx += 1
+        sampled = frame_idx % stride == 0
+
+        # skipped frames are only grabbed, not decoded, unless they are displayed
+        with metrics.span("decode"):
+            if sampled or (preview and preview.due()):
+                success, frame = frame_batch.read(vid_cap) if frame_batch is not None else vid_cap.read()
+            else:
+                success, frame = vid_cap.grab(), None
+
         if success:
+            metrics.inc("frames_decoded")
             
             # settings for live stream
-            if frame_window:    
-                frame_window.image(frame, channels="BGR", width=1280)
-
-            # get timestamp and results
-            timestamp = vid_cap.get(cv2.CAP_PROP_POS_MSEC)                
-
-            results = model(frame, verbose=False)
-
-            for r in results:
-                cls = classes[r.probs.top1]
-                score = float(r.probs.top1conf.cpu())
-
-                if score >= model_thresh:
-
-                    # check whether there is a new movement or the initial condition
-                    if not predictions or predictions[-1]["class"] != cls:
-                        
-                        # finalize previous movement if exists
-                        if predictions:
-                            predictions[-1]["final_timestamp"] = timestamp
-                            predictions[-1]["duration"] = datetime.timedelta(milliseconds=predictions[-1]["final_timestamp"] - predictions[-1]["start_timestamp"])
-                            predictions[-1]["avg_score"] = sum(predictions[-1]["scores"])/len(predictions[-1]["scores"])
-
-                            if predictions[-1]["duration"].total_seconds() < 1:
-                                predictions = predictions[:-1]
-
-                        predictions.append(
-                            {
-                                "class": cls,
-                                "scores": [score],
-                                "avg_score": None,
-                                "final_timestamp": None,
-                                "start_timestamp": timestamp,
-                                "duration": None
-                            }
-                        )
+            if preview and frame is not None:
+                with metrics.span("render"):
+                    preview.show(frame)
+
+            # get timestamp of the frame
+            timestamp = vid_cap.get(cv2.CAP_PROP_POS_MSEC)
+
+            if not sampled:
+                metrics.inc("frames_skipped")
+                continue
+
+            if frame_batch is not None:
+                with metrics.span("preprocess"):
+                    frame_batch.add(frame)
+            else:
+                frames.append(frame)
+            timestamps.append(timestamp)
+
+            if len(timestamps) < batch_size:
+                continue
 
-                    else:
-                        predictions[-1]["scores"].append(score)
-                    
         else:
             vid_cap.release()
+
+        # classify the gathered frames and update the detected poses
+        if timestamps:
+            probs = [] if recorder else None
+            if frame_batch is not None:
+                labels = _classify_preprocessed(model, classifier[1], frame_batch, probs, metrics)
+                frame_batch.clear()
+            else:
+                labels = _classify_batch(model, frames, probs, metrics, scheduled)
+            with metrics.span("segment"):
+                for (cls, score), frame_timestamp in zip(labels, timestamps):
+                    tracker.update(cls, score, frame_timestamp)
+            if progress:
+                progress.update(tracker)
+            if recorder:
+                recorder.append(timestamps, probs)
+            frames, timestamps = [], []
+
+        if not success:
             break
 
-    if predictions:
-        predictions[-1]["final_timestamp"] = timestamp
-        predictions[-1]["duration"] = datetime.timedelta(milliseconds=predictions[-1]["final_timestamp"] - predictions[-1]["start_timestamp"])
-        predictions[-1]["avg_score"] = sum(predictions[-1]["scores"])/len(predictions[-1]["scores"])
+    tracker.finalize(timestamp)
+    if recorder:
+        recorder.final_timestamp = timestamp
+    if preview:
+        metrics.inc("preview_dropped", preview.dropped)
 
-def post_process_predictions(live=False):
-    global predictions
-    
-    if live:
-        # since the last prediction would be probably for stopping the video, we remove it
-        predictions = predictions[:-1]
-    
-    cols = _create_table_view("Click here for the detected poses during your routine!", "ID", "Detected Pose", "Duration", "How Confident Are We?", True)
+def _refine_boundary(model, buffer, previous_cls, previous_timestamp, model_thresh, tolerance_ms, metrics=telemetry.NULL_METRICS):
+    """
+    Bisect the buffered frames between a frame classified as previous_cls and
+    the last buffered frame (classified as another pose) until the pose change
+    is located within tolerance_ms. If the first frame of the new pose is not
+    confident enough, the frames after it are classified densely. Returns the
+    (class, score, timestamp) of the classified frames in timestamp order.
+    """
+    samples = {}
+    lo, hi = -1, len(buffer) - 1
+    lo_timestamp = previous_timestamp
 
-    cleaned_predictions = []
+    while hi - lo > 1 and buffer[hi][1] - lo_timestamp > tolerance_ms:
+        mid = (lo + hi) // 2
+        cls, score = _classify_batch(model, [buffer[mid][0]], metrics=metrics)[0]
+        samples[mid] = (cls, score, buffer[mid][1])
 
-    for i in range(len(predictions)):
-        if cleaned_predictions and predictions[i]["class"] == cleaned_predictions[-1]["class"]:
-            cleaned_predictions[-1]["final_timestamp"] = predictions[i]["final_timestamp"]
-            cleaned_predictions[-1]["scores"].extend(predictions[i]["scores"])
+        if cls == previous_cls:
+            lo, lo_timestamp = mid, buffer[mid][1]
         else:
-            cleaned_predictions.append(predictions[i])
+            hi = mid
 
-    for i in range(len(cleaned_predictions)):
-        cleaned_predictions[i]["duration"] = datetime.timedelta(milliseconds=cleaned_predictions[i]["final_timestamp"] - cleaned_predictions[i]["start_timestamp"])
-        cleaned_predictions[i]["avg_score"] = sum(cleaned_predictions[i]["scores"])/len(cleaned_predictions[i]["scores"])
+    if hi in samples and samples[hi][1] < model_thresh and hi + 1 < len(buffer) - 1:
+        labels = _classify_batch(model, [frame for frame, _ in buffer[hi + 1:-1]], metrics=metrics)
+        for i, (cls, score) in enumerate(labels, start=hi + 1):
+            samples[i] = (cls, score, buffer[i][1])
 
-        # visualize detection results 
-        reference_date = datetime.datetime(1900, 1, 1) # convert timedelta to datetime for visualization
-        duration_in_min_sec = reference_date + cleaned_predictions[i]["duration"]
-        duration_in_min_sec = duration_in_min_sec.strftime("%M:%S.%f")[:-3]
+    return [samples[i] for i in sorted(samples)]
 
-        fill_table(cols, i, cleaned_predictions[i]["class"], duration_in_min_sec, round(cleaned_predictions[i]["avg_score"], 2))
-    
-    predictions = [] # clear global parameter for upcoming predictions
-    
+def _while_video_adaptive(vid_cap, model, tracker, preview, stride, tolerance_ms, metrics=telemetry.NULL_METRICS, progress=None):
+    """
+    Classify every stride-th frame while the detected pose is stable and
+    bisect the skipped frames whenever the pose changes, so that segment
+    boundaries stay accurate to tolerance_ms. Frames are classified densely
+    as long as the last classified frame is below the threshold.
+    """
+    buffer = [] # (frame, timestamp) read since the last classified frame
+    last = None # (class, score, timestamp) of the last classified frame
+    timestamp = None
+
+    while (vid_cap.isOpened()):
+        with metrics.span("decode"):
+            success, frame = vid_cap.read()
+        if success:
+            metrics.inc("frames_decoded")
+
+            # settings for live stream
+            if preview:
+                with metrics.span("render"):
+                    preview.show(frame)
+
+            timestamp = vid_cap.get(cv2.CAP_PROP_POS_MSEC)
+            buffer.append((frame, timestamp))
+
+            if last is not None and last[1] >= tracker.model_thresh and len(buffer) < stride:
+                continue
+
+        else:
+            vid_cap.release()
+            if not buffer:
+                break
+
+        cls, score = _classify_batch(model, [buffer[-1][0]], metrics=metrics)[0]
+        samples = []
+
+        # pose change between the two samples, look for it in the skipped frames
+        if last is not None and cls != last[0]:
+            samples = _refine_boundary(model, buffer, last[0], last[2], tracker.model_thresh, tolerance_ms, metrics)
+
+        last = (cls, score, buffer[-1][1])
+        with metrics.span("segment"):
+            for sample_cls, sample_score, sample_timestamp in samples + [last]:
+                tracker.update(sample_cls, sample_score, sample_timestamp)
+        if progress:
+            progress.update(tracker)
+
+        buffer = []
+
+        if not success:
+            break
+
+    tracker.finalize(timestamp)
+    if preview:
+        metrics.inc("preview_dropped", preview.dropped)
+
+def post_process_predictions(tracker, live=False, metrics=telemetry.NULL_METRICS):
+    """
+    Merge the segments recorded in the tracker, show them in a table and
+    return them. The tracker is cleared for upcoming predictions.
+    """
+    with metrics.span("postprocess"):
+        cleaned_predictions = tracker.merged(live=live)
+    return show_predictions(cleaned_predictions, metrics)
+
+def show_predictions(cleaned_predictions, metrics=telemetry.NULL_METRICS):
+    """
+    Show the finalized segments in a table and return them.
+    """
+    with metrics.span("render_table"):
+        _show_predictions(cleaned_predictions)
+
+    metrics.inc("segments", len(cleaned_predictions))
     return cleaned_predictions
 
-def play_stored_video(model, model_thresh):
+def _show_predictions(cleaned_predictions):
+    cols = _create_table_view("Click here for the detected poses during your routine!", "ID", "Detected Pose", "Duration", "How Confident Are We?", True)
+
+    # visualize detection results
+    for segment in analysis.detected_segments(cleaned_predictions):
+        fill_table(cols, segment.index, segment.pose, segment.duration_text, round(segment.avg_score, 2))
+
+def play_stored_video(model_path, model_thresh, metrics=telemetry.NULL_METRICS):
     source_vid = "video_1" 
 
     with open(settings.VIDEOS_DICT.get(source_vid), 'rb') as video_file:
@@ -167,22 +410,73 @@ def play_stored_video(model, model_thresh):
                 unsafe_allow_html=True,
             )
             try:
-                captured_video = cv2.VideoCapture(str(settings.VIDEOS_DICT.get(source_vid)))
+                video_path = settings.VIDEOS_DICT.get(source_vid)
+                tracker = SegmentTracker(model_thresh)
+
+                # reuse the detections if neither the video, the model nor the settings changed
+                key = None
+                if settings.CACHE_ENABLED:
+                    key = cache.detection_key(
+                        video_path,
+                        model_path,
+                        backend=settings.INFERENCE_BACKEND,
+                        quantized=settings.ONNX_QUANTIZE,
+                        preallocated=settings.PREALLOCATED_PREPROCESSING,
+                        model_thresh=model_thresh,
+                        cascade=_uses_cascade(model_path) and (settings.CASCADE_GATE, settings.CASCADE_LABEL_MAP,
+                                                               cache.file_digest(settings.BEGINNER_MODEL)),
+                        min_duration=tracker.min_duration,
+                        smoothing=tracker.smoothing,
+                        smoothing_window=tracker.window,
+                        sampling=settings.SAMPLING_MODE,
+                        stride=settings.SAMPLING_STRIDE,
+                        tolerance_ms=settings.SAMPLING_TOLERANCE_MS,
+                        # adaptive sampling restarts at every range, so the ranges change the segments
+                        chunks=settings.CHUNKED_DETECTION and (settings.CHUNK_SECONDS, settings.CHUNK_WORKERS or os.cpu_count())
+                    )
+                    cleaned_predictions = cache.get(key)
+                    # a video analyzed before is not recorded in the history again
+                    st.session_state["DETECTIONS_CACHED"] = cleaned_predictions is not None
+                    if cleaned_predictions is not None:
+                        metrics.inc("cache_hits")
+                        return show_predictions(cleaned_predictions, metrics)
 
-                # process the video with YOLO
-                while_video(captured_video, model, model_thresh)
+                # process the video with YOLO, either in parallel time ranges or sequentially
+                with metrics.span("video"):
+                    if settings.CHUNKED_DETECTION:
+                        import chunks # chunks imports while_video from this module
+                        chunks.detect(video_path, model_path, tracker, metrics=metrics)
+                    else:
+                        model, _ = load_model(model_path)
+                        captured_video = cv2.VideoCapture(str(video_path))
+                        while_video(captured_video, model, tracker, batch_size=settings.BATCH_SIZE, sampling=settings.SAMPLING_MODE, metrics=metrics)
 
                 # postprocess and return the final predictions
-                return post_process_predictions()
+                with metrics.span("postprocess"):
+                    cleaned_predictions = tracker.merged()
+                if key:
+                    cache.put(key, cleaned_predictions)
+
+                return show_predictions(cleaned_predictions, metrics)
                 
             except Exception as e:
                 st.sidebar.error("Error during prediction on stored video: " + str(e))
                 if settings.DEBUG:
                     st.sidebar.error(traceback.format_exc())
 
-def play_livevideo(model, model_thresh):
+def end_live_session(state):
+    """
+    Close the camera of the live session of a streamlit session and discard
+    its detections, e.g. once another source is selected.
+    """
+    capture.close_session_capture(state)
+    for key in ("LIVE_TRACKER", "LIVE_ANALYSIS", "LIVE_MODEL"):
+        state.pop(key, None)
 
-    FRAME_WINDOW = st.image([], width=1280)
+def play_livevideo(model_path, model_thresh, metrics=telemetry.NULL_METRICS, user_routine=None, duration_tolerance=0):
+
+    FRAME_WINDOW = st.image([], width=settings.PREVIEW_DISPLAY_WIDTH)
+    PROGRESS_PANEL = st.empty()
 
     stop = st.button("Stop")
     
@@ -192,14 +486,50 @@ def play_livevideo(model, model_thresh):
     
     else:
         try: 
+            model, _ = load_model(model_path)
+
+            # a live session started with another model (yogi level) is discarded
+            if st.session_state.get("LIVE_MODEL", str(model_path)) != str(model_path):
+                end_live_session(st.session_state)
+            st.session_state["LIVE_MODEL"] = str(model_path)
+
+            # "Stop" reruns the script, so the session's detections have to survive the rerun
+            if "LIVE_TRACKER" not in st.session_state:
+                st.session_state["LIVE_TRACKER"] = SegmentTracker(model_thresh)
+            tracker = st.session_state["LIVE_TRACKER"]
+
+            # the routine progress is updated with the segments closed during the session
+            progress = None
+            if settings.LIVE_PROGRESS and user_routine is not None:
+                if "LIVE_ANALYSIS" not in st.session_state:
+                    st.session_state["LIVE_ANALYSIS"] = analysis.LiveAnalysis(user_routine, duration_tolerance)
+                progress = LiveProgress(PROGRESS_PANEL, st.session_state["LIVE_ANALYSIS"], metrics=metrics)
+
+            # the camera is opened once and stays open across reruns until "Stop", a source change or the end of the session
+            live_cam = None
+            if not stop:
+                live_cam = capture.session_capture(st.session_state, settings.WEBCAM_PATH)
+
             while not stop: # st.session_state['ROUTINE']:
-                # start live video
-                live_cam = cv2.VideoCapture(settings.WEBCAM_PATH)
-                # process the video with YOLO
-                while_video(live_cam, model, model_thresh, FRAME_WINDOW)
-            
+                # process the live video with YOLO, returns if no frame arrives in time
+                while_video(live_cam, model, tracker, FRAME_WINDOW, batch_size=settings.LIVE_BATCH_SIZE,
+                            pipelined=settings.LIVE_PIPELINE, metrics=metrics, scheduled=settings.LIVE_SCHEDULER, progress=progress)
+
             # postprocess and return the final predictions
-            return post_process_predictions(live=True)
+            end_live_session(st.session_state)
+            return post_process_predictions(tracker, live=True, metrics=metrics)
 
         except Exception as e:
-            st.sidebar.error("Error during prediction on webcam video: " + str(e))
\ No newline at end of file
+            st.sidebar.error("Error during prediction on webcam video: " + str(e))
+
+def show_metrics(metrics):
+    """
+    Debug panel with the counters and stage latencies of the session.
+    """
+    snapshot = metrics.snapshot()
+
+    with st.sidebar.expander("Performance metrics"):
+        if snapshot["counters"]:
+            st.table(snapshot["counters"])
+        if snapshot["stages"]:
+            st.table(snapshot["stages"])
@@ -0,0 +1,376 @@
+"""
+Session history store for trend analytics across routines.
+
+Every analyzed session is recorded in an SQLite database (settings.HISTORY_DB)
+with its routine, its merged segments and per-pose results. The app has no
+user accounts, so the history holds every session analyzed by the server.
+
+    sessions        one row per session
+    routine_steps   the planned routine, step by step
+    segments        the merged segments (SegmentTracker.merged)
+    session_poses   per session and pose: planned / detected seconds, missed,
+                    fulfilled, confidence and overall score
+
+Sessions are written in bulk: HistoryStore.add buffers them and flush writes
+the buffer in a single transaction. The same transaction updates the daily
+rollups (pose_daily, daily), so the history view and the trend queries below
+read one row per day and pose instead of scanning the raw segments of every
+session.
+
+    python history.py --days 30     # print the trends of the last 30 days
+"""
+import argparse
+import datetime
+import json
+from pathlib import Path
+import sqlite3
+import threading
+import time
+
+import settings
+import analysis
+
+SCHEMA_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    started_at REAL NOT NULL,
+    day TEXT NOT NULL,
+    source TEXT,
+    yogi TEXT,
+    analysis TEXT,
+    duration_tolerance REAL,
+    segments INTEGER NOT NULL,
+    detected_seconds REAL NOT NULL,
+    planned_seconds REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_day ON sessions (day);
+
+CREATE TABLE IF NOT EXISTS routine_steps (
+    session_id INTEGER NOT NULL REFERENCES sessions (id) ON DELETE CASCADE,
+    step INTEGER NOT NULL,
+    pose TEXT NOT NULL,
+    planned_seconds REAL NOT NULL,
+    PRIMARY KEY (session_id, step)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS segments (
+    session_id INTEGER NOT NULL REFERENCES sessions (id) ON DELETE CASCADE,
+    idx INTEGER NOT NULL,
+    pose TEXT NOT NULL,
+    start_ms REAL,
+    duration_seconds REAL NOT NULL,
+    avg_score REAL NOT NULL,
+    PRIMARY KEY (session_id, idx)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS segments_pose ON segments (pose, session_id);
+
+CREATE TABLE IF NOT EXISTS session_poses (
+    session_id INTEGER NOT NULL REFERENCES sessions (id) ON DELETE CASCADE,
+    pose TEXT NOT NULL,
+    planned_steps INTEGER NOT NULL,
+    planned_seconds REAL NOT NULL,
+    detected_seconds REAL NOT NULL,
+    segments INTEGER NOT NULL,
+    score_sum REAL NOT NULL,
+    missed INTEGER NOT NULL,
+    fulfilled INTEGER NOT NULL,
+    overall_score REAL,
+    PRIMARY KEY (session_id, pose)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS session_poses_pose ON session_poses (pose, session_id);
+
+CREATE TABLE IF NOT EXISTS pose_daily (
+    day TEXT NOT NULL,
+    pose TEXT NOT NULL,
+    sessions INTEGER NOT NULL,
+    planned INTEGER NOT NULL,
+    missed INTEGER NOT NULL,
+    fulfilled INTEGER NOT NULL,
+    planned_seconds REAL NOT NULL,
+    detected_seconds REAL NOT NULL,
+    segments INTEGER NOT NULL,
+    score_sum REAL NOT NULL,
+    overall_sum REAL NOT NULL,
+    overall_count INTEGER NOT NULL,
+    PRIMARY KEY (day, pose)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS pose_daily_pose ON pose_daily (pose, day);
+
+CREATE TABLE IF NOT EXISTS daily (
+    day TEXT PRIMARY KEY,
+    sessions INTEGER NOT NULL,
+    segments INTEGER NOT NULL,
+    detected_seconds REAL NOT NULL,
+    planned_seconds REAL NOT NULL
+) WITHOUT ROWID;
+"""
+
+# the rollup columns are sums, so a batch of sessions is added with one upsert per (day, pose)
+_POSE_DAILY_COLUMNS = ("sessions", "planned", "missed", "fulfilled", "planned_seconds", "detected_seconds",
+                       "segments", "score_sum", "overall_sum", "overall_count")
+_DAILY_COLUMNS = ("sessions", "segments", "detected_seconds", "planned_seconds")
+
+_store = None
+_lock = threading.Lock()
+
+
+def _upsert(table, keys, columns):
+    names = ", ".join(keys + columns)
+    values = ", ".join("?" * len(keys + columns))
+    updates = ", ".join(f"{column} = {column} + excluded.{column}" for column in columns)
+    return f"INSERT INTO {table} ({names}) VALUES ({values}) ON CONFLICT ({', '.join(keys)}) DO UPDATE SET {updates}"
+
+def _seconds(duration):
+    # merged segments hold a timedelta, serialized ones (batch.segment_to_dict) seconds
+    return duration.total_seconds() if isinstance(duration, datetime.timedelta) else float(duration)
+
+def _since(days):
+    if days is None:
+        return ""
+    return (datetime.date.today() - datetime.timedelta(days=days - 1)).isoformat()
+
+
+class HistoryStore:
+    """
+    SQLite store of the analyzed sessions. One connection per store, shared
+    by the threads (sessions) of the process under a lock; several processes
+    can write to the same database.
+    """
+    def __init__(self, path=settings.HISTORY_DB, batch_size=settings.HISTORY_BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self._pending = []
+        self._lock = threading.Lock()
+
+        if str(path) != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(str(path), timeout=30, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode = WAL")
+        self._connection.execute("PRAGMA synchronous = NORMAL")
+        self._connection.execute("PRAGMA foreign_keys = ON")
+        self._connection.executescript(_SCHEMA)
+        self._connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add(self, segments, user_routine, yogi=None, analysis_level=None, duration_tolerance=0, overall_scores=None,
+            source=None, started_at=None, basic_results=None):
+        """
+        Buffer a session, the buffer is written once it holds batch_size
+        sessions (see flush).
+        Input:
+            segments: segments returned by SegmentTracker.merged, or as serialized by batch.segment_to_dict
+            user_routine: {"Pose": [...], "Minutes": [...], "Seconds": [...]}
+            overall_scores: overall score per pose of the detailed analysis, if computed
+            started_at: unix time of the session, now by default
+            basic_results: BasicAnalysis.to_dict() of the session, if computed; else the basic
+                analysis is run here, for the missed and fulfilled poses
+        """
+        started_at = time.time() if started_at is None else started_at
+        day = datetime.date.fromtimestamp(started_at).isoformat()
+        duration_tolerance = duration_tolerance or 0
+
+        steps = [(pose, minutes * 60 + seconds) for pose, minutes, seconds in
+                 zip(user_routine["Pose"], user_routine["Minutes"], user_routine["Seconds"])]
+        segment_rows = [(i, segment["class"], segment.get("start_timestamp"), _seconds(segment["duration"]), float(segment["avg_score"]))
+                        for i, segment in enumerate(segments)]
+
+        # pose -> [planned_steps, planned_seconds, detected_seconds, segments, score_sum]
+        poses = {}
+        for pose, planned_seconds in steps:
+            stats = poses.setdefault(pose, [0, 0.0, 0.0, 0, 0.0])
+            stats[0] += 1
+            stats[1] += planned_seconds
+        for _, pose, _, duration, score in segment_rows:
+            stats = poses.setdefault(pose, [0, 0.0, 0.0, 0, 0.0])
+            stats[2] += duration
+            stats[3] += 1
+            stats[4] += score
+
+        if basic_results is None:
+            merged = [{"class": segment["class"], "duration": datetime.timedelta(seconds=_seconds(segment["duration"]))} for segment in segments]
+            basic_results = analysis.compute_basic(merged, user_routine, duration_tolerance)
+
+        pose_rows = []
+        for pose, (planned_steps, planned_seconds, detected_seconds, n_segments, score_sum) in poses.items():
+            check = basic_results.get(pose)
+            missed = check is not None and not check["detected"]
+            fulfilled = check is not None and check["fulfilled"]
+            overall_score = overall_scores.get(pose) if overall_scores else None
+            pose_rows.append((pose, planned_steps, planned_seconds, detected_seconds, n_segments, score_sum,
+                              int(missed), int(fulfilled), overall_score))
+
+        session = (started_at, day, source, yogi, analysis_level, duration_tolerance, len(segment_rows),
+                   sum(row[3] for row in segment_rows), sum(planned for _, planned in steps))
+
+        with self._lock:
+            self._pending.append((session, steps, segment_rows, pose_rows))
+            if len(self._pending) >= self.batch_size:
+                self._flush()
+
+    def flush(self):
+        """
+        Write the buffered sessions and their rollups in one transaction.
+        """
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+
+        pose_daily, daily = {}, {}
+        for session, _, _, pose_rows in self._pending:
+            day = session[1]
+            totals = daily.setdefault(day, [0, 0, 0.0, 0.0])
+            for i, value in enumerate((1, session[6], session[7], session[8])):
+                totals[i] += value
+
+            for pose, planned_steps, planned_seconds, detected_seconds, n_segments, score_sum, missed, fulfilled, overall_score in pose_rows:
+                totals = pose_daily.setdefault((day, pose), [0, 0, 0, 0, 0.0, 0.0, 0, 0.0, 0.0, 0])
+                values = (1, int(bool(planned_steps)), missed, fulfilled, planned_seconds, detected_seconds, n_segments, score_sum,
+                          overall_score or 0.0, int(overall_score is not None))
+                for i, value in enumerate(values):
+                    totals[i] += value
+
+        connection = self._connection
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            for session, steps, segment_rows, pose_rows in self._pending:
+                session_id = connection.execute(
+                    "INSERT INTO sessions (started_at, day, source, yogi, analysis, duration_tolerance, segments, detected_seconds, planned_seconds) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", session).lastrowid
+                connection.executemany("INSERT INTO routine_steps VALUES (?, ?, ?, ?)",
+                                       [(session_id, i, pose, seconds) for i, (pose, seconds) in enumerate(steps)])
+                connection.executemany("INSERT INTO segments VALUES (?, ?, ?, ?, ?, ?)",
+                                       [(session_id, *row) for row in segment_rows])
+                connection.executemany("INSERT INTO session_poses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                       [(session_id, *row) for row in pose_rows])
+
+            connection.executemany(_upsert("pose_daily", ("day", "pose"), _POSE_DAILY_COLUMNS),
+                                   [(*key, *totals) for key, totals in pose_daily.items()])
+            connection.executemany(_upsert("daily", ("day",), _DAILY_COLUMNS),
+                                   [(day, *totals) for day, totals in daily.items()])
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+        self._pending = []
+
+    def rebuild_rollups(self):
+        """
+        Recompute the rollups from the raw tables, e.g. after sessions were
+        deleted by hand.
+        """
+        self.flush()
+        with self._lock:
+            connection = self._connection
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.execute("DELETE FROM pose_daily")
+                connection.execute("DELETE FROM daily")
+                connection.execute(
+                    "INSERT INTO pose_daily SELECT s.day, p.pose, COUNT(*), SUM(p.planned_steps > 0), SUM(p.missed), SUM(p.fulfilled), "
+                    "SUM(p.planned_seconds), SUM(p.detected_seconds), SUM(p.segments), SUM(p.score_sum), "
+                    "TOTAL(p.overall_score), COUNT(p.overall_score) "
+                    "FROM session_poses p JOIN sessions s ON s.id = p.session_id GROUP BY s.day, p.pose")
+                connection.execute(
+                    "INSERT INTO daily SELECT day, COUNT(*), SUM(segments), SUM(detected_seconds), SUM(planned_seconds) "
+                    "FROM sessions GROUP BY day")
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+
+    def _query(self, sql, parameters=()):
+        with self._lock:
+            cursor = self._connection.execute(sql, parameters)
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def daily_totals(self, days=None):
+        """
+        Sessions, segments and detected / planned seconds per day.
+        """
+        return self._query("SELECT * FROM daily WHERE day >= ? ORDER BY day", (_since(days),))
+
+    def pose_trends(self, days=None, poses=None):
+        """
+        Per day and pose: the sessions with the pose, the average detected
+        seconds per session, the average confidence of its segments and the
+        average overall score.
+        """
+        sql = ("SELECT day, pose, sessions, detected_seconds / sessions AS avg_detected_seconds, "
+               "planned_seconds, detected_seconds, score_sum / NULLIF(segments, 0) AS avg_score, "
+               "overall_sum / NULLIF(overall_count, 0) AS avg_overall_score "
+               "FROM pose_daily WHERE day >= ?")
+        parameters = [_since(days)]
+        if poses:
+            sql += f" AND pose IN ({', '.join('?' * len(poses))})"
+            parameters += list(poses)
+        return self._query(sql + " ORDER BY day, pose", parameters)
+
+    def confidence_trend(self, days=None):
+        """
+        Average confidence of the segments of all poses, per day.
+        """
+        return self._query("SELECT day, SUM(score_sum) / NULLIF(SUM(segments), 0) AS avg_score, SUM(segments) AS segments "
+                           "FROM pose_daily WHERE day >= ? GROUP BY day ORDER BY day", (_since(days),))
+
+    def most_missed(self, days=None, limit=10):
+        """
+        Planned poses by the number of sessions in which they were missed.
+        """
+        return self._query("SELECT pose, SUM(missed) AS missed, SUM(planned) AS planned, "
+                           "CAST(SUM(missed) AS REAL) / SUM(planned) AS missed_share, SUM(fulfilled) AS fulfilled "
+                           "FROM pose_daily WHERE day >= ? AND planned > 0 GROUP BY pose "
+                           "ORDER BY missed DESC, missed_share DESC LIMIT ?", (_since(days), limit))
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self._connection.close()
+
+
+def get_store():
+    """
+    Return the process-wide store of settings.HISTORY_DB.
+    """
+    global _store
+
+    with _lock:
+        if _store is None:
+            _store = HistoryStore()
+        return _store
+
+def record(segments, user_routine, yogi=None, analysis_level=None, duration_tolerance=0, overall_scores=None, source=None,
+           basic_results=None):
+    """
+    Record a session of the app right away.
+    """
+    store = get_store()
+    store.add(segments, user_routine, yogi, analysis_level, duration_tolerance, overall_scores, source,
+              basic_results=basic_results)
+    store.flush()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print the trends of the recorded sessions.")
+    parser.add_argument("--days", type=int, default=settings.HISTORY_DAYS, help="days to include, counting today")
+    parser.add_argument("--rebuild", action="store_true", help="recompute the rollups from the raw tables first")
+    args = parser.parse_args()
+
+    with HistoryStore() as store:
+        if args.rebuild:
+            store.rebuild_rollups()
+        print(json.dumps({
+            "daily": store.daily_totals(args.days),
+            "confidence": store.confidence_trend(args.days),
+            "most_missed": store.most_missed(args.days),
+        }, indent=2))
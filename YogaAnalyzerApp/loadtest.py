@@ -0,0 +1,92 @@
+"""
+Load test of the HTTP API (api.py) with concurrent clients. Every client
+submits the video with the routine, polls the job until it is finished and
+submits the next one; submissions refused with 429 are retried.
+
+    python api.py &
+    python loadtest.py --video videos/video_1_trimmed.mp4 --routine routine.json --clients 8 --jobs 32
+"""
+import argparse
+import asyncio
+import json
+from pathlib import Path
+import time
+
+import aiohttp
+import numpy as np
+
+import settings
+
+
+async def _submit(session, url, video_bytes, video_name, routine, analysis, stats):
+    while True:
+        form = aiohttp.FormData()
+        form.add_field("video", video_bytes, filename=video_name, content_type="application/octet-stream")
+        form.add_field("routine", json.dumps(routine))
+        form.add_field("analysis", analysis)
+
+        async with session.post(f"{url}/jobs", data=form) as response:
+            if response.status == 429:
+                stats["rejected"] += 1
+                await asyncio.sleep(float(response.headers.get("Retry-After", 1)))
+                continue
+            response.raise_for_status()
+            return (await response.json())["id"]
+
+async def _wait(session, url, job_id, poll_interval):
+    while True:
+        async with session.get(f"{url}/jobs/{job_id}") as response:
+            response.raise_for_status()
+            record = await response.json()
+        if record["status"] in ("done", "failed"):
+            return record
+        await asyncio.sleep(poll_interval)
+
+async def _client(session, args, video_bytes, routine, remaining, stats):
+    while remaining:
+        remaining.pop()
+        start = time.perf_counter()
+        job_id = await _submit(session, args.url, video_bytes, Path(args.video).name, routine, args.analysis, stats)
+        record = await _wait(session, args.url, job_id, args.poll_interval)
+
+        stats["latencies"].append(time.perf_counter() - start)
+        stats[record["status"]] += 1
+
+async def run(args):
+    video_bytes = Path(args.video).read_bytes()
+    with open(args.routine) as routine_file:
+        routine = json.load(routine_file)
+
+    stats = {"latencies": [], "done": 0, "failed": 0, "rejected": 0}
+    remaining = list(range(args.jobs))
+
+    start = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(_client(session, args, video_bytes, routine, remaining, stats) for _ in range(args.clients)))
+    elapsed = time.perf_counter() - start
+
+    latencies = np.asarray(stats["latencies"])
+    return {
+        "clients": args.clients,
+        "jobs": args.jobs,
+        "done": stats["done"],
+        "failed": stats["failed"],
+        "rejected_submissions": stats["rejected"],
+        "seconds": round(elapsed, 2),
+        "jobs_per_s": round(len(latencies) / elapsed, 3),
+        "p50_latency_s": round(float(np.percentile(latencies, 50)), 3) if len(latencies) else None,
+        "p99_latency_s": round(float(np.percentile(latencies, 99)), 3) if len(latencies) else None,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the HTTP API with concurrent clients.")
+    parser.add_argument("--url", default=f"http://localhost:{settings.API_PORT}")
+    parser.add_argument("--video", default=str(settings.VIDEOS_DICT["video_1"]))
+    parser.add_argument("--routine", required=True, help="routine JSON file")
+    parser.add_argument("--analysis", choices=settings.ANALYSIS_LIST, default=settings.BASIC)
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--jobs", type=int, default=16)
+    parser.add_argument("--poll-interval", type=float, default=0.5)
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(run(args)), indent=2))
@@ -0,0 +1,296 @@
+"""
+Long-running model host.
+
+Importing ultralytics / PyTorch and loading the weights takes seconds and a
+large part of the memory of a process. With MODEL_HOST enabled, the app
+process never imports the inference stack: a model host process, started
+once ahead of the app (or by the app on its first run), keeps the models of
+the registry loaded and classifies the frames the app sends over a local
+socket. The app only holds RemoteModel proxies, which registry.get_model
+returns in place of the models.
+
+    python modelhost.py [--preload]
+
+Only the standard library is imported at the top of this module, so the app
+can use it (e.g. model_names for the routine planner) before, or without,
+loading the inference stack.
+
+The app and the host authenticate each other with a key that is generated
+once per install and stored readable by its owner only (see _authkey), as
+the host unpickles what its clients send.
+"""
+import argparse
+import json
+from multiprocessing.connection import Client, Listener
+import os
+from pathlib import Path
+import pickle
+import secrets
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+
+import settings
+
+_started = False
+
+
+def _read_key(key_path):
+    if os.name == "posix" and key_path.stat().st_mode & 0o077:
+        raise PermissionError(f"{key_path} must only be accessible by its owner (chmod 600 {key_path})")
+    return key_path.read_bytes()
+
+def _authkey():
+    """
+    Return MODEL_HOST_AUTHKEY if set, else the key of MODEL_HOST_AUTHKEY_FILE,
+    generating a random one on first use.
+    """
+    if os.environ.get("MODEL_HOST_AUTHKEY"):
+        return os.environ["MODEL_HOST_AUTHKEY"].encode()
+
+    key_path = Path(settings.MODEL_HOST_AUTHKEY_FILE)
+    try:
+        return _read_key(key_path)
+    except FileNotFoundError:
+        pass
+
+    # written to a private (0600) temporary file first, linked into place unless another process was faster
+    key_path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=key_path.parent)
+    try:
+        with os.fdopen(fd, "wb") as key_file:
+            key_file.write(secrets.token_hex(32).encode())
+        os.link(tmp_path, key_path)
+    except FileExistsError:
+        pass
+    finally:
+        os.unlink(tmp_path)
+
+    return _read_key(key_path)
+
+def _handle(connection):
+    """
+    Answer the requests of one client connection until it is closed.
+    """
+    import registry
+
+    with connection:
+        while True:
+            try:
+                command, model_path, *args = connection.recv()
+            except (EOFError, OSError):
+                return
+
+            try:
+                model = registry.get_model(model_path)
+                if command == "names":
+                    response = model.names
+                elif command == "classify":
+                    with registry.inference_lock(model):
+                        results = model(args[0], verbose=False)
+                    response = [r.probs.data.cpu().numpy() for r in results]
+                else:
+                    raise ValueError(f"Unknown command: {command}")
+                connection.send(("ok", response))
+            except Exception as e:
+                connection.send(("error", f"{type(e).__name__}: {e}"))
+
+def serve(address=settings.MODEL_HOST_ADDRESS, preload=False):
+    """
+    Run the model host, one thread per client connection.
+    """
+    # the models of this process are the ones served, not proxies to itself
+    settings.MODEL_HOST = False
+    import registry
+
+    with Listener(address, authkey=_authkey()) as listener:
+        if preload:
+            registry.preload_models()
+        print(f"model host listening on {listener.address}", flush=True)
+
+        while True:
+            try:
+                connection = listener.accept()
+            except Exception as e:
+                # e.g. a client with the wrong authkey
+                print(f"refused connection: {e}", file=sys.stderr)
+                continue
+            threading.Thread(target=_handle, args=(connection,), name="model-host-client", daemon=True).start()
+
+def _connect(address, timeout=0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return Client(address, authkey=_authkey())
+        except (ConnectionRefusedError, FileNotFoundError):
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(0.2)
+
+def start(address=settings.MODEL_HOST_ADDRESS):
+    """
+    Start a model host in the background, preloading the models, unless one
+    is already listening. Returns whether a host was started.
+    """
+    global _started
+
+    if _started:
+        return False
+    try:
+        _connect(address).close()
+        return False
+    except (ConnectionRefusedError, FileNotFoundError):
+        pass
+
+    subprocess.Popen([sys.executable, str(Path(__file__).resolve()), "--preload"], cwd=Path(__file__).parent,
+                     stdin=subprocess.DEVNULL, start_new_session=True)
+    _started = True
+    return True
+
+
+class RemoteModel:
+    """
+    Proxy of a model loaded by the model host, with the subset of the
+    ultralytics interface used by helper.py: `names` and
+    `model(frames, verbose=False)`.
+    """
+    def __init__(self, model_path, address=settings.MODEL_HOST_ADDRESS, timeout=settings.MODEL_HOST_CONNECT_TIMEOUT):
+        self.model_path = str(model_path)
+        self.address = address
+        self.timeout = timeout
+        self._connection = None
+        self._lock = threading.Lock()
+        self._names = None
+
+    def _request(self, *request):
+        with self._lock:
+            for attempt in range(2):
+                if self._connection is None:
+                    if settings.MODEL_HOST_AUTOSTART:
+                        start(self.address)
+                    self._connection = _connect(self.address, self.timeout)
+                try:
+                    self._connection.send(request)
+                    status, response = self._connection.recv()
+                    break
+                except (EOFError, OSError):
+                    # the host was restarted, reconnect once
+                    self._connection = None
+                    if attempt:
+                        raise
+
+        if status == "error":
+            raise RuntimeError(f"model host: {response}")
+        return response
+
+    @property
+    def names(self):
+        if self._names is None:
+            self._names = self._request("names", self.model_path)
+        return self._names
+
+    def __call__(self, frames, verbose=False):
+        import backends
+
+        if not isinstance(frames, list):
+            frames = [frames]
+        return backends.results(self._request("classify", self.model_path, frames))
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+class _Stub:
+    """
+    Empty stand-in for the classes of a checkpoint, keeping their plain state.
+    """
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __setstate__(self, state):
+        if isinstance(state, tuple): # (state, slot state)
+            state = state[0]
+        if isinstance(state, dict):
+            self.__dict__.update(state)
+
+
+class _CheckpointUnpickler(pickle.Unpickler):
+    # no class or function of the checkpoint is imported, let alone called
+    def find_class(self, module, name):
+        if (module, name) == ("collections", "OrderedDict"):
+            return super().find_class(module, name)
+        return type(name, (_Stub,), {})
+
+    def persistent_load(self, pid):
+        return None # tensor storages
+
+def checkpoint_names(model_path):
+    """
+    Read the class names of an ultralytics (PyTorch zip) checkpoint without
+    importing torch or ultralytics. Returns None if they cannot be read.
+    """
+    try:
+        with zipfile.ZipFile(model_path) as checkpoint:
+            member = next(name for name in checkpoint.namelist() if name.endswith("/data.pkl"))
+            with checkpoint.open(member) as data:
+                contents = _CheckpointUnpickler(data).load()
+    except (OSError, StopIteration, zipfile.BadZipFile, pickle.UnpicklingError, EOFError, ValueError, TypeError):
+        return None
+
+    if not isinstance(contents, dict):
+        return None
+    for key in ("model", "ema"):
+        names = getattr(contents.get(key), "names", None)
+        if isinstance(names, dict) and names:
+            return {int(i): str(name) for i, name in names.items()}
+        if isinstance(names, (list, tuple)) and names:
+            return {i: str(name) for i, name in enumerate(names)}
+    return None
+
+def model_names(model_path):
+    """
+    Return the class names of a weight file without loading it when
+    possible: from MODEL_NAMES_CACHE if the weights did not change, else from
+    the checkpoint itself (see checkpoint_names), else from the model host,
+    else from the model loaded in this process.
+    """
+    weights = Path(model_path).resolve()
+    key = f"{weights}:{weights.stat().st_mtime_ns}"
+
+    cache_path = Path(settings.MODEL_NAMES_CACHE)
+    try:
+        with open(cache_path) as cache_file:
+            cache = json.load(cache_file)
+    except (FileNotFoundError, ValueError):
+        cache = {}
+    if key in cache:
+        return {int(i): name for i, name in cache[key].items()}
+
+    names = checkpoint_names(weights)
+    if names is None and settings.MODEL_HOST:
+        names = RemoteModel(weights).names
+    elif names is None:
+        import registry
+        names = registry.get_model(weights).names
+
+    cache[key] = names
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_name(cache_path.name + f".{os.getpid()}.tmp")
+    with open(tmp_path, "w") as cache_file:
+        json.dump(cache, cache_file)
+    os.replace(tmp_path, cache_path)
+
+    return names
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the models to the app over a local socket.")
+    parser.add_argument("--preload", action="store_true", help="load every model in MODELS_DICT at startup")
+    args = parser.parse_args()
+
+    serve(preload=args.preload)
@@ -0,0 +1,214 @@
+import queue
+import threading
+import time
+
+import cv2
+
+import settings
+import telemetry
+
+# queue policies when a stage falls behind
+BLOCK = "block" # wait for the slower stage (backpressure, no frame is lost)
+DROP = "drop" # discard the oldest queued frame to make room for the newest one
+
+_DONE = object() # end of stream marker
+
+
+class PipelineStats:
+    """
+    Thread-safe per-stage latency and frame counters of a pipeline run,
+    also forwarded to a telemetry Metrics.
+    """
+    def __init__(self, metrics=telemetry.NULL_METRICS):
+        self.metrics = metrics
+        self._lock = threading.Lock()
+        self.stages = {}
+        self.frames = 0
+        self.dropped = 0
+
+    def record(self, stage, seconds, count=1):
+        with self._lock:
+            total, n, worst = self.stages.get(stage, (0.0, 0, 0.0))
+            self.stages[stage] = (total + seconds, n + count, max(worst, seconds))
+        self.metrics.observe(stage, seconds)
+
+    def add_frame(self):
+        with self._lock:
+            self.frames += 1
+        self.metrics.inc("frames_decoded")
+
+    def add_dropped(self):
+        with self._lock:
+            self.dropped += 1
+        self.metrics.inc("frames_dropped")
+
+    def summary(self):
+        with self._lock:
+            stages = {
+                stage: {"count": n, "avg_ms": round(total * 1000 / n, 2), "max_ms": round(worst * 1000, 2)}
+                for stage, (total, n, worst) in self.stages.items() if n
+            }
+            return {"frames": self.frames, "dropped": self.dropped, "stages": stages}
+
+
+def _put(q, item, policy, stop_event, stats=None):
+    """
+    Put an item on a bounded queue, either waiting for free space or
+    dropping the oldest queued item depending on the policy.
+    """
+    if policy == DROP:
+        while True:
+            try:
+                q.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    q.get_nowait()
+                    if stats:
+                        stats.add_dropped()
+                except queue.Empty:
+                    pass
+
+    while not stop_event.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            continue
+
+def _get(q, stop_event):
+    while not stop_event.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _DONE
+
+def run(vid_cap, classify, on_result, render=None, batch_size=1,
+        queue_size=settings.PIPELINE_QUEUE_SIZE, drop_policy=settings.PIPELINE_DROP_POLICY,
+        metrics=telemetry.NULL_METRICS):
+    """
+    Process a capture with a decoder thread, an inference worker and the
+    calling thread as UI consumer, connected by bounded queues.
+
+    Input:
+        vid_cap: opened cv2.VideoCapture, released once the stream ends
+        classify: callable taking a list of frames and returning one
+            (class, score) pair per frame
+        on_result: callable receiving (class, score, timestamp) in
+            timestamp order, always called on the calling thread
+        render: optional callable receiving the latest decoded frame,
+            always called on the calling thread
+        batch_size: max. number of queued frames classified per call
+        queue_size: capacity of the decoder -> inference queue
+        drop_policy: BLOCK or DROP, applied when inference falls behind
+        metrics: telemetry Metrics receiving the stage latencies and counters
+    Output:
+        last_timestamp: timestamp of the last classified frame or None
+        stats: PipelineStats of the run
+    """
+    stats = PipelineStats(metrics)
+    stop_event = threading.Event()
+    errors = []
+
+    frame_queue = queue.Queue(maxsize=max(queue_size, 1))
+    result_queue = queue.Queue(maxsize=max(queue_size, 1))
+    preview_queue = queue.Queue(maxsize=1) # the preview only ever needs the latest frame
+
+    def decode():
+        try:
+            while not stop_event.is_set() and vid_cap.isOpened():
+                start = time.perf_counter()
+                success, frame = vid_cap.read()
+                if not success:
+                    vid_cap.release()
+                    break
+
+                timestamp = vid_cap.get(cv2.CAP_PROP_POS_MSEC)
+                decoded_at = time.perf_counter()
+                stats.record("decode", decoded_at - start)
+                stats.add_frame()
+
+                if render:
+                    _put(preview_queue, frame, DROP, stop_event)
+                _put(frame_queue, (frame, timestamp, decoded_at), drop_policy, stop_event, stats)
+        except Exception as e:
+            errors.append(e)
+            stop_event.set()
+        finally:
+            _put(frame_queue, _DONE, BLOCK, stop_event)
+
+    def infer():
+        done = False
+        try:
+            while not done and not stop_event.is_set():
+                batch = []
+                item = _get(frame_queue, stop_event)
+
+                # take whatever is already queued, up to the batch size
+                while item is not _DONE:
+                    batch.append(item)
+                    if len(batch) >= batch_size:
+                        break
+                    try:
+                        item = frame_queue.get_nowait()
+                    except queue.Empty:
+                        break
+                done = item is _DONE
+
+                if batch:
+                    start = time.perf_counter()
+                    labels = classify([frame for frame, _, _ in batch])
+                    stats.record("infer", time.perf_counter() - start, len(batch))
+
+                    results = [(cls, score, timestamp, decoded_at) for (cls, score), (_, timestamp, decoded_at) in zip(labels, batch)]
+                    _put(result_queue, results, BLOCK, stop_event)
+        except Exception as e:
+            errors.append(e)
+            stop_event.set()
+        finally:
+            _put(result_queue, _DONE, BLOCK, stop_event)
+
+    workers = [
+        threading.Thread(target=decode, name="pipeline-decode", daemon=True),
+        threading.Thread(target=infer, name="pipeline-infer", daemon=True),
+    ]
+    for worker in workers:
+        worker.start()
+
+    last_timestamp = None
+    try:
+        while not stop_event.is_set():
+            if render:
+                try:
+                    frame = preview_queue.get_nowait()
+                    start = time.perf_counter()
+                    render(frame)
+                    stats.record("render", time.perf_counter() - start)
+                except queue.Empty:
+                    pass
+
+            try:
+                results = result_queue.get(timeout=0.01 if render else 0.1)
+            except queue.Empty:
+                continue
+
+            if results is _DONE:
+                break
+
+            start = time.perf_counter()
+            for cls, score, timestamp, decoded_at in results:
+                on_result(cls, score, timestamp)
+                stats.record("latency", time.perf_counter() - decoded_at)
+                last_timestamp = timestamp
+            stats.record("segment", time.perf_counter() - start, len(results))
+
+        if errors:
+            raise errors[0]
+    finally:
+        # also reached when streamlit interrupts the script, e.g. on "Stop"
+        stop_event.set()
+        for worker in workers:
+            worker.join(timeout=1)
+
+    return last_timestamp, stats
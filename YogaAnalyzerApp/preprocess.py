@@ -0,0 +1,94 @@
+"""
+Frame preprocessing into preallocated buffers.
+
+Given raw frames, model(frames) decodes nothing but preprocesses every frame
+on its own: a colour conversion, a resize, a normalisation and a new input
+tensor per call, and it wraps every output in a result object. FrameBatch
+instead decodes every frame into one reused buffer, resizes it with OpenCV
+straight to the classifier input size into a preallocated array and writes
+it, RGB, CHW and scaled to [0, 1], into its slot of a preallocated input
+batch. The batch is classified by the function returned by
+backends.batch_classifier, which returns the probability vectors only.
+
+The transform is the one of OnnxClassifier.preprocess (resize of the shorter
+side to imgsz, center crop), which follows ultralytics' classify_transforms.
+The tests in tests/test_preprocess.py check that the detections match the
+raw-frame path, and `python backends.py --check-preprocessing` compares both
+paths with a real model on the demo video.
+"""
+import cv2
+import numpy as np
+
+
+def plan_resize(shape, imgsz):
+    """
+    Resize geometry of a frame of the given shape for a classifier input of
+    imgsz x imgsz pixels.
+    Output:
+        (width, height) of the resized frame, the interpolation and the
+        (top, left) offset of the center crop
+    """
+    height, width = shape[:2]
+    scale = imgsz / min(height, width)
+    resized_w, resized_h = max(round(width * scale), imgsz), max(round(height * scale), imgsz)
+    interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+
+    return (resized_w, resized_h), interpolation, ((resized_h - imgsz) // 2, (resized_w - imgsz) // 2)
+
+
+class FrameBatch:
+    """
+    Preallocated input batch of up to batch_size frames, filled in place.
+    """
+    def __init__(self, imgsz, batch_size):
+        self.imgsz = imgsz
+        self.data = np.empty((batch_size, 3, imgsz, imgsz), dtype=np.float32)
+        self.size = 0
+
+        self._frame = None # decode buffer
+        self._shape = None # frame shape the resize buffer was planned for
+        self._resized = None
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def full(self):
+        return self.size == len(self.data)
+
+    @property
+    def batch(self):
+        # view of the filled slots, valid until the next add()
+        return self.data[:self.size]
+
+    def read(self, vid_cap):
+        """
+        Read the next frame of a capture. cv2.VideoCapture and captures with
+        reads_into_buffer (e.g. chunks.FrameRange) decode into the reused
+        buffer, other captures return their own frames.
+        """
+        if not (isinstance(vid_cap, cv2.VideoCapture) or getattr(vid_cap, "reads_into_buffer", False)):
+            return vid_cap.read()
+
+        success, frame = vid_cap.read(self._frame)
+        if success:
+            self._frame = frame
+        return success, frame
+
+    def add(self, frame):
+        """
+        Resize, crop and normalise a BGR frame into the next slot of the batch.
+        """
+        if frame.shape != self._shape:
+            self._shape = frame.shape
+            self._dsize, self._interpolation, (self._top, self._left) = plan_resize(frame.shape, self.imgsz)
+            self._resized = np.empty((self._dsize[1], self._dsize[0], 3), dtype=np.uint8)
+
+        cv2.resize(frame, self._dsize, dst=self._resized, interpolation=self._interpolation)
+        cropped = self._resized[self._top:self._top + self.imgsz, self._left:self._left + self.imgsz, ::-1] # BGR -> RGB
+
+        np.divide(cropped.transpose(2, 0, 1), np.float32(255), out=self.data[self.size])
+        self.size += 1
+
+    def clear(self):
+        self.size = 0
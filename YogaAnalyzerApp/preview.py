@@ -0,0 +1,54 @@
+import time
+
+import cv2
+
+import settings
+
+
+class Preview:
+    """
+    Throttled, downscaled live preview of the analyzed frames. Frames are
+    shown at most max_fps times per second; frames arriving in between are
+    dropped, never queued. Shown frames are resized to `width` pixels and
+    sent to the browser as JPEG, independently of the frames given to the
+    model.
+    """
+    def __init__(self, frame_window, max_fps=settings.PREVIEW_MAX_FPS, width=settings.PREVIEW_WIDTH,
+                 jpeg_quality=settings.PREVIEW_JPEG_QUALITY, display_width=settings.PREVIEW_DISPLAY_WIDTH):
+        self.frame_window = frame_window
+        self.interval = 1 / max_fps if max_fps else 0
+        self.width = width
+        self.encode_params = [int(cv2.IMWRITE_JPEG_QUALITY), jpeg_quality]
+        self.display_width = display_width
+        self.shown = 0
+        self.dropped = 0
+        self._last_shown = None
+
+    def due(self):
+        """
+        Whether the next frame would be shown.
+        """
+        return self._last_shown is None or time.perf_counter() - self._last_shown >= self.interval
+
+    def show(self, frame):
+        """
+        Show a BGR frame if the frame rate cap allows it. Returns whether the
+        frame was shown.
+        """
+        if not self.due():
+            self.dropped += 1
+            return False
+        self._last_shown = time.perf_counter()
+
+        height, width = frame.shape[:2]
+        if self.width and width > self.width:
+            frame = cv2.resize(frame, (self.width, round(height * self.width / width)), interpolation=cv2.INTER_AREA)
+
+        success, jpeg = cv2.imencode(".jpg", frame, self.encode_params)
+        if not success:
+            self.dropped += 1
+            return False
+
+        self.frame_window.image(jpeg.tobytes(), width=self.display_width)
+        self.shown += 1
+        return True
@@ -0,0 +1,107 @@
+import json
+from pathlib import Path
+
+import numpy as np
+
+import settings
+import segmentation
+
+# A probability store is a pair of files: "<path>" holds one fixed-size record
+# (timestamp, probability vector) per classified frame and is memory-mapped on
+# load, "<path>.json" holds the class names and the number of frames.
+
+
+def _record_dtype(n_classes):
+    return np.dtype([("timestamp", "<f8"), ("probs", "<f4", (n_classes,))])
+
+
+class ProbabilityRecorder:
+    """
+    Append the full probability vectors of classified frames to a store.
+    """
+    def __init__(self, path, class_names):
+        self.path = Path(path)
+        self.class_names = class_names
+        self.dtype = _record_dtype(len(class_names))
+        self.n_frames = 0
+        self.final_timestamp = None
+        self._file = open(self.path, "wb")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def append(self, timestamps, probs):
+        records = np.empty(len(timestamps), dtype=self.dtype)
+        records["timestamp"] = timestamps
+        records["probs"] = probs
+        self._file.write(records.tobytes())
+        self.n_frames += len(records)
+
+    def close(self, final_timestamp=None):
+        """
+        Close the store. final_timestamp is the timestamp of the last frame of
+        the video, which closes the last segment on re-segmentation.
+        """
+        if self._file.closed:
+            return
+        self._file.close()
+
+        if final_timestamp is not None:
+            self.final_timestamp = final_timestamp
+
+        meta = {"class_names": self.class_names, "n_frames": self.n_frames, "final_timestamp": self.final_timestamp}
+        with open(f"{self.path}.json", "w") as meta_file:
+            json.dump(meta, meta_file)
+
+
+def load(path):
+    """
+    Memory-map a probability store.
+    Output:
+        records: structured array with "timestamp" and "probs" fields
+        meta: dictionary with "class_names", "n_frames" and "final_timestamp"
+    """
+    with open(f"{path}.json") as meta_file:
+        meta = json.load(meta_file)
+
+    dtype = _record_dtype(len(meta["class_names"]))
+    if not meta["n_frames"]:
+        return np.empty(0, dtype=dtype), meta
+
+    records = np.memmap(path, dtype=dtype, mode="r", shape=(meta["n_frames"],))
+    return records, meta
+
+def resegment(path, model_thresh, min_duration_ms=1000, smoothing=settings.SMOOTHING, window=settings.SMOOTHING_WINDOW):
+    """
+    Rebuild the merged segments of a recorded video under another threshold,
+    minimum segment duration or smoothing, without running inference again.
+    The result matches what SegmentTracker.merged() returns for the same settings.
+    """
+    records, meta = load(path)
+    class_names = meta["class_names"]
+
+    if not len(records):
+        return []
+
+    # ensure timestamp order (adaptive sampling classifies frames out of order)
+    order = np.argsort(records["timestamp"], kind="stable")
+    timestamps = np.asarray(records["timestamp"])[order]
+    probs = np.asarray(records["probs"])[order]
+
+    top1 = probs.argmax(axis=1)
+    scores = probs[np.arange(len(probs)), top1]
+
+    # class ids in order of first appearance among the accepted frames, as SegmentTracker assigns them,
+    # since majority smoothing breaks ties by the lower class id
+    classes, first_frames = np.unique(top1[scores >= model_thresh], return_index=True)
+    appearance = classes[np.argsort(first_frames)]
+    class_ids = np.zeros(len(class_names), dtype=np.int64)
+    class_ids[appearance] = np.arange(len(appearance))
+
+    final_timestamp = meta["final_timestamp"] if meta["final_timestamp"] is not None else float(timestamps[-1])
+
+    return segmentation.segment(timestamps, class_ids[top1], scores, [class_names[c] for c in appearance], model_thresh,
+                                min_duration_ms, final_timestamp, smoothing=smoothing, window=window)
@@ -0,0 +1,68 @@
+import time
+
+import streamlit as st
+
+import settings
+import telemetry
+import alignment
+
+
+class LiveProgress:
+    """
+    Live routine progress panel of a running session. The segments closed by
+    the session's SegmentTracker are fed into a LiveAnalysis and the panel is
+    redrawn at most once every `interval` seconds; frames arriving in between
+    only cost a clock check, so the panel adds no per-frame work.
+    """
+    def __init__(self, placeholder, live_analysis, interval=settings.LIVE_PROGRESS_INTERVAL, metrics=telemetry.NULL_METRICS):
+        self.placeholder = placeholder
+        self.analysis = live_analysis
+        self.interval = interval
+        self.metrics = metrics
+        self.updates = 0
+        self._last_update = None
+
+    def due(self):
+        """
+        Whether the next update would redraw the panel.
+        """
+        return self._last_update is None or time.perf_counter() - self._last_update >= self.interval
+
+    def update(self, tracker, force=False):
+        """
+        Add the segments closed since the last update and redraw the panel if
+        the refresh rate allows it. Returns whether the panel was redrawn.
+        """
+        if not force and not self.due():
+            return False
+        self._last_update = time.perf_counter()
+
+        with self.metrics.span("live_progress"):
+            for segment in tracker.closed_segments():
+                self.analysis.add(segment)
+            self.render()
+
+        self.updates += 1
+        return True
+
+    def render(self):
+        live = self.analysis
+        rows = {"Pose": [], "Planned": [], "Detected": [], "Is fulfilled?": [], "Score": []}
+
+        for pose, planned in live.planned.items():
+            minutes, seconds = divmod(planned, 60)
+            rows["Pose"].append(pose)
+            rows["Planned"].append(f"{minutes:02}:{seconds:02}")
+            rows["Detected"].append(f"{live.detected.get(pose, 0):.1f}s")
+            rows["Is fulfilled?"].append("✅" if pose in live.fulfilled else "❌")
+            rows["Score"].append(round(live.scores.get(pose, 0), 2))
+
+        with self.placeholder.container():
+            st.progress(min(live.progress, 1.0), text=f"Routine progress: {live.progress:.0%}")
+
+            col1, col2, col3 = st.columns(3)
+            col1.metric("Next pose", live.next_pose or "-")
+            col2.metric("Matched steps", f"{live.counts[alignment.MATCHED]} / {len(live.steps)}")
+            col3.metric("Missed / extra", f"{live.counts[alignment.MISSED]} / {live.counts[alignment.EXTRA]}")
+
+            st.table(rows)
@@ -0,0 +1,111 @@
+from collections import OrderedDict
+from pathlib import Path
+import threading
+import time
+import weakref
+
+import numpy as np
+
+import settings
+import backends
+import modelhost
+import scheduler
+import telemetry
+
+# process-wide cache of loaded models, shared by every streamlit session
+_models = OrderedDict()
+_lock = threading.Lock() # guards the dictionaries below, never held while a model loads or runs
+_load_locks = {} # key -> lock held while that model loads, so it is loaded once
+_inference_locks = weakref.WeakKeyDictionary()
+_weights_paths = weakref.WeakKeyDictionary()
+
+
+def _warm_up(model):
+    """
+    Run a single inference on a blank frame so that the first real frame
+    does not pay for lazy initialisation inside the inference backend.
+    """
+    dummy_frame = np.zeros((settings.WARMUP_IMGSZ, settings.WARMUP_IMGSZ, 3), dtype=np.uint8)
+    model(dummy_frame, verbose=False)
+
+def get_model(model_path):
+    """
+    Return the cached model for the given weight file, loading it with the
+    inference backend of settings.INFERENCE_BACKEND and warming it up on first
+    use. The least recently used model is evicted once more than
+    settings.MODEL_CACHE_SIZE models are resident. With settings.MODEL_HOST
+    the model is a proxy of the model loaded by the model host.
+    """
+    weights = str(Path(model_path).resolve())
+    key = (weights, settings.INFERENCE_BACKEND, settings.ONNX_QUANTIZE, settings.MODEL_HOST)
+
+    with _lock:
+        if key in _models:
+            _models.move_to_end(key)
+            return _models[key]
+        load_lock = _load_locks.setdefault(key, threading.Lock())
+
+    # a slow load (or ONNX export) only blocks the sessions waiting for the same model
+    with load_lock:
+        with _lock:
+            if key in _models:
+                _models.move_to_end(key)
+                return _models[key]
+
+        metrics = telemetry.process_metrics()
+        start = time.perf_counter()
+        model = modelhost.RemoteModel(weights) if settings.MODEL_HOST else backends.load(weights)
+        loaded_at = time.perf_counter()
+        _warm_up(model)
+        metrics.observe("model_load", loaded_at - start)
+        metrics.observe("model_warmup", time.perf_counter() - loaded_at)
+        metrics.inc("model_loads")
+
+        evicted = []
+        with _lock:
+            _inference_locks[model] = threading.Lock()
+            _weights_paths[model] = weights
+            _models[key] = model
+            _load_locks.pop(key, None)
+            while len(_models) > max(settings.MODEL_CACHE_SIZE, 1):
+                evicted.append(_models.popitem(last=False)[1])
+
+    for model_evicted in evicted:
+        scheduler.discard(model_evicted)
+
+    return model
+
+def preload_models(model_paths=None):
+    """
+    Eagerly load the given weight files, or every model in settings.MODELS_DICT.
+    Weight files that are not present on disk are skipped.
+    """
+    if model_paths is None:
+        model_paths = settings.MODELS_DICT.values()
+
+    for model_path in model_paths:
+        if Path(model_path).exists():
+            get_model(model_path)
+
+def weights_path(model):
+    """
+    Return the weight file a registry model was loaded from.
+    """
+    return _weights_paths[model]
+
+def inference_lock(model):
+    """
+    Return the lock guarding forward passes of a shared model instance.
+    Registry models get their lock when they are loaded, so the lookup takes
+    no global lock.
+    """
+    lock = _inference_locks.get(model)
+    if lock is None:
+        # models not loaded through the registry, e.g. the cascade
+        with _lock:
+            lock = _inference_locks.setdefault(model, threading.Lock())
+    return lock
+
+def clear():
+    with _lock:
+        _models.clear()
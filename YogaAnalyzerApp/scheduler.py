@@ -0,0 +1,276 @@
+"""
+Cross-session micro-batching of model calls.
+
+Every live session classifies a handful of frames at a time, and with a
+shared model the forward passes of concurrent sessions run one after the
+other. The InferenceScheduler of a model instead collects the frames of all
+sessions and classifies them with one forward pass per micro-batch, which
+costs little more than a single frame on CPU. A batch is dispatched once
+every recently active session has queued frames, once it holds max_batch
+frames or once its oldest frame has waited max_wait_ms. The batch size is
+lowered whenever the measured per-frame forward time would push the oldest
+frame past latency_budget_ms.
+
+The dispatcher thread stops once no session has submitted frames for
+idle_seconds; the next request starts a new one. Models evicted from the
+registry get no scheduler anymore, see discard. Frames that are not
+classified within _TIMEOUT_BUDGETS latency budgets, e.g. because a forward
+pass hangs, are withdrawn and the caller classifies them directly.
+"""
+from collections import deque
+from concurrent import futures
+from concurrent.futures import Future
+import threading
+import time
+import weakref
+
+import settings
+import telemetry
+
+
+# a session that has not submitted frames for this long is no longer waited for
+_ACTIVE_SECONDS = 1
+# classify() gives up after this many latency budgets
+_TIMEOUT_BUDGETS = 20
+
+
+class SchedulerClosed(RuntimeError):
+    """
+    Raised for frames submitted to (or pending in) a closed scheduler.
+    """
+
+
+class SchedulerTimeout(TimeoutError):
+    """
+    Raised by classify for frames not classified in time.
+    """
+
+
+class _Request:
+    __slots__ = ("frames", "future", "enqueued_at", "session")
+
+    def __init__(self, frames):
+        self.frames = frames
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+        self.session = threading.get_ident()
+
+
+class InferenceScheduler:
+    """
+    Micro-batches classify(model, frames) calls of concurrent sessions on a
+    dispatcher thread.
+    """
+    def __init__(self, model, classify, max_batch=settings.SCHEDULER_MAX_BATCH,
+                 max_wait_ms=settings.SCHEDULER_MAX_WAIT_MS, latency_budget_ms=settings.SCHEDULER_LATENCY_BUDGET_MS,
+                 idle_seconds=settings.SCHEDULER_IDLE_SECONDS):
+        self.model = model
+        self.classify_batch = classify
+        self.max_batch = max(max_batch, 1)
+        self.max_wait = max_wait_ms / 1000
+        self.latency_budget = latency_budget_ms / 1000
+        self.idle_seconds = idle_seconds
+        self.timeout = self.latency_budget * _TIMEOUT_BUDGETS or None
+
+        self._pending = deque()
+        self._pending_frames = 0
+        self._last_seen = {} # submitting thread -> time of its last request
+        self._cond = threading.Condition()
+        self._closed = False
+        self._frame_seconds = None # moving average of the forward time per frame
+
+        self.counters = {"batches": 0, "frames": 0, "requests": 0}
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+        self._thread = threading.Thread(target=self._run, name="inference-scheduler", daemon=True)
+        self._thread.start()
+
+    def submit(self, frames):
+        """
+        Queue frames for classification, returns a Future of their
+        (class, score) pairs.
+        """
+        return self._enqueue(frames).future
+
+    def _enqueue(self, frames):
+        request = _Request(frames)
+        with self._cond:
+            if self._closed:
+                raise SchedulerClosed("scheduler is closed")
+            self._pending.append(request)
+            self._pending_frames += len(frames)
+            self._last_seen[request.session] = request.enqueued_at
+            self._cond.notify()
+        return request
+
+    @property
+    def closed(self):
+        # a dispatcher thread that died does not classify anything anymore
+        return self._closed or not self._thread.is_alive()
+
+    def classify(self, frames, timeout=None):
+        """
+        Classify frames together with the frames of the other sessions and
+        return their (class, score) pairs. Raises SchedulerTimeout if they
+        are not classified within timeout seconds (self.timeout by default),
+        the frames are then withdrawn if they are still queued.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        request = self._enqueue(frames)
+        try:
+            return request.future.result(timeout)
+        except futures.TimeoutError:
+            with self._cond:
+                if request in self._pending:
+                    self._pending.remove(request)
+                    self._pending_frames -= len(frames)
+            telemetry.process_metrics().inc("scheduler_timeouts")
+            raise SchedulerTimeout(f"frames not classified within {timeout} s") from None
+
+    def _batch_limit(self, waited):
+        # frames that can still be classified before the oldest frame exceeds the budget
+        if not self._frame_seconds or not self.latency_budget:
+            return self.max_batch
+        affordable = int((self.latency_budget - waited) / self._frame_seconds)
+        return min(max(affordable, 1), self.max_batch)
+
+    def _all_sessions_pending(self, now):
+        for session, last_seen in list(self._last_seen.items()):
+            if now - last_seen > _ACTIVE_SECONDS:
+                del self._last_seen[session]
+        return len({request.session for request in self._pending}) >= len(self._last_seen)
+
+    def _next_batch(self):
+        """
+        Wait for a batch to be due and take its requests off the queue.
+        Closes the scheduler if no frames arrive for idle_seconds.
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._pending or self._closed, timeout=self.idle_seconds):
+                self._closed = True
+            if self._closed:
+                return []
+
+            deadline = self._pending[0].enqueued_at + self.max_wait
+            while not self._closed:
+                now = time.perf_counter()
+                if (now >= deadline or self._all_sessions_pending(now)
+                        or self._pending_frames >= self._batch_limit(now - self._pending[0].enqueued_at)):
+                    break
+                self._cond.wait(deadline - now)
+            if self._closed:
+                return []
+
+            limit = self._batch_limit(time.perf_counter() - self._pending[0].enqueued_at)
+            requests, n_frames = [], 0
+            # whole requests only, and at least one even if it is larger than the limit
+            while self._pending and (not requests or n_frames + len(self._pending[0].frames) <= limit):
+                request = self._pending.popleft()
+                requests.append(request)
+                n_frames += len(request.frames)
+            self._pending_frames -= n_frames
+            return requests
+
+    def _run(self):
+        metrics = telemetry.process_metrics()
+
+        while not self._closed:
+            requests = self._next_batch()
+            if not requests:
+                continue
+
+            frames = [frame for request in requests for frame in request.frames]
+            start = time.perf_counter()
+            try:
+                labels = self.classify_batch(self.model, frames)
+            except Exception as e:
+                for request in requests:
+                    request.future.set_exception(e)
+                continue
+            elapsed = time.perf_counter() - start
+
+            frame_seconds = elapsed / len(frames)
+            self._frame_seconds = frame_seconds if self._frame_seconds is None else 0.8 * self._frame_seconds + 0.2 * frame_seconds
+
+            offset = 0
+            for request in requests:
+                waited = start - request.enqueued_at
+                self._wait_total += waited
+                self._wait_max = max(self._wait_max, waited)
+                metrics.observe("scheduler_wait", waited)
+
+                request.future.set_result(labels[offset:offset + len(request.frames)])
+                offset += len(request.frames)
+
+            self.counters["batches"] += 1
+            self.counters["frames"] += len(frames)
+            self.counters["requests"] += len(requests)
+            metrics.observe("scheduler_batch", elapsed)
+            metrics.inc("scheduler_batches")
+            metrics.inc("scheduler_frames", len(frames))
+
+        # idle or closed: the next request for the model starts a new scheduler
+        _forget(self)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            pending, self._pending = list(self._pending), deque()
+            self._cond.notify_all()
+        for request in pending:
+            request.future.set_exception(SchedulerClosed("scheduler is closed"))
+        self._thread.join(timeout=2)
+
+    def stats(self):
+        stats = dict(self.counters)
+        requests = stats["requests"]
+        stats["avg_batch_size"] = round(stats["frames"] / stats["batches"], 2) if stats["batches"] else None
+        stats["avg_wait_ms"] = round(self._wait_total * 1000 / requests, 2) if requests else None
+        stats["max_wait_ms"] = round(self._wait_max * 1000, 2)
+        return stats
+
+
+# one scheduler per shared model instance
+_schedulers = {}
+_discarded = weakref.WeakSet() # models evicted from the registry
+_lock = threading.Lock()
+
+
+def get(model, classify):
+    """
+    Return the scheduler of a model, starting it on first use (or after it
+    stopped for being idle). classify is called as classify(model, frames)
+    with the frames of a micro-batch. Returns None for a discarded model,
+    whose frames have to be classified directly.
+    """
+    with _lock:
+        if model in _discarded:
+            return None
+        scheduler = _schedulers.get(model)
+        if scheduler is None or scheduler.closed:
+            scheduler = _schedulers[model] = InferenceScheduler(model, classify)
+        return scheduler
+
+def _forget(scheduler):
+    with _lock:
+        if _schedulers.get(scheduler.model) is scheduler:
+            del _schedulers[scheduler.model]
+
+def discard(model):
+    """
+    Stop the scheduler of a model evicted from the registry, if any, and do
+    not start a new one for it.
+    """
+    with _lock:
+        _discarded.add(model)
+        scheduler = _schedulers.pop(model, None)
+    if scheduler:
+        scheduler.close()
+
+def close_all():
+    with _lock:
+        schedulers = list(_schedulers.values())
+        _schedulers.clear()
+    for scheduler in schedulers:
+        scheduler.close()
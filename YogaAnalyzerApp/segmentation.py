@@ -0,0 +1,167 @@
+from array import array
+import datetime
+
+import numpy as np
+
+import settings
+import segments
+
+# temporal smoothing methods
+NO_SMOOTHING = "none"
+MAJORITY_SMOOTHING = "majority" # most frequent pose in a centered window of frames
+HYSTERESIS_SMOOTHING = "hysteresis" # a pose change needs at least `window` consecutive frames
+
+
+def _majority_filter(class_ids, window):
+    """
+    Replace every class id by the most frequent class id in a centered window.
+    Ties keep the class with the lower id.
+    """
+    n_classes = int(class_ids.max()) + 1
+    half = window // 2
+
+    # windowed class counts from the cumulative one-hot counts
+    one_hot = np.zeros((len(class_ids) + 1, n_classes), dtype=np.int32)
+    one_hot[np.arange(1, len(class_ids) + 1), class_ids] = 1
+    cumulative = np.cumsum(one_hot, axis=0)
+
+    idx = np.arange(len(class_ids))
+    lo = np.clip(idx - half, 0, len(class_ids))
+    hi = np.clip(idx + half + 1, 0, len(class_ids))
+    counts = cumulative[hi] - cumulative[lo]
+
+    return counts.argmax(axis=1)
+
+def _hysteresis_filter(class_ids, window):
+    """
+    Absorb every run shorter than `window` frames into the preceding
+    (sufficiently long) run, so that only stable pose changes remain.
+    """
+    run_starts = np.flatnonzero(np.r_[True, class_ids[1:] != class_ids[:-1]])
+    run_lengths = np.diff(np.r_[run_starts, len(class_ids)])
+
+    stable = run_lengths >= window
+    stable[0] = True # nothing to fall back to before the first run
+
+    # index of the last stable run at or before every run
+    source_run = np.maximum.accumulate(np.where(stable, np.arange(len(run_starts)), 0))
+
+    return np.repeat(class_ids[run_starts][source_run], run_lengths)
+
+def smooth(class_ids, method=NO_SMOOTHING, window=1):
+    """
+    Suppress short flickers between poses in a sequence of class ids.
+    """
+    if method == NO_SMOOTHING or window <= 1 or len(class_ids) < 2:
+        return class_ids
+    if method == MAJORITY_SMOOTHING:
+        return _majority_filter(class_ids, window)
+    if method == HYSTERESIS_SMOOTHING:
+        return _hysteresis_filter(class_ids, window)
+    raise ValueError(f"Unknown smoothing method: {method}")
+
+def segment(timestamps, class_ids, scores, class_names, model_thresh, min_duration_ms=1000, final_timestamp=None,
+            smoothing=NO_SMOOTHING, window=1, drop_last=False):
+    """
+    Turn per-frame classifications into merged pose segments in a single
+    vectorized pass.
+
+    Input:
+        timestamps, class_ids, scores: per-frame arrays in timestamp order
+        class_names: class name of every class id
+        model_thresh: frames below this score are ignored
+        min_duration_ms: segments shorter than this are dropped, except for the last one
+        final_timestamp: closes the last segment, defaults to the last timestamp
+        smoothing, window: temporal smoothing applied to the accepted frames
+        drop_last: drop the last segment before merging (e.g. stopping a live session)
+    Output:
+        list of segments in the format of SegmentTracker.merged()
+    """
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    class_ids = np.asarray(class_ids, dtype=np.int64)
+    scores = np.asarray(scores, dtype=np.float64)
+
+    if not len(timestamps):
+        return []
+    if final_timestamp is None:
+        final_timestamp = float(timestamps[-1])
+
+    # frames below the threshold are ignored
+    accepted = scores >= model_thresh
+    timestamps, class_ids, scores = timestamps[accepted], class_ids[accepted], scores[accepted]
+    if not len(class_ids):
+        return []
+
+    class_ids = smooth(class_ids, smoothing, window)
+
+    # runs of consecutive frames with the same pose
+    run_starts = np.flatnonzero(np.r_[True, class_ids[1:] != class_ids[:-1]])
+    run_classes = class_ids[run_starts]
+    run_start_ts = timestamps[run_starts]
+    run_final_ts = np.r_[timestamps[run_starts[1:]], final_timestamp]
+
+    # too short runs are dropped, except for the last one which is never checked
+    # (durations are rounded to microseconds like a timedelta)
+    keep = np.round((run_final_ts - run_start_ts) * 1000) >= min_duration_ms * 1000
+    keep[-1] = True
+
+    kept = np.flatnonzero(keep)
+    if drop_last:
+        kept = kept[:-1]
+    if not len(kept):
+        return []
+
+    # per-run score statistics
+    run_count = np.diff(np.r_[run_starts, len(scores)])
+    run_total = np.add.reduceat(scores, run_starts)
+    run_sumsq = np.add.reduceat(scores * scores, run_starts)
+    run_min = np.minimum.reduceat(scores, run_starts)
+    run_max = np.maximum.reduceat(scores, run_starts)
+
+    # consecutive kept runs of the same pose are merged into one segment
+    new_group = np.r_[True, run_classes[kept][1:] != run_classes[kept][:-1]]
+    group_starts = np.flatnonzero(new_group)
+    group_ends = np.r_[group_starts[1:], len(kept)] - 1
+
+    count = np.add.reduceat(run_count[kept], group_starts)
+    total = np.add.reduceat(run_total[kept], group_starts)
+    sumsq = np.add.reduceat(run_sumsq[kept], group_starts)
+    min_score = np.minimum.reduceat(run_min[kept], group_starts)
+    max_score = np.maximum.reduceat(run_max[kept], group_starts)
+    start_ts = run_start_ts[kept][group_starts]
+    final_ts = run_final_ts[kept][group_ends]
+    group_classes = run_classes[kept][group_starts]
+
+    histograms = None
+    bins = settings.SCORE_HISTOGRAM_BINS
+    if bins:
+        group_of_run = np.full(len(run_starts), -1)
+        group_of_run[kept] = np.cumsum(new_group) - 1
+        group_of_frame = group_of_run[np.repeat(np.arange(len(run_starts)), run_count)]
+        frame_bins = np.clip((scores * bins).astype(int), 0, bins - 1)
+        valid = group_of_frame >= 0
+        histograms = np.bincount(group_of_frame[valid] * bins + frame_bins[valid], minlength=len(group_starts) * bins).reshape(-1, bins)
+
+    predictions = []
+    for i in range(len(group_starts)):
+        stats = segments.ScoreStats(bins)
+        stats.count = int(count[i])
+        stats.total = float(total[i])
+        stats.min = float(min_score[i])
+        stats.max = float(max_score[i])
+        stats._m2 = max(float(sumsq[i]) - float(total[i]) ** 2 / stats.count, 0.0)
+        if histograms is not None:
+            stats.histogram = array("I", histograms[i].tolist())
+
+        predictions.append(
+            {
+                "class": class_names[int(group_classes[i])],
+                "scores": stats,
+                "avg_score": stats.mean,
+                "final_timestamp": float(final_ts[i]),
+                "start_timestamp": float(start_ts[i]),
+                "duration": datetime.timedelta(milliseconds=float(final_ts[i] - start_ts[i]))
+            }
+        )
+
+    return predictions
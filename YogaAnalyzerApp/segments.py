@@ -0,0 +1,210 @@
+from array import array
+import bisect
+import math
+
+import numpy as np
+
+import settings
+import segmentation
+
+
+class ScoreStats:
+    """
+    Summary statistics of the confidence scores of a segment, filled in by
+    segmentation.segment from the per-frame arrays of a SegmentTracker. Closed
+    segments keep only these, their frames are dropped (see SegmentTracker).
+    """
+    __slots__ = ("count", "total", "min", "max", "_m2", "histogram")
+
+    def __init__(self, bins=0):
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self._m2 = 0.0 # sum of squared deviations from the mean
+        self.histogram = array("I", bytes(4 * bins)) if bins else None # scores in [0, 1]
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    @property
+    def variance(self):
+        return self._m2 / self.count if self.count else None
+
+
+class SegmentTracker:
+    """
+    Session-scoped segmentation state. Collects the per-frame classifications
+    of a session in compact arrays and turns them into pose segments with the
+    vectorized segmentation engine, so that every session (or batch job) owns
+    its own detections instead of sharing a module-level list.
+
+    The frames above model_thresh are kept (14 bytes per frame) until their
+    segment is closed, i.e. followed by a segment of another pose that is long
+    enough to be kept: no later frame can change a closed segment, so once
+    compact_frames frames are held the closed segments are folded into their
+    ScoreStats and their frames are dropped. A session then holds the frames
+    of its open segment and one summary per closed segment. With temporal
+    smoothing the windows look across segment boundaries, so every frame is
+    kept and merged() segments them all again.
+    """
+    def __init__(self, model_thresh, min_duration=1, smoothing=settings.SMOOTHING, window=settings.SMOOTHING_WINDOW,
+                 compact_frames=settings.TRACKER_COMPACT_FRAMES):
+        self.model_thresh = model_thresh # frames below this score are ignored
+        self.min_duration = min_duration # segments shorter than this (in seconds) are discarded
+        self.smoothing = smoothing # temporal smoothing method, see segmentation.smooth
+        self.window = window # smoothing window in frames
+        self.compact_frames = compact_frames # frames held before closed segments are folded, 0 keeps every frame
+        self.class_names = []
+        self._class_ids = {}
+        self.clear()
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    @property
+    def _folds(self):
+        # closed segments are final, and merged() starts from them, only without smoothing
+        return self.smoothing == segmentation.NO_SMOOTHING or self.window <= 1
+
+    def clear(self):
+        self.timestamps = array("d")
+        self.class_ids = array("H")
+        self.scores = array("f")
+        self.final_timestamp = None
+        self._open_from = 0 # first frame of the segment that is still open, see closed_segments
+        self._closed = [] # segments closed so far
+        self._reported = 0 # closed segments already returned by closed_segments
+        self._compact_at = self.compact_frames # number of held frames that triggers the next compaction
+
+    def finalize(self, timestamp):
+        """
+        Close the last segment at the given timestamp.
+        """
+        if timestamp is not None:
+            self.final_timestamp = timestamp
+
+    def update(self, cls, score, timestamp):
+        """
+        Add the classification of a single frame.
+        """
+        if score < self.model_thresh:
+            return
+
+        self.timestamps.append(timestamp)
+        self.class_ids.append(self._class_id(cls))
+        self.scores.append(score)
+
+        if self.compact_frames and len(self.timestamps) >= self._compact_at and self._folds:
+            self._compact()
+
+    def _class_id(self, cls):
+        if cls not in self._class_ids:
+            self._class_ids[cls] = len(self.class_names)
+            self.class_names.append(cls)
+        return self._class_ids[cls]
+
+    def extend(self, other):
+        """
+        Append the frames recorded by another tracker over a later time
+        range, e.g. a chunk of the same video processed in another process.
+        The ranges are stitched frame by frame, so the other tracker must hold
+        all of its frames (compact_frames=0).
+        """
+        if other._closed:
+            raise ValueError("cannot extend a tracker with one whose closed segments were folded")
+
+        if len(other):
+            ids = np.array([self._class_id(cls) for cls in other.class_names], dtype=np.uint16)
+            self.timestamps.extend(other.timestamps)
+            self.class_ids.frombytes(ids[np.frombuffer(other.class_ids, dtype=np.uint16)].tobytes())
+            self.scores.extend(other.scores)
+
+        if other.final_timestamp is not None:
+            self.final_timestamp = other.final_timestamp
+
+    def closed_segments(self):
+        """
+        Return the segments closed since the last call, for live progress.
+        A segment is closed once it is followed by a segment of another pose
+        that is already long enough to be kept. Only the frames of the open
+        segment and the new frames are segmented again, so every call costs
+        O(new frames) instead of O(session). With temporal smoothing the
+        segments may differ slightly from merged() around their boundaries.
+        """
+        self._close()
+        closed = self._closed[self._reported:]
+        self._reported = len(self._closed)
+        return closed
+
+    def _compact(self):
+        """
+        Fold the closed segments and drop their frames.
+        """
+        self._close()
+
+        start = self._open_from
+        if start:
+            del self.timestamps[:start]
+            del self.class_ids[:start]
+            del self.scores[:start]
+            self._open_from = 0
+
+        # a long open segment is checked again after compact_frames more frames, not on every frame
+        self._compact_at = len(self.timestamps) + self.compact_frames
+
+    def _close(self):
+        """
+        Append the segments closed by the frames since the open segment to
+        the closed segments.
+        """
+        start = self._open_from
+        if len(self.timestamps) - start < 2:
+            return
+
+        segments = segmentation.segment(
+            np.frombuffer(self.timestamps, dtype=np.float64)[start:],
+            np.frombuffer(self.class_ids, dtype=np.uint16)[start:],
+            np.frombuffer(self.scores, dtype=np.float32)[start:],
+            self.class_names,
+            self.model_thresh,
+            min_duration_ms=self.min_duration * 1000,
+            smoothing=self.smoothing,
+            window=self.window
+        )
+        if len(segments) < 2:
+            return
+
+        # the last segment could still be dropped as too short, and its predecessor be extended past it
+        if segments[-1]["duration"].total_seconds() < self.min_duration:
+            return
+
+        self._open_from = bisect.bisect_left(self.timestamps, segments[-1]["start_timestamp"], start)
+        self._closed.extend(segments[:-1])
+
+    def merged(self, live=False):
+        """
+        Return the finalized segments with consecutive segments of the same
+        pose merged, and clear the tracker for upcoming predictions.
+        """
+        # without smoothing the closed segments are final, only the open one is segmented again
+        start, closed = (self._open_from, self._closed) if self._folds else (0, [])
+
+        # since the last prediction would be probably for stopping the video, we remove it when live
+        cleaned_predictions = closed + segmentation.segment(
+            np.frombuffer(self.timestamps, dtype=np.float64)[start:],
+            np.frombuffer(self.class_ids, dtype=np.uint16)[start:],
+            np.frombuffer(self.scores, dtype=np.float32)[start:],
+            self.class_names,
+            self.model_thresh,
+            min_duration_ms=self.min_duration * 1000,
+            final_timestamp=self.final_timestamp,
+            smoothing=self.smoothing,
+            window=self.window,
+            drop_last=live
+        )
+
+        self.clear()
+
+        return cleaned_predictions
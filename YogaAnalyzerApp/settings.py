@@ -12,7 +12,11 @@ if root_path not in sys.path:
     sys.path.append(str(root_path))
 
 # Get the relative path of the root directory with respect to the current working directory
-ROOT = root_path.relative_to(Path.cwd())
+# (falls back to the absolute path when running from outside of it, e.g. the batch CLI)
+try:
+    ROOT = root_path.relative_to(Path.cwd())
+except ValueError:
+    ROOT = root_path
 
 # Sources
 VIDEO = 'Demo Video'
@@ -51,11 +55,133 @@ YES_NO_LIST = [
 ]
 
 # Webcam config
-WEBCAM_PATH = 0
+WEBCAM_PATH = 0 # camera index, or path of a video file standing in for the camera
+CAPTURE_BUFFER_SIZE = 4 # latest frames kept by the capture session, older ones are dropped
+CAPTURE_READ_TIMEOUT = 2 # seconds to wait for a frame before the read loop returns
+CAPTURE_RECONNECT_DELAY = 0.5 # initial reconnect delay (seconds), doubled after every failed attempt
+CAPTURE_RECONNECT_MAX_DELAY = 8 # upper bound of the reconnect delay (seconds)
 
 # ML Model config
 MODEL_DIR = ROOT / 'weights'
 BEGINNER_MODEL = MODEL_DIR / 'beginner.pt'  # 5-CLASS
 ADVANCED_MODEL = MODEL_DIR / 'advanced.pt'  # 47-CLASS
+MODELS_DICT = {
+    BEGINNER: BEGINNER_MODEL,
+    ADVANCED: ADVANCED_MODEL
+}
+MODEL_THRESH_DICT = {
+    BEGINNER: 0.7,
+    ADVANCED: 0.5
+}
+
+# Inference backend config
+INFERENCE_BACKEND = "torch" # "torch" (ultralytics / PyTorch) or "onnx" (ONNX Runtime on CPU)
+ONNX_DIR = MODEL_DIR / 'onnx' # exported ONNX models
+ONNX_QUANTIZE = False # use INT8 dynamically quantized weights with the onnx backend
+ONNX_INTRA_OP_THREADS = 0 # threads within an operator, 0 lets ONNX Runtime decide
+ONNX_INTER_OP_THREADS = 0 # threads across operators, 0 lets ONNX Runtime decide
+ONNX_PARITY_TOLERANCE = 0.01 # largest probability difference to the PyTorch backend accepted by backends.py --check-parity
+ONNX_PARITY_MIN_AGREEMENT = 0.99 # smallest top-1 agreement with the PyTorch backend accepted by backends.py --check-parity
+
+# Model registry config
+MODEL_CACHE_SIZE = 2 # max. number of models kept in memory per process
+PRELOAD_MODELS = False # load & warm up every model in MODELS_DICT at startup
+WARMUP_IMGSZ = 224 # size of the blank frame used to warm up a model
+
+# Model host config (models loaded by a separate long-running process, see modelhost.py)
+MODEL_HOST = False # classify through the model host instead of loading the models in the app process
+MODEL_HOST_ADDRESS = ("127.0.0.1", 6010) # local socket of the model host, or a socket file path on Linux
+MODEL_HOST_AUTOSTART = True # start the model host from the app if none is listening
+MODEL_HOST_CONNECT_TIMEOUT = 120 # seconds to wait for the model host to come up
+MODEL_HOST_AUTHKEY_FILE = ROOT / '.cache' / 'modelhost.key' # random key shared by the app and the model host, created on first use (0600)
+MODEL_NAMES_CACHE = ROOT / '.cache' / 'model_names.json' # class names of the weight files, read without loading them
+
+# Cascade config (beginner model first, advanced model only for the frames it is unsure about)
+CASCADE = False # classify with the cascade whenever the advanced model is selected
+CASCADE_GATE = 0.9 # beginner frames below this confidence are classified by the advanced model
+CASCADE_LABEL_MAP = { # beginner class -> advanced class, beginner classes without a counterpart are always escalated
+    'downdog': 'Adho Mukha Svanasana',
+    'plank': 'Phalakasana',
+    'tree': 'Vrksasana',
+    'warrior2': 'Virabhadrasana Two',
+}
+
+# Inference config
+BATCH_SIZE = 8 # number of frames classified per model call on stored videos
+PREALLOCATED_PREPROCESSING = False # decode & preprocess frames into reused buffers, see preprocess.py and backends.py --check-preprocessing
+
+# Segment config
+SCORE_HISTOGRAM_BINS = 0 # size of the per-segment confidence histogram, 0 disables it
+SMOOTHING = "none" # temporal smoothing of the detected poses: "none", "majority" or "hysteresis"
+SMOOTHING_WINDOW = 5 # smoothing window (majority) or min. number of frames of a pose change (hysteresis)
+TRACKER_COMPACT_FRAMES = 1800 # frames a session holds before its closed segments are folded (without smoothing), 0 keeps every frame
+
+# Frame sampling config
+DENSE_SAMPLING = "dense" # classify every frame
+STRIDE_SAMPLING = "stride" # classify every SAMPLING_STRIDE-th frame
+ADAPTIVE_SAMPLING = "adaptive" # sparse while the pose is stable, dense around pose changes
+SAMPLING_MODE = DENSE_SAMPLING # sampling used on stored videos
+SAMPLING_STRIDE = 10 # frame stride of the "stride" mode and max. gap of the "adaptive" mode
+SAMPLING_TOLERANCE_MS = 100 # max. error of segment boundaries in the "adaptive" mode
+
+# Chunked detection config (one stored video split into time ranges processed in parallel)
+CHUNKED_DETECTION = False # detect the poses of stored videos with a process pool
+CHUNK_WORKERS = None # worker processes, each with its own model copy, None for one per core
+CHUNK_SECONDS = 60 # max. length of a time range, shorter if needed to give every worker a range
+CHUNK_THREADS = 1 # inference threads per worker process
+
+# Detection cache config
+CACHE_ENABLED = True # reuse the detections of unchanged videos, weights & settings
+CACHE_DIR = ROOT / '.cache' / 'detections'
+CACHE_MAX_BYTES = 64 * 1024 * 1024 # on-disk size limit, least recently used entries are evicted
+CACHE_MEMORY_ENTRIES = 16 # entries kept in memory in front of the disk cache
+CACHE_DIGEST_ENTRIES = 256 # file digests kept in memory, least recently used ones are dropped
+
+# Batch analysis config
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mov", ".mkv", ".webm")
+
+# Live preview config
+PREVIEW_MAX_FPS = 15 # max. frame rate of the live preview, frames in between are dropped
+PREVIEW_WIDTH = 640 # frames are downscaled to this width (pixels) before they are sent to the browser
+PREVIEW_JPEG_QUALITY = 70 # JPEG quality of the preview frames
+PREVIEW_DISPLAY_WIDTH = 1280 # width of the preview in the page
+
+# Live progress config
+LIVE_PROGRESS = True # show the routine progress while a webcam session runs
+LIVE_PROGRESS_INTERVAL = 1.0 # min. seconds between two refreshes of the progress panel
+
+# Pipeline config (decode / inference / render on separate threads)
+LIVE_PIPELINE = True # use the pipeline for webcam sessions
+LIVE_BATCH_SIZE = 4 # max. number of queued webcam frames classified per model call
+PIPELINE_QUEUE_SIZE = 8 # capacity of the bounded queues between stages
+PIPELINE_DROP_POLICY = "drop" # "drop" oldest frames or "block" the decoder when inference falls behind
+
+# Inference scheduler config (micro-batches the frames of all live sessions)
+LIVE_SCHEDULER = True # classify webcam frames through the shared scheduler of the model
+SCHEDULER_MAX_BATCH = 16 # max. number of frames per forward pass
+SCHEDULER_MAX_WAIT_MS = 10 # max. time the first frame of a batch waits for frames of other sessions
+SCHEDULER_LATENCY_BUDGET_MS = 150 # batches are cut short so that frames are classified within this budget
+SCHEDULER_IDLE_SECONDS = 30 # the dispatcher thread of a model stops after this long without frames
+
+# HTTP API config (api.py)
+API_PORT = 8000
+API_WORKERS = 2 # jobs analyzed concurrently, forward passes of a shared model still run one at a time
+API_MAX_QUEUED_JOBS = 16 # further submissions are refused with 429 until jobs finish
+API_MAX_UPLOAD_BYTES = 200 * 1024 * 1024 # max. size of a video or frame stream upload
+API_MAX_FRAMES = 30 * 60 * 30 # max. number of frames per frame stream upload (30 min at 30 fps)
+API_JOB_TTL = 60 * 60 # seconds finished jobs are kept for status polling
+API_UPLOAD_DIR = ROOT / '.cache' / 'uploads'
+
+# Session history config (history.py)
+HISTORY_ENABLED = True # record every analyzed session for the history view
+HISTORY_DB = ROOT / 'data' / 'history.db' # SQLite database of the recorded sessions
+HISTORY_BATCH_SIZE = 100 # sessions written per transaction by bulk imports (batch.py --history)
+HISTORY_DAYS = 90 # days shown in the history view
+
+# Metrics config
+METRICS_ENABLED = False # record timing spans & counters (always on with DEBUG)
+METRICS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5) # latency histogram bounds (seconds)
+METRICS_FILE = None # write the Prometheus text exposition to this file after every detection, e.g. ROOT / 'metrics.prom'
+METRICS_PORT = None # serve the exposition on http://0.0.0.0:<port>/metrics
 
 DEBUG = False 
\ No newline at end of file
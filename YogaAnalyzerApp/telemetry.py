@@ -0,0 +1,261 @@
+"""
+Lightweight timing spans and counters for the hot paths.
+
+Every streamlit session records into its own Metrics (see session_metrics),
+which also feeds the process-wide totals in PROCESS. All live metrics can be
+exported in the Prometheus text format, either to settings.METRICS_FILE
+(e.g. for node_exporter's textfile collector) or over HTTP on
+settings.METRICS_PORT.
+
+When metrics are disabled every call goes to NULL_METRICS, whose span() and
+inc() do nothing, so instrumented code pays one attribute lookup and call.
+"""
+from bisect import bisect_left
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import threading
+import time
+import uuid
+import weakref
+
+import settings
+
+PREFIX = "yoga_analyzer"
+
+_NULL_SPAN = nullcontext()
+
+
+def enabled():
+    return settings.METRICS_ENABLED or settings.DEBUG
+
+
+class Histogram:
+    """
+    Cumulative latency histogram over the bucket bounds (seconds) of
+    settings.METRICS_BUCKETS.
+    """
+    __slots__ = ("bounds", "counts", "count", "total", "max")
+
+    def __init__(self, bounds=settings.METRICS_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1) # last bucket is +Inf
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        """
+        Upper bound of the bucket holding the q-quantile, capped at the
+        largest observation.
+        """
+        if not self.count:
+            return None
+        rank, seen = q * self.count, 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class _Span:
+    __slots__ = ("metrics", "stage", "start")
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.stage, time.perf_counter() - self.start)
+
+
+class Metrics:
+    """
+    Thread-safe counters and per-stage latency histograms. Observations are
+    forwarded to the parent Metrics as well, if any.
+    """
+    def __init__(self, name, parent=None):
+        self.name = name
+        self.parent = parent
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def span(self, stage):
+        """
+        Context manager timing its block as one observation of stage.
+        """
+        return _Span(self, stage)
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.observe(seconds)
+        if self.parent:
+            self.parent.observe(stage, seconds)
+
+    def inc(self, counter, value=1):
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+        if self.parent:
+            self.parent.inc(counter, value)
+
+    def snapshot(self):
+        """
+        Counters and per-stage latency summaries (ms) as plain dicts.
+        """
+        with self._lock:
+            stages = {}
+            for stage, histogram in self.histograms.items():
+                stages[stage] = {
+                    "count": histogram.count,
+                    "avg_ms": round(histogram.total * 1000 / histogram.count, 3),
+                    "p50_ms": round(histogram.quantile(0.5) * 1000, 3),
+                    "p99_ms": round(histogram.quantile(0.99) * 1000, 3),
+                    "max_ms": round(histogram.max * 1000, 3),
+                }
+            return {"counters": dict(self.counters), "stages": stages}
+
+    def render(self, families):
+        """
+        Add the Prometheus text format samples of this Metrics, labelled with
+        its name, to families ({metric: (type, sample lines)}).
+        """
+        label = f'session="{self.name}"'
+        with self._lock:
+            for counter, value in sorted(self.counters.items()):
+                metric = f"{PREFIX}_{counter}_total"
+                families.setdefault(metric, ("counter", []))[1].append(f"{metric}{{{label}}} {value}")
+
+            metric = f'{PREFIX}_stage_seconds'
+            for stage, histogram in sorted(self.histograms.items()):
+                lines = families.setdefault(metric, ("histogram", []))[1]
+                cumulative = 0
+                for bound, count in zip(histogram.bounds, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{{label},stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{{label},stage="{stage}",le="+Inf"}} {histogram.count}')
+                lines.append(f'{metric}_sum{{{label},stage="{stage}"}} {histogram.total:.6f}')
+                lines.append(f'{metric}_count{{{label},stage="{stage}"}} {histogram.count}')
+
+
+class _NullMetrics:
+    """
+    Stand-in used while metrics are disabled.
+    """
+    name = None
+
+    def span(self, stage):
+        return _NULL_SPAN
+
+    def observe(self, stage, seconds):
+        pass
+
+    def inc(self, counter, value=1):
+        pass
+
+    def snapshot(self):
+        return {"counters": {}, "stages": {}}
+
+
+NULL_METRICS = _NullMetrics()
+PROCESS = Metrics("process")
+
+# metrics of the sessions that are still alive
+_sessions = weakref.WeakValueDictionary()
+_server = None
+_server_lock = threading.Lock()
+
+
+def process_metrics():
+    """
+    Process-wide metrics (e.g. model loads), or NULL_METRICS if disabled.
+    """
+    return PROCESS if enabled() else NULL_METRICS
+
+def session_metrics(state):
+    """
+    Return the Metrics of a streamlit session, stored in its session state,
+    or NULL_METRICS if disabled.
+    """
+    if not enabled():
+        return NULL_METRICS
+
+    if "METRICS" not in state:
+        metrics = Metrics(uuid.uuid4().hex[:8], parent=PROCESS)
+        _sessions[metrics.name] = metrics
+        state["METRICS"] = metrics
+    return state["METRICS"]
+
+def render():
+    """
+    Prometheus text exposition of the process and all live sessions.
+    """
+    families = {}
+    for metrics in [PROCESS] + list(_sessions.values()):
+        metrics.render(families)
+
+    lines = []
+    for metric, (metric_type, samples) in families.items():
+        lines.append(f"# TYPE {metric} {metric_type}")
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+def write(path=None):
+    """
+    Atomically write the exposition to path (default settings.METRICS_FILE).
+    """
+    path = path or settings.METRICS_FILE
+    if not path or not enabled():
+        return
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as metrics_file:
+        metrics_file.write(render())
+    os.replace(tmp_path, path)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve(port=None):
+    """
+    Serve the exposition on http://0.0.0.0:<port>/metrics from a background
+    thread. Started once per process; does nothing without a port.
+    """
+    global _server
+    port = port or settings.METRICS_PORT
+    if not port or not enabled():
+        return
+
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer(("0.0.0.0", port), _Handler)
+            threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
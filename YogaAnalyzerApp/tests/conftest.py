@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# the app modules are imported flat, as in YogaAnalyzerApp/
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
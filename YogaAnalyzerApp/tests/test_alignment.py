@@ -0,0 +1,80 @@
+"""
+alignment.align matches every planned step with a detection of the same pose,
+in routine order, at the lowest total cost.
+"""
+from functools import lru_cache
+import random
+
+import pytest
+
+import alignment
+from alignment import MATCHED, MISSED, EXTRA
+
+
+def _cost(alignments, planned_durations, detected_durations):
+    cost = 0.0
+    for kind, i, j in alignments:
+        if kind == MATCHED:
+            longest = max(planned_durations[i], detected_durations[j], 1e-9)
+            cost += abs(planned_durations[i] - detected_durations[j]) / longest
+        else:
+            cost += alignment.MISS_COST if kind == MISSED else alignment.EXTRA_COST
+    return cost
+
+def _best_cost(planned_classes, planned_durations, detected_classes, detected_durations):
+    # the edit distance computed by plain recursion
+    @lru_cache(maxsize=None)
+    def best(i, j):
+        if i == len(planned_classes):
+            return (len(detected_classes) - j) * alignment.EXTRA_COST
+        if j == len(detected_classes):
+            return (len(planned_classes) - i) * alignment.MISS_COST
+        costs = [best(i + 1, j) + alignment.MISS_COST, best(i, j + 1) + alignment.EXTRA_COST]
+        if planned_classes[i] == detected_classes[j]:
+            costs.append(best(i + 1, j + 1) + _cost([(MATCHED, i, j)], planned_durations, detected_durations))
+        return min(costs)
+    return best(0, 0)
+
+def test_identical_sequences_are_matched():
+    poses = ["tree", "plank", "goddess"]
+
+    assert alignment.align(poses, [30, 60, 45], poses, [31, 58, 45]) == [(MATCHED, 0, 0), (MATCHED, 1, 1), (MATCHED, 2, 2)]
+
+def test_missed_step():
+    assert alignment.align(["tree", "plank", "goddess"], [30, 60, 45], ["tree", "goddess"], [30, 45]) == [
+        (MATCHED, 0, 0), (MISSED, 1, None), (MATCHED, 2, 1)]
+
+def test_extra_segment():
+    assert alignment.align(["tree"], [30], ["plank", "tree"], [20, 30]) == [(EXTRA, None, 0), (MATCHED, 0, 1)]
+
+def test_repeated_poses_are_matched_with_their_own_occurrence():
+    # the long tree detection belongs to the second, long tree step
+    assert alignment.align(["tree", "plank", "tree"], [30, 30, 90], ["tree", "tree"], [30, 90]) == [
+        (MATCHED, 0, 0), (MISSED, 1, None), (MATCHED, 2, 1)]
+
+def test_other_poses_are_never_matched():
+    assert alignment.align(["tree"], [30], ["plank"], [30]) in (
+        [(MISSED, 0, None), (EXTRA, None, 0)], [(EXTRA, None, 0), (MISSED, 0, None)])
+
+def test_empty_inputs():
+    assert alignment.align([], [], [], []) == []
+    assert alignment.align(["tree"], [30], [], []) == [(MISSED, 0, None)]
+    assert alignment.align([], [], ["tree"], [30]) == [(EXTRA, None, 0)]
+
+@pytest.mark.parametrize("seed", range(20))
+def test_alignment_has_the_lowest_cost(seed):
+    rng = random.Random(seed)
+    poses = ["tree", "plank", "goddess"]
+    planned_classes = [rng.choice(poses) for _ in range(rng.randrange(8))]
+    detected_classes = [rng.choice(poses) for _ in range(rng.randrange(8))]
+    planned_durations = [rng.uniform(5, 90) for _ in planned_classes]
+    detected_durations = [rng.uniform(1, 90) for _ in detected_classes]
+
+    alignments = alignment.align(planned_classes, planned_durations, detected_classes, detected_durations)
+
+    # every step and segment once, in order
+    assert [i for _, i, _ in alignments if i is not None] == list(range(len(planned_classes)))
+    assert [j for _, _, j in alignments if j is not None] == list(range(len(detected_classes)))
+    assert all(planned_classes[i] == detected_classes[j] for kind, i, j in alignments if kind == MATCHED)
+    assert _cost(alignments, planned_durations, detected_durations) == pytest.approx(
+        _best_cost(planned_classes, planned_durations, detected_classes, detected_durations))
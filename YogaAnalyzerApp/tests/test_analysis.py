@@ -0,0 +1,97 @@
+"""
+The basic analysis fulfils a planned pose when its detected duration (summed
+over its segments) is within duration_tolerance percent of the planned one.
+LiveAnalysis keeps the same results up to date segment by segment.
+"""
+from datetime import timedelta
+import random
+
+import pytest
+
+import analysis
+
+ROUTINE = {"Pose": ["tree", "plank", "tree"], "Minutes": [0, 1, 0], "Seconds": [30, 0, 30]}
+
+
+def _segments(*poses):
+    return [{"class": pose, "duration": timedelta(seconds=seconds), "avg_score": 0.9} for pose, seconds in poses]
+
+@pytest.mark.parametrize("seconds, fulfilled", [
+    (54, True), # -10%
+    (60, True),
+    (66, True), # +10%
+    (53.9, False),
+    (66.1, False),
+])
+def test_fulfilled_at_the_tolerance_boundary(seconds, fulfilled):
+    results = analysis.compute_basic(_segments(("plank", seconds)), ROUTINE, 10)
+
+    assert results["plank"]["detected"]
+    assert results["plank"]["planned_duration"] == 60
+    assert results["plank"]["detected_duration"] == pytest.approx(seconds)
+    assert results["plank"]["fulfilled"] is fulfilled
+
+def test_durations_are_summed_per_pose():
+    # the routine plans 2 x 30 s of tree, detected in two segments
+    results = analysis.compute_basic(_segments(("tree", 25), ("plank", 60), ("tree", 30)), ROUTINE, 10)
+
+    assert results["tree"]["planned_duration"] == 60
+    assert results["tree"]["detected_duration"] == 55
+    assert results["tree"]["fulfilled"]
+
+def test_missing_pose_is_not_fulfilled():
+    results = analysis.compute_basic(_segments(("plank", 60)), ROUTINE, 100)
+
+    assert not results["tree"]["detected"]
+    assert not results["tree"]["fulfilled"]
+    assert results["tree"]["detected_duration"] == 0
+
+def test_zero_tolerance_needs_the_exact_duration():
+    assert analysis.compute_basic(_segments(("plank", 60)), ROUTINE, 0)["plank"]["fulfilled"]
+    assert not analysis.compute_basic(_segments(("plank", 61)), ROUTINE, 0)["plank"]["fulfilled"]
+
+def test_live_progress_follows_the_routine():
+    live = analysis.LiveAnalysis(ROUTINE, 10)
+    assert (live.progress, live.next_pose) == (0, "tree")
+
+    live.add(_segments(("tree", 30))[0])
+    assert (live.progress, live.next_pose) == (0.25, "plank")
+    assert "tree" not in live.fulfilled # 30 of 60 s
+
+    live.add(_segments(("plank", 60))[0])
+    assert (live.progress, live.next_pose) == (0.75, "tree")
+    assert live.fulfilled == {"plank"}
+
+    live.add(_segments(("tree", 30))[0])
+    assert (live.progress, live.next_pose) == (1, None)
+    assert live.fulfilled == {"tree", "plank"}
+    assert live.counts == {"matched": 3, "missed": 0, "extra": 0}
+
+    # more plank than planned: the progress stays full, the pose is no longer fulfilled
+    live.add(_segments(("plank", 30))[0])
+    assert live.progress == 1
+    assert live.fulfilled == {"tree"}
+    assert live.counts == {"matched": 3, "missed": 0, "extra": 1}
+
+def test_live_skipped_step_is_missed():
+    live = analysis.LiveAnalysis(ROUTINE, 10)
+    for segment in _segments(("plank", 60), ("goddess", 20)):
+        live.add(segment)
+
+    assert live.counts == {"matched": 1, "missed": 1, "extra": 1}
+    assert live.next_pose == "tree"
+    assert live.to_dict()["poses"]["tree"]["score"] < 0
+
+@pytest.mark.parametrize("seed", range(10))
+def test_live_results_match_compute_basic(seed):
+    rng = random.Random(seed)
+    segments = _segments(*[(rng.choice(["tree", "plank", "goddess"]), rng.randrange(5, 40)) for _ in range(rng.randrange(1, 8))])
+
+    live = analysis.LiveAnalysis(ROUTINE, 20)
+    for segment in segments:
+        live.add(segment)
+    results = analysis.compute_basic(segments, ROUTINE, 20)
+
+    for pose, result in results.items():
+        assert live.detected.get(pose, 0) == result["detected_duration"]
+        assert (pose in live.fulfilled) is result["fulfilled"]
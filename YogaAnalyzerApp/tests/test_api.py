@@ -0,0 +1,117 @@
+"""
+Invalid job submissions are refused with a 400, too large ones with a 413
+and those that cannot be queued with a 429, leaving no uploaded files behind.
+"""
+import asyncio
+import json
+
+import pytest
+
+pytest.importorskip("aiohttp")
+from aiohttp import FormData
+from aiohttp.test_utils import TestClient, TestServer
+
+import settings
+import api
+
+ROUTINE = {"Pose": ["tree", "plank"], "Minutes": [1, 0], "Seconds": [0, 30]}
+
+
+@pytest.fixture(autouse=True)
+def upload_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "API_UPLOAD_DIR", tmp_path / "uploads")
+    return tmp_path / "uploads"
+
+def _form(routine=ROUTINE, videos=1, frames=0, **fields):
+    form = FormData()
+    for i in range(videos):
+        form.add_field("video", b"\0" * 1024, filename=f"session_{i}.mp4")
+    for i in range(frames):
+        form.add_field("frame", b"\0" * 256, filename=f"frame_{i}.jpg", content_type="image/jpeg")
+    # a content type keeps the form multipart without files
+    form.add_field("routine", routine if isinstance(routine, str) else json.dumps(routine), content_type="application/json")
+    for name, value in fields.items():
+        form.add_field(name, str(value))
+    return form
+
+def _submit(form):
+    async def submit():
+        async with TestClient(TestServer(api.create_app())) as client:
+            response = await client.post("/jobs", data=form)
+            return response.status, await response.json()
+    return asyncio.run(submit())
+
+def test_second_video_is_refused(upload_dir):
+    status, body = _submit(_form(videos=2))
+
+    assert status == 400
+    assert "one video" in body["error"]
+    assert not list(upload_dir.iterdir())
+
+@pytest.mark.parametrize("routine", [
+    "not json",
+    ["tree"],
+    {"Pose": ["tree"], "Minutes": [1]},
+    {"Pose": "tree", "Minutes": [1], "Seconds": [0]},
+    {"Pose": ["tree", "plank"], "Minutes": [1], "Seconds": [0, 30]},
+    {"Pose": [], "Minutes": [], "Seconds": []},
+    {"Pose": [3], "Minutes": [1], "Seconds": [0]},
+    {"Pose": ["tree"], "Minutes": ["1"], "Seconds": [0]},
+    {"Pose": ["tree"], "Minutes": [1], "Seconds": [-5]},
+])
+def test_malformed_routine_is_refused(upload_dir, routine):
+    status, body = _submit(_form(routine))
+
+    assert status == 400, body
+    assert not list(upload_dir.iterdir())
+
+def test_routine_check_accepts_the_planner_format():
+    assert api._routine_error(ROUTINE) is None
+    assert api._routine_error({"Pose": ["tree"], "Minutes": [0], "Seconds": [12.5]}) is None
+
+def test_too_large_video_is_refused(upload_dir, monkeypatch):
+    monkeypatch.setattr(settings, "API_MAX_UPLOAD_BYTES", 1000)
+    status, body = _submit(_form())
+
+    assert status == 413
+    assert not list(upload_dir.iterdir())
+
+@pytest.mark.parametrize("max_bytes, max_frames", [(1000, 10), (10**6, 2)])
+def test_too_large_frame_stream_is_refused(upload_dir, monkeypatch, max_bytes, max_frames):
+    monkeypatch.setattr(settings, "API_MAX_UPLOAD_BYTES", max_bytes)
+    monkeypatch.setattr(settings, "API_MAX_FRAMES", max_frames)
+    status, body = _submit(_form(videos=0, frames=5))
+
+    assert status == 413
+    assert not list(upload_dir.iterdir())
+
+def test_video_or_frames_are_required():
+    status, body = _submit(_form(videos=0))
+
+    assert status == 400
+    assert "video or frames" in body["error"]
+
+def test_form_must_be_multipart():
+    status, body = _submit({"routine": json.dumps(ROUTINE)})
+
+    assert status == 400
+    assert "multipart" in body["error"]
+
+def test_full_queue_is_refused(upload_dir, monkeypatch):
+    async def idle_worker(app):
+        await asyncio.Event().wait()
+
+    # the queued job is never picked up
+    monkeypatch.setattr(api, "_worker", idle_worker)
+    monkeypatch.setattr(settings, "API_MAX_QUEUED_JOBS", 1)
+
+    async def submit():
+        async with TestClient(TestServer(api.create_app())) as client:
+            responses = [await client.post("/jobs", data=_form()) for _ in range(2)]
+            return [response.status for response in responses], responses[1].headers.get("Retry-After")
+
+    statuses, retry_after = asyncio.run(submit())
+
+    assert statuses == [202, 429]
+    assert retry_after
+    assert len(list(upload_dir.iterdir())) == 1
@@ -0,0 +1,75 @@
+"""
+The detection cache returns copies of the stored segments, is keyed on the
+content of the video and weights and on the settings, and treats a corrupt
+entry as a miss.
+"""
+import os
+
+import pytest
+
+import settings
+import cache
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "CACHE_DIR", tmp_path / "detections")
+    cache._memory.clear()
+    yield tmp_path / "detections"
+    cache._memory.clear()
+
+def _segments(n=3):
+    return [{"class": "tree", "start_timestamp": i * 1000.0, "final_timestamp": (i + 1) * 1000.0} for i in range(n)]
+
+def test_get_returns_a_copy():
+    cache.put("key", _segments())
+
+    segments = cache.get("key")
+    segments[0]["class"] = "plank"
+
+    assert cache.get("key") == _segments()
+    cache._memory.clear() # from disk
+    assert cache.get("key") == _segments()
+    assert cache.get("other") is None
+
+def test_corrupt_entry_is_a_miss(cache_dir):
+    cache.put("key", _segments())
+    cache._memory.clear()
+    (cache_dir / "key.pkl").write_bytes(b"\x80\x05not a pickle")
+
+    assert cache.get("key") is None
+    assert not (cache_dir / "key.pkl").exists()
+
+def test_key_follows_the_content_and_settings(tmp_path):
+    video, model = tmp_path / "session.mp4", tmp_path / "model.pt"
+    video.write_bytes(b"frames")
+    model.write_bytes(b"weights")
+    key = cache.detection_key(video, model, model_thresh=0.5, stride=1)
+
+    assert cache.detection_key(video, model, model_thresh=0.5, stride=1) == key
+    assert cache.detection_key(video, model, model_thresh=0.6, stride=1) != key
+    assert cache.detection_key(video, model, model_thresh=0.5, stride=2) != key
+
+    # a new video of the same size saved under the same name, the digest of the old one must not be reused
+    video.write_bytes(b"FRAMES")
+    os.utime(video, ns=(0, 0))
+    assert cache.detection_key(video, model, model_thresh=0.5, stride=1) != key
+
+def test_least_recently_used_entries_are_evicted(cache_dir, monkeypatch):
+    cache.put("first", _segments(50))
+    entry_size = (cache_dir / "first.pkl").stat().st_size
+    monkeypatch.setattr(settings, "CACHE_MAX_BYTES", int(entry_size * 2.5))
+
+    cache.put("second", _segments(50))
+    os.utime(cache_dir / "first.pkl", (0, 0))
+    os.utime(cache_dir / "second.pkl", (1, 1))
+    cache.put("third", _segments(50))
+
+    assert sorted(path.stem for path in cache_dir.glob("*.pkl")) == ["second", "third"]
+
+def test_clear(cache_dir):
+    cache.put("key", _segments())
+    cache.clear()
+
+    assert cache.get("key") is None
+    assert not list(cache_dir.glob("*.pkl"))
@@ -0,0 +1,171 @@
+"""
+Several videos processed at once with a shared model, as concurrent
+streamlit sessions or API jobs do, must each get the result of their own
+sequential run. The shared scheduler of a model must not outlive its use.
+"""
+import random
+import threading
+
+import cv2
+import numpy as np
+import pytest
+
+import settings
+import backends
+import helper
+import scheduler
+from segments import SegmentTracker
+
+NAMES = {0: "downdog", 1: "goddess", 2: "plank", 3: "tree", 4: "warrior2"}
+
+
+class FakeModel:
+    """
+    Classifier whose frames are (class id, score) pairs.
+    """
+    names = NAMES
+
+    def __call__(self, frames, verbose=False):
+        if not isinstance(frames, list):
+            frames = [frames]
+        probs = np.zeros((len(frames), len(self.names)), dtype=np.float32)
+        for i, (cls, score) in enumerate(frames):
+            probs[i] = (1 - score) / (len(self.names) - 1)
+            probs[i, cls] = score
+        return backends.results(probs)
+
+
+class FakeCapture:
+    """
+    cv2.VideoCapture stand-in playing a list of frames at 30 fps.
+    """
+    def __init__(self, frames, fps=30.0):
+        self.frames = frames
+        self.fps = fps
+        self.position = 0
+        self.opened = True
+
+    def isOpened(self):
+        return self.opened
+
+    def read(self):
+        if self.position >= len(self.frames):
+            return False, None
+        self.position += 1
+        return True, self.frames[self.position - 1]
+
+    def grab(self):
+        return self.read()[0]
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_POS_MSEC:
+            return (self.position - 1) * 1000 / self.fps
+        return 0
+
+    def release(self):
+        self.opened = False
+
+
+def _frames(seed, n_frames=1500):
+    rng = random.Random(seed)
+    frames = []
+    while len(frames) < n_frames:
+        cls, length = rng.randrange(len(NAMES)), rng.randrange(10, 150)
+        frames += [(cls, rng.uniform(0.5, 1.0)) if rng.random() > 0.05 else (rng.randrange(len(NAMES)), rng.random())
+                   for _ in range(length)]
+    return frames[:n_frames]
+
+def _detect(model, frames, **kwargs):
+    tracker = SegmentTracker(0.5)
+    helper.while_video(FakeCapture(frames), model, tracker, **kwargs)
+    return [(s["class"], s["start_timestamp"], s["final_timestamp"], s["scores"].count, s["avg_score"])
+            for s in tracker.merged()]
+
+@pytest.mark.parametrize("kwargs", [
+    {"batch_size": 1},
+    {"batch_size": 8},
+    {"batch_size": 8, "sampling": settings.STRIDE_SAMPLING, "stride": 3},
+    {"batch_size": 4, "scheduled": True},
+])
+def test_parallel_videos_keep_their_own_results(kwargs):
+    model = FakeModel()
+    videos = [_frames(seed) for seed in range(6)]
+    expected = [_detect(model, frames, **kwargs) for frames in videos]
+
+    results = [None] * len(videos)
+    errors = []
+    start = threading.Barrier(len(videos))
+
+    def run(i):
+        try:
+            start.wait()
+            results[i] = _detect(model, videos[i], **kwargs)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(len(videos))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    scheduler.discard(model)
+
+    assert not errors
+    for i, result in enumerate(results):
+        assert result, f"video {i} has no segments"
+        assert result == expected[i], f"video {i} differs from its sequential run"
+
+def test_evicted_model_is_not_scheduled_again():
+    model = FakeModel()
+    frames = _frames(0, n_frames=300)
+    expected = _detect(model, frames, batch_size=4)
+
+    assert scheduler.get(model, helper._classify_batch) is not None
+    scheduler.discard(model)
+
+    # the sessions still holding the evicted model classify its frames directly
+    assert _detect(model, frames, batch_size=4, scheduled=True) == expected
+    assert scheduler.get(model, helper._classify_batch) is None
+    assert model not in scheduler._schedulers
+
+def test_idle_scheduler_stops():
+    model = FakeModel()
+    idle = scheduler.InferenceScheduler(model, helper._classify_batch, idle_seconds=0.05)
+    assert idle.classify([(1, 0.9)]) == [("goddess", pytest.approx(0.9))]
+
+    idle._thread.join(timeout=2)
+    assert idle.closed and not idle._thread.is_alive()
+    with pytest.raises(scheduler.SchedulerClosed):
+        idle.classify([(1, 0.9)])
+
+def test_hanging_forward_pass_times_out():
+    model = FakeModel()
+    release = threading.Event()
+
+    def hanging_classify(model, frames):
+        release.wait()
+        return helper._classify_batch(model, frames)
+
+    hanging = scheduler.InferenceScheduler(model, hanging_classify, latency_budget_ms=10)
+    try:
+        # the first frames hang in the forward pass, the second ones wait behind them and are withdrawn
+        with pytest.raises(scheduler.SchedulerTimeout):
+            hanging.classify([(1, 0.9)])
+        with pytest.raises(scheduler.SchedulerTimeout):
+            hanging.classify([(2, 0.9)])
+        assert not hanging._pending and hanging._pending_frames == 0
+    finally:
+        release.set()
+        hanging.close()
+
+def test_scheduled_frames_fall_back_to_direct_inference(monkeypatch):
+    model = FakeModel()
+    frames = _frames(1, n_frames=300)
+    expected = _detect(model, frames, batch_size=4)
+
+    def timeout(self, frames, timeout=None):
+        raise scheduler.SchedulerTimeout("frames not classified within 0 s")
+
+    monkeypatch.setattr(scheduler.InferenceScheduler, "classify", timeout)
+    assert _detect(model, frames, batch_size=4, scheduled=True) == expected
+    scheduler.discard(model)
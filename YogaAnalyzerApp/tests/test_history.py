@@ -0,0 +1,71 @@
+"""
+The rollups written with every batch of sessions must equal the ones
+rebuilt from the raw tables.
+"""
+import random
+import time
+
+import pytest
+
+from history import HistoryStore
+
+POSES = ["downdog", "goddess", "plank", "tree", "warrior2"]
+DAY = 24 * 60 * 60
+
+
+def _session(rng):
+    routine = {"Pose": rng.sample(POSES, 3), "Minutes": [rng.randrange(2) for _ in range(3)], "Seconds": [rng.randrange(60) for _ in range(3)]}
+    segments = [{"class": rng.choice(POSES), "duration": rng.uniform(1, 90), "avg_score": rng.uniform(0.5, 1.0)}
+                for _ in range(rng.randrange(6))]
+    overall_scores = {pose: rng.uniform(-50, 50) for pose in routine["Pose"]} if rng.random() < 0.5 else None
+    return segments, routine, overall_scores
+
+def _snapshot(store):
+    rows = store.daily_totals() + store.pose_trends() + store.most_missed(limit=len(POSES)) + store.confidence_trend()
+    return [{name: round(value, 6) if isinstance(value, float) else value for name, value in row.items()} for row in rows]
+
+def test_rollups_match_the_rebuilt_ones(tmp_path):
+    rng = random.Random(0)
+    now = time.time()
+
+    with HistoryStore(tmp_path / "history.db", batch_size=7) as store:
+        for _ in range(100):
+            segments, routine, overall_scores = _session(rng)
+            store.add(segments, routine, duration_tolerance=rng.choice([0, 10, 50]), overall_scores=overall_scores,
+                      started_at=now - rng.randrange(10) * DAY)
+        store.flush()
+        rollups = _snapshot(store)
+        assert len(store.daily_totals()) == 10
+        assert sum(day["sessions"] for day in store.daily_totals()) == 100
+
+        store.rebuild_rollups()
+        assert _snapshot(store) == rollups
+
+def test_sessions_are_written_in_batches(tmp_path):
+    rng = random.Random(1)
+    path = tmp_path / "history.db"
+
+    with HistoryStore(path, batch_size=3) as store:
+        for _ in range(4):
+            store.add(*_session(rng)[:2])
+        # a second connection only sees the full batch
+        with HistoryStore(path) as reader:
+            assert [day["sessions"] for day in reader.daily_totals()] == [3]
+
+    with HistoryStore(path) as reader:
+        assert [day["sessions"] for day in reader.daily_totals()] == [4]
+
+def test_missed_poses(tmp_path):
+    routine = {"Pose": ["tree", "plank"], "Minutes": [1, 1], "Seconds": [0, 0]}
+
+    with HistoryStore(tmp_path / "history.db") as store:
+        store.add([{"class": "tree", "duration": 60, "avg_score": 0.9}], routine)
+        store.add([{"class": "plank", "duration": 30, "avg_score": 0.8}], routine)
+        store.add([], routine)
+        store.flush()
+
+        missed = {row["pose"]: row for row in store.most_missed()}
+
+    assert (missed["tree"]["missed"], missed["tree"]["fulfilled"]) == (2, 1)
+    assert (missed["plank"]["missed"], missed["plank"]["fulfilled"]) == (2, 0)
+    assert missed["plank"]["missed_share"] == pytest.approx(2 / 3)
@@ -0,0 +1,156 @@
+"""
+With PREALLOCATED_PREPROCESSING the frames of a stored video are decoded and
+preprocessed into reused buffers; the detections must be the ones of the
+raw-frame path, which preprocesses every frame on its own.
+"""
+import contextlib
+import sys
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+import pytest
+
+import settings
+import backends
+import helper
+from preprocess import FrameBatch
+from segments import SegmentTracker
+
+NAMES = {0: "downdog", 1: "goddess", 2: "plank", 3: "tree", 4: "warrior2"}
+IMGSZ = 32
+
+
+class LinearClassifier(backends.OnnxClassifier):
+    """
+    OnnxClassifier with a fixed random linear layer instead of an ONNX
+    Runtime session. Raw frames are preprocessed one by one with
+    OnnxClassifier.preprocess.
+    """
+    def __init__(self, seed=0):
+        self.names = NAMES
+        self.imgsz = IMGSZ
+        self._frame_batch = None
+        self.weights = np.random.default_rng(seed).normal(size=(3 * IMGSZ * IMGSZ, len(NAMES))).astype(np.float32)
+
+    def probs(self, batch):
+        logits = batch.reshape(len(batch), -1) @ self.weights
+        exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+        return exp / exp.sum(axis=1, keepdims=True)
+
+    def __call__(self, frames, verbose=False):
+        return backends.results(self.probs(np.stack([self.preprocess(frame) for frame in frames])))
+
+
+class _Tensor:
+    """
+    The part of torch.Tensor used by backends.batch_classifier.
+    """
+    def __init__(self, value):
+        self.value = value
+
+    def to(self, device, dtype):
+        return self
+
+    def float(self):
+        return self
+
+    def softmax(self, dim):
+        exp = np.exp(self.value - self.value.max(axis=dim, keepdims=True))
+        return _Tensor(exp / exp.sum(axis=dim, keepdims=True))
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.value
+
+
+class _Network:
+    """
+    ClassificationModel stand-in, returning (softmax, logits) as the
+    Classify head of recent ultralytics versions does in eval mode.
+    """
+    def __init__(self, weights):
+        self.weights = weights
+        self.training = True
+
+    def eval(self):
+        self.training = False
+
+    def parameters(self):
+        return iter([SimpleNamespace(device="cpu", dtype="float32")])
+
+    def __call__(self, batch):
+        assert not self.training
+        logits = _Tensor(batch.value.reshape(len(batch.value), -1) @ self.weights)
+        return logits.softmax(1), logits
+
+
+class YOLO:
+    """
+    ultralytics.YOLO stand-in of a classifier whose raw frames are
+    preprocessed one by one.
+    """
+    task = "classify"
+    overrides = {"imgsz": IMGSZ}
+
+    def __init__(self):
+        self.reference = LinearClassifier()
+        self.names = self.reference.names
+        self.model = _Network(self.reference.weights)
+
+    def __call__(self, frames, verbose=False):
+        return self.reference(frames)
+
+
+def _video(path, n_frames=90, size=(160, 120)):
+    rng = np.random.default_rng(1)
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"MJPG"), 30, size)
+    for _ in range(n_frames):
+        # a random colour per frame, so that the frames get different classes
+        colour = rng.integers(0, 256, 3)
+        noise = rng.integers(-20, 21, (size[1], size[0], 3))
+        writer.write(np.clip(colour + noise, 0, 255).astype(np.uint8))
+    writer.release()
+    return path
+
+def _detect(video_path, model, **kwargs):
+    tracker = SegmentTracker(0)
+    helper.while_video(cv2.VideoCapture(str(video_path)), model, tracker, **kwargs)
+    return np.array(tracker.timestamps), np.array(tracker.class_ids), np.array(tracker.scores), tracker.class_names
+
+@pytest.mark.parametrize("shape", [(120, 160, 3), (160, 120, 3), (20, 30, 3), (32, 32, 3)])
+def test_frame_batch_matches_per_frame_transform(shape):
+    model = LinearClassifier()
+    frames = np.random.default_rng(2).integers(0, 256, (3,) + shape, dtype=np.uint8)
+
+    frame_batch = FrameBatch(IMGSZ, len(frames))
+    for frame in frames:
+        frame_batch.add(frame)
+
+    np.testing.assert_array_equal(frame_batch.batch, np.stack([model.preprocess(frame) for frame in frames]))
+
+@pytest.mark.parametrize("model_type", [LinearClassifier, YOLO])
+@pytest.mark.parametrize("kwargs", [
+    {"batch_size": 1},
+    {"batch_size": 8},
+    {"batch_size": 8, "sampling": settings.STRIDE_SAMPLING, "stride": 3},
+])
+def test_preallocated_detection_matches_raw_frames(tmp_path, monkeypatch, model_type, kwargs):
+    video_path = _video(tmp_path / "session.avi")
+    model = model_type()
+    # the ultralytics path only needs torch to wrap and unwrap the batch
+    monkeypatch.setitem(sys.modules, "torch", SimpleNamespace(from_numpy=_Tensor, inference_mode=contextlib.nullcontext))
+    assert backends.batch_classifier(model) is not None
+
+    monkeypatch.setattr(settings, "PREALLOCATED_PREPROCESSING", False)
+    timestamps, class_ids, scores, class_names = _detect(video_path, model, **kwargs)
+    monkeypatch.setattr(settings, "PREALLOCATED_PREPROCESSING", True)
+    preallocated = _detect(video_path, model, **kwargs)
+
+    assert len(timestamps) == 90 // kwargs.get("stride", 1)
+    assert len(set(class_ids)) > 1
+    np.testing.assert_array_equal(preallocated[0], timestamps)
+    assert [preallocated[3][i] for i in preallocated[1]] == [class_names[i] for i in class_ids]
+    np.testing.assert_allclose(preallocated[2], scores, rtol=0, atol=1e-6)
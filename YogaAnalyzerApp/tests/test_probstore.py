@@ -0,0 +1,57 @@
+"""
+Re-segmenting a recorded probability store must give the segments of a
+SegmentTracker fed with the same frames, including how majority smoothing
+breaks ties.
+"""
+import numpy as np
+import pytest
+
+import segmentation
+import probstore
+from segments import SegmentTracker
+
+NAMES = ["downdog", "goddess", "plank", "tree", "warrior2"]
+
+
+def _probs(seed, n_frames=3000):
+    # runs of 2 to 40 frames, the first ones of the poses with the highest class index
+    rng = np.random.default_rng(seed)
+    classes = [4, 3]
+    while len(classes) < n_frames:
+        classes += [int(rng.integers(len(NAMES)))] * int(rng.integers(2, 40))
+    classes = np.array(classes[:n_frames])
+    # frequent one-frame flicker, so that the smoothing windows often tie
+    flicker = rng.random(n_frames) < 0.3
+    classes[flicker] = rng.integers(len(NAMES), size=flicker.sum())
+
+    probs = rng.uniform(0, 0.1, (n_frames, len(NAMES))).astype(np.float32)
+    probs[np.arange(n_frames), classes] = rng.uniform(0.3, 1.0, n_frames)
+    return probs
+
+def _summary(segments):
+    return [(s["class"], s["start_timestamp"], s["final_timestamp"], s["scores"].count, s["avg_score"]) for s in segments]
+
+@pytest.mark.parametrize("smoothing, window", [
+    (segmentation.NO_SMOOTHING, 1),
+    (segmentation.MAJORITY_SMOOTHING, 4),
+    (segmentation.MAJORITY_SMOOTHING, 5),
+    (segmentation.HYSTERESIS_SMOOTHING, 3),
+])
+@pytest.mark.parametrize("seed", range(3))
+def test_resegment_matches_tracker(tmp_path, smoothing, window, seed):
+    probs = _probs(seed)
+    timestamps = np.arange(len(probs)) * 1000 / 30
+    path = tmp_path / "session.probs"
+
+    tracker = SegmentTracker(0.5, min_duration=0.2, smoothing=smoothing, window=window)
+    with probstore.ProbabilityRecorder(path, NAMES) as recorder:
+        recorder.append(timestamps, probs)
+        for timestamp, frame_probs in zip(timestamps, probs):
+            cls = int(frame_probs.argmax())
+            tracker.update(NAMES[cls], float(frame_probs[cls]), float(timestamp))
+        recorder.final_timestamp = float(timestamps[-1])
+    tracker.finalize(float(timestamps[-1]))
+
+    expected = tracker.merged()
+    assert len(expected) > 20
+    assert _summary(probstore.resegment(path, 0.5, min_duration_ms=200, smoothing=smoothing, window=window)) == _summary(expected)
@@ -0,0 +1,88 @@
+"""
+segmentation.segment drops the runs shorter than min_duration (but never the
+last one), merges the neighbouring runs of the same pose and smooths the
+flicker between poses before segmenting.
+"""
+import numpy as np
+import pytest
+
+import segmentation
+
+NAMES = ["plank", "tree"]
+PLANK, TREE = 0, 1
+
+
+def _frames(*runs, fps=10):
+    # (class id, n frames) runs, at fps frames per second
+    class_ids = np.concatenate([[cls] * n for cls, n in runs])
+    timestamps = np.arange(len(class_ids)) * 1000 / fps
+    return timestamps, class_ids, np.full(len(class_ids), 0.9)
+
+def _segment(frames, **kwargs):
+    kwargs.setdefault("min_duration_ms", 1000)
+    return [(s["class"], s["start_timestamp"], s["final_timestamp"]) for s in segmentation.segment(*frames, NAMES, 0.5, **kwargs)]
+
+def test_short_run_is_dropped_and_its_neighbours_merged():
+    frames = _frames((PLANK, 20), (TREE, 5), (PLANK, 20))
+
+    assert _segment(frames) == [("plank", 0, 4400)]
+    assert _segment(frames, min_duration_ms=0) == [("plank", 0, 2000), ("tree", 2000, 2500), ("plank", 2500, 4400)]
+
+def test_last_run_is_kept_even_if_short():
+    assert _segment(_frames((PLANK, 20), (TREE, 2))) == [("plank", 0, 2000), ("tree", 2000, 2100)]
+
+def test_drop_last_removes_the_last_segment():
+    frames = _frames((PLANK, 20), (TREE, 20))
+
+    assert _segment(frames, drop_last=True) == [("plank", 0, 2000)]
+    assert _segment(_frames((PLANK, 20)), drop_last=True) == []
+
+def test_final_timestamp_closes_the_last_segment():
+    assert _segment(_frames((PLANK, 20), (TREE, 20)), final_timestamp=5000) == [("plank", 0, 2000), ("tree", 2000, 5000)]
+
+def test_frames_below_the_threshold_are_ignored():
+    timestamps, class_ids, scores = _frames((PLANK, 20), (TREE, 20), (PLANK, 20))
+    scores[20:40] = 0.2
+
+    segments = segmentation.segment(timestamps, class_ids, scores, NAMES, 0.5, min_duration_ms=1000)
+
+    assert [s["class"] for s in segments] == ["plank"]
+    assert segments[0]["scores"].count == 40
+    assert segmentation.segment(timestamps, class_ids, np.zeros(len(scores)), NAMES, 0.5) == []
+
+def test_score_statistics_of_a_segment():
+    timestamps, class_ids, _ = _frames((PLANK, 30))
+    scores = np.random.default_rng(0).uniform(0.5, 1.0, len(class_ids))
+
+    stats = segmentation.segment(timestamps, class_ids, scores, NAMES, 0.5)[0]["scores"]
+
+    assert stats.count == 30
+    assert stats.mean == pytest.approx(scores.mean())
+    assert (stats.min, stats.max) == (scores.min(), scores.max())
+    assert stats.variance == pytest.approx(scores.var())
+
+def test_majority_smoothing_removes_one_frame_flicker():
+    frames = _frames((PLANK, 20), (TREE, 1), (PLANK, 20), (TREE, 1), (PLANK, 1), (TREE, 20))
+
+    # the lone plank frame between the tree frames is outvoted too
+    assert _segment(frames, min_duration_ms=0, smoothing=segmentation.MAJORITY_SMOOTHING, window=3) == [
+        ("plank", 0, 4200), ("tree", 4200, 6200)]
+
+def test_majority_ties_keep_the_lower_class_id():
+    # windows of 5 frames, clipped to 4 at the edges
+    smoothed = segmentation.smooth(np.array([TREE, TREE, PLANK, PLANK]), segmentation.MAJORITY_SMOOTHING, 4)
+
+    assert smoothed.tolist() == [TREE, PLANK, PLANK, PLANK]
+
+def test_hysteresis_absorbs_runs_shorter_than_the_window():
+    class_ids = np.array([PLANK] * 4 + [TREE] * 2 + [PLANK] * 4 + [TREE] * 3)
+
+    smoothed = segmentation.smooth(class_ids, segmentation.HYSTERESIS_SMOOTHING, 3)
+
+    assert smoothed.tolist() == [PLANK] * 10 + [TREE] * 3
+    # the first run is kept, there is nothing before it
+    assert segmentation.smooth(np.array([TREE, PLANK, PLANK, PLANK]), segmentation.HYSTERESIS_SMOOTHING, 3).tolist() == [TREE, PLANK, PLANK, PLANK]
+
+def test_unknown_smoothing_method():
+    with pytest.raises(ValueError):
+        segmentation.smooth(np.array([PLANK, TREE]), "median", 3)
@@ -0,0 +1,92 @@
+"""
+A SegmentTracker folds its closed segments and drops their frames; the
+segments it returns must be the ones of a tracker keeping every frame.
+"""
+import random
+
+import pytest
+
+import segmentation
+from segments import SegmentTracker
+
+POSES = ["downdog", "goddess", "plank", "tree", "warrior2"]
+
+
+def _frames(seed, n_frames=12000, fps=30):
+    # runs of 0.1 to 5 seconds, with flicker and frames below the threshold
+    rng = random.Random(seed)
+    frames = []
+    while len(frames) < n_frames:
+        pose, length = rng.choice(POSES), rng.randrange(3, 150)
+        for _ in range(length):
+            if rng.random() < 0.05:
+                frames.append((rng.choice(POSES), rng.random()))
+            else:
+                frames.append((pose, rng.uniform(0.3, 1.0)))
+    return [(pose, score, i * 1000 / fps) for i, (pose, score) in enumerate(frames[:n_frames])]
+
+def _summary(segments):
+    return [(s["class"], s["start_timestamp"], s["final_timestamp"], s["duration"], s["scores"].count,
+             s["avg_score"], s["scores"].min, s["scores"].max, s["scores"].variance) for s in segments]
+
+def _track(frames, live=False, progress_every=None, **kwargs):
+    tracker = SegmentTracker(0.5, **kwargs)
+    closed, max_held = [], 0
+    for i, frame in enumerate(frames):
+        tracker.update(*frame)
+        max_held = max(max_held, len(tracker))
+        if progress_every and i % progress_every == 0:
+            closed += tracker.closed_segments()
+    tracker.finalize(frames[-1][2] + 1000 / 30)
+    return tracker.merged(live=live), closed, max_held
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("live", [False, True])
+def test_compacted_tracker_matches_full_tracker(seed, live):
+    frames = _frames(seed)
+    expected, _, full_held = _track(frames, live, compact_frames=0)
+    merged, _, max_held = _track(frames, live, compact_frames=300)
+
+    assert _summary(merged) == _summary(expected)
+    # the frames of the open segment and of up to compact_frames more
+    assert max_held < full_held / 4
+
+def test_closed_segments_are_a_prefix_of_merged():
+    frames = _frames(7)
+    merged, closed, _ = _track(frames, progress_every=45, compact_frames=300)
+
+    assert len(closed) > 10
+    assert _summary(closed) == _summary(merged[:len(closed)])
+
+def test_smoothed_tracker_keeps_every_frame():
+    frames = _frames(3, n_frames=3000)
+    tracker = SegmentTracker(0.5, smoothing=segmentation.MAJORITY_SMOOTHING, window=5, compact_frames=300)
+    for frame in frames:
+        tracker.update(*frame)
+
+    assert len(tracker) == sum(score >= 0.5 for _, score, _ in frames)
+
+def test_extend_needs_every_frame():
+    folded = SegmentTracker(0.5, compact_frames=300)
+    for frame in _frames(1):
+        folded.update(*frame)
+
+    with pytest.raises(ValueError):
+        SegmentTracker(0.5).extend(folded)
+
+@pytest.mark.parametrize("chunks", [2, 5])
+def test_extended_chunks_match_one_tracker(chunks):
+    frames = _frames(4, n_frames=6000)
+    expected, _, _ = _track(frames, compact_frames=0)
+
+    # every chunk tracker sees the poses in its own order, so their class ids differ
+    tracker = SegmentTracker(0.5)
+    bounds = [len(frames) * i // chunks for i in range(chunks + 1)]
+    for start, stop in zip(bounds, bounds[1:]):
+        chunk_tracker = SegmentTracker(0.5, compact_frames=0)
+        for frame in frames[start:stop]:
+            chunk_tracker.update(*frame)
+        tracker.extend(chunk_tracker)
+    tracker.finalize(frames[-1][2] + 1000 / 30)
+
+    assert _summary(tracker.merged()) == _summary(expected)